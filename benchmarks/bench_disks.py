@@ -0,0 +1,133 @@
+"""Micro-benchmark: DISKREAD/DISKWRITE/DISKBUSY rows of a frame
+encoded as a point per disk and mode (default) vs a multi-field point
+per disk (NMON_DISK_FIELDS), and, if numpy is installed, vectorized
+parsing of the rows (one frame or a batch of frames at once)
+
+usage: python -m benchmarks.bench_disks [--disks 16 256 1024]
+"""
+import argparse
+import datetime
+import logging
+import timeit
+from typing import Callable, Dict, List
+
+from src.encoder import LineBuffer, series_key
+from src.scraper import NmonHeaderParser, NmonParser
+from src.synthetic import synthetic_nmon
+
+DISK_SECTIONS = ("DISKBUSY", "DISKREAD", "DISKWRITE")
+START = datetime.datetime(2023, 1, 31)
+
+
+def disk_frames(disks: int, frames: int) -> List[str]:
+    return [
+        line
+        for line in synthetic_nmon(
+            cpus=1, disks=disks, intervals=frames, start=START
+        )
+        if line.startswith(("ZZZZ",) + DISK_SECTIONS)
+    ]
+
+
+def parser_variants(lines: List[str]) -> Dict[str, Callable[[], bytes]]:
+    variants = {}
+    for layout, disk_fields in (("mode", False), ("fields", True)):
+        parser = NmonParser(timestamp_prefix="ZZZZ")
+        header_parser = NmonHeaderParser(
+            parser, "bench", "0", disk_fields=disk_fields
+        )
+        frame = list(lines)
+        while not frame[0].startswith("ZZZZ"):
+            header_parser.parse(frame.pop(0))
+        # a single frame
+        frame = frame[: 1 + len(DISK_SECTIONS)]
+
+        def collectors(parser=parser, frame=frame) -> bytes:
+            return "\n".join(
+                entry for line in frame for entry in parser.parse(line)
+            ).encode()
+
+        def encoder(parser=parser, frame=frame) -> bytes:
+            buffer = LineBuffer()
+            for line in frame:
+                samples = parser.collect(line)
+                if samples is not None:
+                    buffer.add(samples)
+            return buffer.take()
+
+        variants[f"{layout}-collectors"] = collectors
+        variants[f"{layout}-encoder"] = encoder
+    return variants
+
+
+def numpy_variants(
+    lines: List[str], disks: int, batch: int
+) -> Dict[str, Callable[[], bytes]]:
+    try:
+        import numpy as np
+    except ImportError:
+        logging.warning("numpy is not installed, vectorized path is skipped")
+        return {}
+
+    header = {
+        line.partition(",")[0]: line
+        for line in lines
+        if line.startswith(DISK_SECTIONS) and ",T0" not in line
+    }
+    names = header["DISKREAD"].split(",")[2:]
+    keys = [series_key("disk-bench", run="0", disk=name) for name in names]
+    rows = [
+        line.split(",", 2)[2]
+        for line in lines
+        if line.startswith(DISK_SECTIONS) and ",T0" in line
+    ]
+    ns = 1675123200 * 10**9
+
+    def encode(frames: List[str]) -> bytes:
+        # (frames, busy/read/write, disks) in one pass
+        values = np.fromstring(",".join(frames), sep=",").reshape(
+            -1, len(DISK_SECTIONS), disks
+        )
+        entries = []
+        for busy, read, write in values.tolist():
+            entries += [
+                f"{key} read={r},write={w},busy={b} {ns}"
+                for key, r, w, b in zip(keys, read, write, busy)
+            ]
+        return "\n".join(entries).encode()
+
+    def single() -> bytes:
+        return encode(rows[: len(DISK_SECTIONS)])
+
+    def batched() -> bytes:
+        return encode(rows[: len(DISK_SECTIONS) * batch])
+
+    return {"numpy-frame": single, f"numpy-{batch}-frames": batched}
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument("--disks", type=int, nargs="+", default=[16, 256, 1024])
+    args.add_argument("--batch", type=int, default=64)
+    args.add_argument("--seconds", type=float, default=1.0)
+    args = args.parse_args()
+    logging.getLogger("nmon-parser").setLevel(logging.INFO)
+
+    for disks in args.disks:
+        lines = disk_frames(disks, args.batch)
+        variants = parser_variants(lines)
+        variants.update(numpy_variants(lines, disks, args.batch))
+        print(f"{disks} disks")
+        for name, fn in variants.items():
+            frames = args.batch if name.endswith("-frames") else 1
+            repeat = max(1, int(args.seconds / timeit.timeit(fn, number=1)))
+            elapsed = timeit.timeit(fn, number=repeat) / repeat / frames
+            entries = fn().count(b"\n") + 1
+            print(
+                f"{name:>18}: {elapsed * 1e6:9.1f} us/frame, "
+                f"{entries // frames:6d} lines/frame"
+            )
+
+
+if __name__ == "__main__":
+    main()
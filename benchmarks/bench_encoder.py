@@ -0,0 +1,62 @@
+"""Micro-benchmark: string collectors vs bytes encoder
+on a single frame of a host with many disks. Collectors render a line
+protocol string per entry which are joined and encoded (as the writer
+used to), the encoder formats frame records straight into a LineBuffer
+(as BatchingWriter does)
+
+usage: python -m benchmarks.bench_encoder [--disks 200] [--repeat 2000]
+"""
+import argparse
+import logging
+import timeit
+from main import prefix_filter
+from src.encoder import LineBuffer
+from src.scraper import NmonHeaderParser, NmonParser
+from src.synthetic import synthetic_nmon
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument("--disks", type=int, default=200)
+    args.add_argument("--repeat", type=int, default=2000)
+    args = args.parse_args()
+    logging.getLogger("nmon-parser").setLevel(logging.INFO)
+
+    # a single frame of a host with 16 cores
+    lines = [
+        line
+        for line in synthetic_nmon(cpus=16, disks=args.disks, intervals=1)
+        if prefix_filter(line)
+    ]
+    parser = NmonParser(timestamp_prefix="ZZZZ")
+    header_parser = NmonHeaderParser(parser, "bench", "0")
+    while not lines[0].startswith("ZZZZ"):
+        header_parser.parse(lines.pop(0))
+
+    def collectors() -> bytes:
+        return "\n".join(
+            entry for line in lines for entry in parser.parse(line)
+        ).encode()
+
+    buffer = LineBuffer()
+
+    def encoder() -> bytes:
+        for line in lines:
+            samples = parser.collect(line)
+            if samples is not None:
+                buffer.add(samples)
+        return buffer.take()
+
+    assert collectors() == encoder()
+    entries = len(collectors().split(b"\n"))
+    for name, fn in (("collectors", collectors), ("encoder", encoder)):
+        elapsed = timeit.timeit(fn, number=args.repeat)
+        per_frame = elapsed / args.repeat
+        print(
+            f"{name:>10}: {per_frame * 1e6:8.1f} us/frame, "
+            f"{entries / per_frame:12.0f} lines/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
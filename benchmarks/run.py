@@ -0,0 +1,210 @@
+"""Throughput benchmark suite on synthetic nmon output.
+
+Reports parse and encode throughput, per-interval parse latency,
+end-to-end throughput of the parsing pipeline with the batching writer
+(against a local stub write function) and peak memory. Results are
+saved as JSON; if a baseline is given, regressions are reported
+
+usage: python -m benchmarks.run [--cpus 64] [--disks 200]
+    [--intervals 200] [--output results.json] [--baseline old.json]
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import reactivex as rx
+
+from main import prefix_filter
+from src.encoder import LineBuffer
+from src.pipeline import nmon_parsing_pipeline
+from src.scraper import NmonHeaderParser, NmonParser
+from src.synthetic import synthetic_nmon
+from src.writer import BatchingWriter
+
+# metrics where lower values are better
+LOWER_IS_BETTER = ("latency", "peak")
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def prepared_parser(header: List[str]) -> NmonParser:
+    parser = NmonParser(timestamp_prefix="ZZZZ")
+    header_parser = NmonHeaderParser(parser, "bench", "0")
+    for line in header:
+        header_parser.parse(line)
+    return parser
+
+
+def split_frames(lines: List[str]):
+    header, frames = [], []
+    for line in lines:
+        if line.startswith("ZZZZ"):
+            frames.append([line])
+        elif frames:
+            frames[-1].append(line)
+        else:
+            header.append(line)
+    return header, frames
+
+
+def bench_frames(
+    frames: List[List[str]], run: Callable[[List[str]], int]
+) -> Dict[str, float]:
+    latencies, entries = [], 0
+    started = time.perf_counter()
+    for frame in frames:
+        frame_started = time.perf_counter()
+        entries += run(frame)
+        latencies.append(time.perf_counter() - frame_started)
+    elapsed = time.perf_counter() - started
+    lines = sum(map(len, frames))
+    return {
+        "lines_per_sec": lines / elapsed,
+        "entries_per_sec": entries / elapsed,
+        "interval_latency_p50_ms": percentile(latencies, 0.5) * 1e3,
+        "interval_latency_p99_ms": percentile(latencies, 0.99) * 1e3,
+    }
+
+
+def bench_parse(header, frames) -> Dict[str, float]:
+    parser = prepared_parser(header)
+
+    def run(frame: List[str]) -> int:
+        # samples are counted, not rendered
+        entries = 0
+        for line in frame:
+            samples = parser.collect(line)
+            if samples is not None:
+                entries += len(samples.series)
+        return entries
+
+    return bench_frames(frames, run)
+
+
+def bench_encode(header, frames) -> Dict[str, float]:
+    # samples are encoded into a payload per frame,
+    # the way BatchingWriter builds its write requests
+    parser = prepared_parser(header)
+    buffer = LineBuffer()
+    encoded = 0
+
+    def run(frame: List[str]) -> int:
+        nonlocal encoded
+        for line in frame:
+            samples = parser.collect(line)
+            if samples is not None:
+                buffer.add(samples)
+        entries = len(buffer)
+        encoded += len(buffer.take())
+        return entries
+
+    started = time.perf_counter()
+    results = bench_frames(frames, run)
+    results["bytes_per_sec"] = encoded / (time.perf_counter() - started)
+    return results
+
+
+def bench_end_to_end(lines: List[str]) -> Dict[str, float]:
+    written = {"requests": 0, "bytes": 0}
+
+    def stub_write(payload: bytes):
+        written["requests"] += 1
+        written["bytes"] += len(payload)
+
+    def run():
+        with BatchingWriter(stub_write, flush_interval=60) as writer:
+            nmon_parsing_pipeline(rx.from_iterable(lines), "0").subscribe(
+                writer.write
+            )
+
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    requests, sent = written["requests"], written["bytes"]
+
+    # tracing slows things down, thus memory is measured separately
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "lines_per_sec": len(lines) / elapsed,
+        "requests": requests,
+        "bytes_per_sec": sent / elapsed,
+        "peak_memory_mb": peak / 2**20,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for suite, metrics in results["suites"].items():
+        for name, value in metrics.items():
+            old = baseline.get("suites", {}).get(suite, {}).get(name)
+            if not old or name == "requests":
+                continue
+            change = (value - old) / old
+            if any(marker in name for marker in LOWER_IS_BETTER):
+                change = -change
+            if change < -threshold:
+                regressions.append(
+                    f"{suite}.{name}: {old:.2f} -> {value:.2f} "
+                    f"({change * 100:+.1f}%)"
+                )
+    return regressions
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__)
+    args.add_argument("--cpus", type=int, default=64)
+    args.add_argument("--disks", type=int, default=200)
+    args.add_argument("--intervals", type=int, default=200)
+    args.add_argument("--output", default=None)
+    args.add_argument("--baseline", default=None)
+    args.add_argument("--threshold", type=float, default=0.1)
+    args = args.parse_args()
+    logging.getLogger("nmon-parser").setLevel(logging.INFO)
+
+    lines = [
+        line
+        for line in synthetic_nmon(args.cpus, args.disks, args.intervals)
+        if prefix_filter(line)
+    ]
+    header, frames = split_frames(lines)
+    results = {
+        "params": {
+            "cpus": args.cpus,
+            "disks": args.disks,
+            "intervals": args.intervals,
+        },
+        "python": platform.python_version(),
+        "time": time.time(),
+        "suites": {
+            "parse": bench_parse(header, frames),
+            "encode": bench_encode(header, frames),
+            "end_to_end": bench_end_to_end(lines),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,77 @@
 # required by pytest to add cwd to python path
 # common fixtures can be placed here
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+import pytest
+
+from src.writer import decompress
+
+
+class StubInfluxServer(ThreadingHTTPServer):
+    """Minimal stand-in for influxdb write endpoint:
+    records bodies of all write requests it recieves
+    (compressed ones are decompressed, their sizes are kept).
+    The first `fail_requests` writes are rejected with 503
+    """
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), StubInfluxHandler)
+        self.requests: List[bytes] = []
+        # (content encoding, body size as sent)
+        self.received: List[Tuple[str, int]] = []
+        self.failed = 0
+        self.fail_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def lines(self) -> List[str]:
+        with self.lock:
+            return [
+                line
+                for body in self.requests
+                for line in body.decode().splitlines()
+            ]
+
+
+class StubInfluxHandler(BaseHTTPRequestHandler):
+    server: StubInfluxServer
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        encoding = self.headers.get("Content-Encoding", "identity")
+        if self.path.startswith("/api/v2/write"):
+            with self.server.lock:
+                if self.server.failed < self.server.fail_requests:
+                    self.server.failed += 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                self.server.received.append((encoding, len(body)))
+                if encoding != "identity":
+                    body = decompress(encoding, body)
+                self.server.requests.append(body)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *_):
+        pass
+
+
+@pytest.fixture
+def influx_stub():
+    server = StubInfluxServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
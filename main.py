@@ -1,67 +1,609 @@
+import argparse
+import asyncio
+import json
 import os
+import shlex
+import socket
+import threading
+from contextlib import ExitStack
 from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
 
 import reactivex as rx
 import reactivex.operators as ops
 
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient, WriteOptions
+from influxdb_client import InfluxDBClient
+from reactivex.observable import Observable
 
 from src import logger_factory
-from src.client import stream_subprocess_stdout
-from src.pipeline import nmon_parsing_pipeline
+from src.aio import influx_async_write_function, run_async_pipeline
+from src.backfill import ingest_files
+from src.cardinality import SeriesFilters, deadband, filters_from_patterns
+from src.checkpoint import CheckpointStore
+from src.client import bounded_buffer, stream_subprocess_stdout
+from src.follow import FileFollower
+from src.launcher import NmonLauncher
+from src.live import LiveServer, LiveStore
+from src.multihost import MultiHostCollector, NmonSource
+from src.pipeline import line_dispatcher, nmon_parsing_pipeline
+from src.registry import Entry, SeriesRegistry
+from src.replay import Recording, run_load
+from src.schema import SchemaCache, cached_schema
+from src.sinks import FanOut, ParquetSink, RotatingFileSink
+from src.spool import Spool, SpoolDrainer
+from src.stats import StatsReporter, stats
+from src.synthetic import synthetic_nmon
+from src.writer import (
+    BatchingWriter,
+    WriteFunction,
+    influx_http_write_function,
+)
+
+
+# skip odd lines
+# this list can be modified, however, e.g.
+# if preamble data should be parsed (like os
+# version/configuration)
+REJECTED_PREFIXES = ("AAA", "BBBP")
 
 
 def prefix_filter(line: str) -> bool:
-    # skip odd lines
-    # this list can be modified, however, e.g.
-    # if preamble data should be parsed (like os
-    # version/configuration)
-    return not line.startswith(
-        (
-            "AAA",
-            "BBBP",
-            "DISKBSIZE",
-            "JFSFILE",
-            "DISKXFER",
-            "NET",
-            "VM",
-            "PROC",
+    return not line.startswith(REJECTED_PREFIXES)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="collects nmon metrics into influxdb"
+    )
+    parser.add_argument(
+        "--file",
+        dest="files",
+        nargs="+",
+        metavar="PATH",
+        help=(
+            "ingest archived .nmon files (or directories of them) "
+            "instead of running nmon"
+        ),
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="size of process pool for file ingestion (default: cpu count)",
+    )
+    parser.add_argument(
+        "--run-id",
+        default=None,
+        help="run tag (default: derived from the time or the file name)",
+    )
+    parser.add_argument(
+        "--source",
+        dest="sources",
+        action="append",
+        metavar="HOST=SOURCE",
+        help=(
+            "collect from several hosts in one process, source is either "
+            "a command, file:PATH, fifo:PATH or follow:PATH (files written "
+            "with nmon -f, can be a glob pattern) (can be repeated)"
+        ),
+    )
+    parser.add_argument(
+        "--follow",
+        metavar="PATH",
+        help=(
+            "follow nmon output files written with nmon -f "
+            "(a path or a glob pattern, e.g., '/var/log/nmon/*.nmon')"
+        ),
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="SOURCE",
+        help=(
+            "load test: replay a recorded .nmon file, or synthetic output "
+            "(synthetic[:CPUS:DISKS:INTERVALS]), with timestamps shifted "
+            "to now"
+        ),
+    )
+    parser.add_argument(
+        "--hosts",
+        type=int,
+        default=1,
+        help="number of simulated hosts for --replay",
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=1.0,
+        help="replay speed, e.g., 10 (0 - as fast as possible)",
+    )
+    parser.add_argument(
+        "--loops",
+        type=int,
+        default=1,
+        help="times the recording is replayed",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=1,
+        help="seconds between nmon snapshots (nmon -s)",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=120,
+        help="number of nmon snapshots (nmon -c)",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="use asyncio-based reader and writer (requires aiohttp)",
+    )
+    return parser.parse_args()
+
+
+def counted_prefix_filter(line: str) -> bool:
+    # same as prefix_filter, but reports line counts per prefix
+    prefix, _, _ = line.partition(",")
+    stats.incr("lines_read")
+    stats.incr(f"lines_{prefix}")
+    if prefix_filter(line):
+        return True
+    stats.incr("lines_filtered")
+    return False
+
+
+def series_filters() -> SeriesFilters:
+    # e.g., NMON_DISK_EXCLUDE=loop*,sr* or NMON_CPU_INCLUDE=CPU_ALL
+    return filters_from_patterns(
+        {
+            section: (
+                os.getenv(f"NMON_{section}_INCLUDE"),
+                os.getenv(f"NMON_{section}_EXCLUDE"),
+            )
+            for section in ("CPU", "DISK")
+        }
+    )
+
+
+def change_only(data: Observable[Entry]) -> Observable[Entry]:
+    # unchanged samples are dropped if deadband is configured
+    threshold = os.getenv("NMON_DEADBAND")
+    if threshold is None:
+        return data
+    return data.pipe(
+        deadband(
+            float(threshold),
+            heartbeat=int(os.getenv("NMON_HEARTBEAT", 60)),
         )
     )
 
 
-def main():
-    load_dotenv("influx.env")
-    log = logger_factory("main")
+def schema_cache_from_env() -> Optional[SchemaCache]:
+    directory = os.getenv("NMON_SCHEMA_DIR")
+    return SchemaCache(directory) if directory else None
 
-    stream = stream_subprocess_stdout(["sh", "scripts/nmon-to-stdout.sh"])
+
+def live_stream(
+    run_id: str, interval: int = 1, count: int = 120
+) -> Observable[Entry]:
+    log = logger_factory("main")
+    command = os.getenv("NMON_COMMAND")
+    if command:
+        # custom command writing nmon output to stdout,
+        # e.g., "sh scripts/nmon-to-stdout.sh"
+        lines = (
+            line.rstrip("\n")
+            for line in stream_subprocess_stdout(shlex.split(command))
+            if counted_prefix_filter(line)
+        )
+    else:
+        # launcher drops rejected lines (and counts them) itself
+        lines = NmonLauncher(
+            interval=interval,
+            count=count,
+            reject=tuple(prefix.encode() for prefix in REJECTED_PREFIXES),
+        ).lines()
+    schema_cache = schema_cache_from_env()
+    if schema_cache is not None:
+        # a restarted collector resumes the run from the next frame
+        lines = cached_schema(
+            lines,
+            schema_cache,
+            host=os.getenv("NMON_HOST") or socket.gethostname(),
+            run_id=run_id,
+        )
+    # if parsing falls behind, either nmon is blocked on the pipe
+    # or whole frames are dropped (NMON_READ_POLICY)
+    stream = bounded_buffer(
+        lines,
+        maxsize=int(os.getenv("NMON_READ_BUFFER", 10000)),
+        policy=os.getenv("NMON_READ_POLICY", "block"),
+    )
 
     def interceptor(x: str):
         log.debug(f"nmon: {x}")
         return x
 
-    stream = rx.from_iterable(stream).pipe(
-        ops.filter(prefix_filter),
-        ops.map(lambda l: l.rstrip("\n")),
-        ops.map(interceptor),
+    stream = rx.from_iterable(stream)
+    if os.getenv("NMON_LOG_LINES"):
+        # logging each line is expensive, thus only on demand
+        stream = stream.pipe(ops.map(interceptor))
+    return nmon_parsing_pipeline(
+        source=stream,
+        run_id=run_id,
+        workers=int(os.getenv("NMON_PARSE_WORKERS", 0)),
+        executor=os.getenv("NMON_PARSE_EXECUTOR", "thread"),
+        rollup_windows=[
+            window
+            for window in os.getenv("NMON_ROLLUP_WINDOWS", "").split(",")
+            if window
+        ],
+        keep_raw=not os.getenv("NMON_ROLLUP_ONLY"),
+        filters=series_filters(),
+        disk_fields=bool(os.getenv("NMON_DISK_FIELDS")),
+        max_pending=int(os.getenv("NMON_PARSE_MAX_PENDING", 0)) or None,
     )
 
-    run_id = f"nmon-shitbarn-{datetime.now().isoformat()}"
-    data = nmon_parsing_pipeline(source=stream, run_id=run_id)
 
-    with InfluxDBClient(
+def follow_options() -> Dict[str, Optional[float]]:
+    # FileFollower settings of --follow and follow: sources,
+    # it stops once files have not grown for NMON_FOLLOW_IDLE_TIMEOUT
+    # seconds (e.g., nmon finished)
+    idle_timeout = os.getenv("NMON_FOLLOW_IDLE_TIMEOUT")
+    return {
+        "poll_interval": float(os.getenv("NMON_FOLLOW_POLL_INTERVAL", 1.0)),
+        "settle": float(os.getenv("NMON_FOLLOW_SETTLE", 0.2)),
+        "idle_timeout": float(idle_timeout) if idle_timeout else None,
+    }
+
+
+def follow_stream(path: str, run_id: str) -> Observable[Entry]:
+    follower = FileFollower(path, **follow_options())  # type: ignore
+
+    def entries() -> Iterator[Entry]:
+        # each (rotated) file has its own header, thus its own parser;
+        # lines of a file are consumed before the next one is followed.
+        # Series keep their ids across files
+        registry = SeriesRegistry()
+        for lines in follower.files():
+            dispatch = line_dispatcher(
+                run_id,
+                filters=series_filters(),
+                disk_fields=bool(os.getenv("NMON_DISK_FIELDS")),
+                registry=registry,
+            )
+            for line in filter(counted_prefix_filter, lines):
+                yield from dispatch(line)
+
+    return rx.from_iterable(entries())
+
+
+def multihost_stream(
+    sources: List[str], run_id: str
+) -> Observable[Entry]:
+    def subscribe(observer, scheduler=None):
+        options = follow_options()
+        collector = MultiHostCollector(
+            [NmonSource.from_spec(spec, **options) for spec in sources],
+            run_id=run_id,
+            write=observer.on_next,
+            line_filter=counted_prefix_filter,
+            filters=series_filters(),
+            schema_cache=schema_cache_from_env(),
+            disk_fields=bool(os.getenv("NMON_DISK_FIELDS")),
+        )
+        collector.run()
+        observer.on_completed()
+
+    return rx.create(subscribe)
+
+
+def influx_sink(stack: ExitStack) -> WriteFunction:
+    client = stack.enter_context(
+        InfluxDBClient(
+            url=os.getenv("INFLUX_API_URL", "http://localhost:8086"),
+            token=os.getenv("INFLUX_API_TOKEN", None),
+            org=os.getenv("INFLUX_ORG", "my-org"),
+        )
+    )
+    level = os.getenv("INFLUX_COMPRESSION_LEVEL")
+    # payloads are compressed on the sender thread
+    write = influx_http_write_function(
+        client,
+        bucket=os.getenv("INFLUX_BUCKET_NAME", "performance-metrics"),
+        compression=os.getenv("INFLUX_COMPRESSION") or None,
+        level=int(level) if level else None,
+    )
+
+    spool_directory = os.getenv("NMON_SPOOL_DIR")
+    if spool_directory:
+        # batches go to the disk spool first and are replayed
+        # to influx in background (at-least-once delivery)
+        spool = Spool(
+            spool_directory,
+            max_bytes=int(os.getenv("NMON_SPOOL_MAX_BYTES", 1 << 30)),
+        )
+        stack.callback(spool.close)
+        drainer = SpoolDrainer(spool, write).start()
+        stack.callback(
+            drainer.stop,
+            timeout=float(os.getenv("NMON_SPOOL_DRAIN_TIMEOUT", 30)),
+        )
+        write = spool.append
+    return write
+
+
+def sinks(stack: ExitStack) -> WriteFunction:
+    """Creates sinks listed in NMON_SINKS (influx, file, parquet),
+    several sinks are written to in parallel"""
+    names = [
+        name.strip()
+        for name in os.getenv("NMON_SINKS", "influx").split(",")
+        if name.strip()
+    ]
+    directory = os.getenv("NMON_SINK_DIR", "nmon-output")
+    compression = os.getenv("NMON_SINK_COMPRESSION", "gzip")
+    factories: Dict[str, Callable[[], WriteFunction]] = {
+        "influx": lambda: influx_sink(stack),
+        "file": lambda: stack.enter_context(
+            RotatingFileSink(
+                os.path.join(directory, "line-protocol"),
+                max_bytes=int(os.getenv("NMON_SINK_MAX_BYTES", 64 << 20)),
+                compression=None if compression == "none" else compression,
+            )
+        ),
+        "parquet": lambda: stack.enter_context(
+            ParquetSink(os.path.join(directory, "parquet"))
+        ),
+    }
+    unknown = set(names) - set(factories)
+    if unknown or not names:
+        raise ValueError(f"invalid sinks: {names}. expected {set(factories)}")
+    if len(names) == 1:
+        return factories[names[0]]()
+    return stack.enter_context(
+        FanOut(
+            {name: factories[name]() for name in names},
+            max_pending=int(os.getenv("NMON_SINK_MAX_PENDING", 16)),
+            policy=os.getenv("NMON_SINK_POLICY", "drop-oldest"),
+        )
+    )
+
+
+def live_store(stack: ExitStack, resolution: float) -> Optional[LiveStore]:
+    # last NMON_LIVE_MINUTES of each series served to grafana
+    # (simple-json datasource) straight from memory
+    port = os.getenv("NMON_LIVE_PORT")
+    if not port:
+        return None
+    minutes = float(os.getenv("NMON_LIVE_MINUTES", 10))
+    store = LiveStore(
+        capacity=max(1, int(minutes * 60 / resolution)),
+        max_targets=int(os.getenv("NMON_LIVE_MAX_TARGETS", 100_000)),
+    )
+    stack.enter_context(
+        LiveServer(
+            store, host=os.getenv("NMON_LIVE_HOST", "0.0.0.0"), port=int(port)
+        )
+    )
+    return store
+
+
+def write_to_sinks(
+    data: Observable[Entry],
+    split_intervals: bool = True,
+    run_id: Optional[str] = None,
+    bind: Optional[Callable[[BatchingWriter], None]] = None,
+    resolution: float = 1.0,
+):
+    log = logger_factory("main")
+
+    with ExitStack() as stack:
+        write = sinks(stack)
+
+        # lines of each nmon interval are sent as a single request
+        writer = stack.enter_context(
+            BatchingWriter(
+                write,
+                batch_size=int(os.getenv("INFLUX_BATCH_SIZE", 5000)),
+                flush_interval=float(os.getenv("INFLUX_FLUSH_INTERVAL", 1.0)),
+                max_pending=int(os.getenv("INFLUX_MAX_PENDING", 16)),
+                split_intervals=split_intervals,
+                policy=os.getenv("INFLUX_WRITE_POLICY", "block"),
+            )
+        )
+        if bind is not None:
+            bind(writer)
+        # collector health is written through the same writer
+        stack.enter_context(
+            StatsReporter(
+                writer.write,
+                interval=float(os.getenv("NMON_STATS_INTERVAL", 10)),
+                tags={"run": run_id} if run_id else None,
+                dump_path=os.getenv("NMON_STATS_DUMP"),
+            )
+        )
+        store = live_store(stack, resolution)
+        if store is not None:
+            data = data.pipe(ops.do_action(on_next=store.add))
+        done = threading.Event()
+
+        def on_error(e: Exception):
+            log.error(f"pipeline failed: {e}")
+            done.set()
+
+        data.subscribe(
+            on_next=writer.write,
+            on_error=on_error,
+            on_completed=done.set,
+        )
+        done.wait()
+
+
+def replay_recording(source: str) -> Recording:
+    if source.startswith("synthetic"):
+        # e.g., synthetic:64:200:600
+        _, *sizes = source.split(":")
+        cpus, disks, intervals = map(int, sizes) if sizes else (12, 8, 60)
+        return Recording.from_lines(synthetic_nmon(cpus, disks, intervals))
+    with open(source) as f:
+        return Recording.from_lines(f)
+
+
+def run_replay(args: argparse.Namespace, run_id: str):
+    recording = replay_recording(args.replay)
+    with ExitStack() as stack:
+        report = run_load(
+            recording,
+            sinks(stack),
+            run_id,
+            hosts=args.hosts,
+            speedup=args.speedup,
+            loops=args.loops,
+            line_filter=prefix_filter,
+            batch_size=int(os.getenv("INFLUX_BATCH_SIZE", 5000)),
+            flush_interval=float(os.getenv("INFLUX_FLUSH_INTERVAL", 1.0)),
+            max_pending=int(os.getenv("INFLUX_MAX_PENDING", 16)),
+            policy=os.getenv("INFLUX_WRITE_POLICY", "block"),
+        )
+    # sinks are closed, thus spooled batches are drained
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+# settings only the thread-based runners support: asyncio mode parses on
+# a single task and writes straight to influx (no sinks, spool, compression,
+# deadband, rollups, stats, live server, parse pool or drop policies).
+# Values are the ones asyncio mode behaves as (None - none of them);
+# knobs of the features listed here (e.g., NMON_SPOOL_MAX_BYTES) are
+# inert on their own, thus not checked
+ASYNCIO_UNSUPPORTED: Dict[str, Optional[str]] = {
+    "NMON_SPOOL_DIR": None,
+    "NMON_DEADBAND": None,
+    "NMON_SCHEMA_DIR": None,
+    "NMON_ROLLUP_WINDOWS": None,
+    "NMON_ROLLUP_ONLY": None,
+    "NMON_STATS_DUMP": None,
+    "NMON_STATS_INTERVAL": None,
+    "NMON_LIVE_PORT": None,
+    "NMON_LOG_LINES": None,
+    "NMON_PARSE_EXECUTOR": None,
+    "NMON_PARSE_MAX_PENDING": None,
+    "INFLUX_COMPRESSION": None,
+    "INFLUX_COMPRESSION_LEVEL": None,
+    "INFLUX_FLUSH_INTERVAL": None,
+    # frames are parsed in order on the event loop
+    "NMON_PARSE_WORKERS": "0",
+    # bounded queues make the reader and the parser wait
+    "NMON_READ_POLICY": "block",
+    "INFLUX_WRITE_POLICY": "block",
+}
+
+
+def check_asyncio_settings(args: argparse.Namespace):
+    """Rejects settings which would be silently ignored by --asyncio
+
+    :raises ValueError: if any of them is set
+    """
+    unsupported = [
+        name
+        for name, honoured in ASYNCIO_UNSUPPORTED.items()
+        if os.getenv(name) and os.getenv(name) != honoured
+    ]
+    if os.getenv("NMON_SINKS", "influx").strip() != "influx":
+        unsupported.append("NMON_SINKS")
+    if args.sources or args.follow:
+        unsupported.append("--source/--follow")
+    if (args.interval, args.count) != (1, 120):
+        # nmon is run by a command, which sets these itself
+        unsupported.append("--interval/--count (use NMON_COMMAND)")
+    if unsupported:
+        raise ValueError(f"--asyncio does not support: {unsupported}")
+
+
+async def run_asyncio(run_id: str):
+    # imported here as aiohttp is an optional dependency
+    from influxdb_client.client.influxdb_client_async import (
+        InfluxDBClientAsync,
+    )
+
+    async with InfluxDBClientAsync(
         url=os.getenv("INFLUX_API_URL", "http://localhost:8086"),
         token=os.getenv("INFLUX_API_TOKEN", None),
         org=os.getenv("INFLUX_ORG", "my-org"),
     ) as client:
-        with client.write_api(
-            write_options=WriteOptions(batch_size=1)
-        ) as write_api:
-            write_api.write(
-                bucket=os.getenv("INFLUX_BUCKET_NAME", "performance-metrics"),
-                record=data,
+        write = influx_async_write_function(
+            client.write_api(),
+            bucket=os.getenv("INFLUX_BUCKET_NAME", "performance-metrics"),
+        )
+        await run_async_pipeline(
+            shlex.split(
+                os.getenv("NMON_COMMAND", "sh scripts/nmon-to-stdout.sh")
+            ),
+            run_id=run_id,
+            write=write,
+            line_filter=prefix_filter,
+            read_queue_size=int(os.getenv("NMON_READ_BUFFER", 10000)),
+            write_queue_size=int(os.getenv("INFLUX_MAX_PENDING", 16)),
+            batch_size=int(os.getenv("INFLUX_BATCH_SIZE", 5000)),
+            filters=series_filters(),
+            disk_fields=bool(os.getenv("NMON_DISK_FIELDS")),
+        )
+
+
+def main():
+    args = parse_args()
+    load_dotenv("influx.env")
+
+    # fixed run id (e.g., in influx.env) lets a restarted
+    # collector continue the same run (see NMON_SCHEMA_DIR)
+    run_id = args.run_id or os.getenv("NMON_RUN_ID")
+    if args.files:
+        # backfill mode: archived outputs are parsed by a process pool
+        checkpoint_path = os.getenv("NMON_CHECKPOINTS")
+        checkpoints = (
+            CheckpointStore(checkpoint_path) if checkpoint_path else None
+        )
+        # progress is committed once the writer has sent the lines
+        writers: List[BatchingWriter] = []
+        data = rx.from_iterable(
+            ingest_files(
+                args.files,
+                run_id=run_id,
+                processes=args.processes,
+                filters=series_filters(),
+                disk_fields=bool(os.getenv("NMON_DISK_FIELDS")),
+                checkpoints=checkpoints,
+                acknowledge=lambda commit: writers[0].acknowledge(commit),
             )
+        )
+        write_to_sinks(change_only(data), run_id=run_id, bind=writers.append)
+        return
+
+    if args.replay:
+        run_id = run_id or f"nmon-replay-{datetime.now().isoformat()}"
+        run_replay(args, run_id)
+        return
+    if run_id is None:
+        run_id = f"nmon-shitbarn-{datetime.now().isoformat()}"
+    if args.asyncio:
+        check_asyncio_settings(args)
+        asyncio.run(run_asyncio(run_id))
+        return
+    if args.follow:
+        data = follow_stream(args.follow, run_id)
+        write_to_sinks(change_only(data), run_id=run_id)
+        return
+    if args.sources:
+        # sources interleave, thus batches are limited by size/time
+        data = change_only(multihost_stream(args.sources, run_id))
+        write_to_sinks(data, split_intervals=False, run_id=run_id)
+        return
+    data = live_stream(run_id, args.interval, args.count)
+    write_to_sinks(
+        change_only(data), run_id=run_id, resolution=args.interval
+    )
 
 
 if __name__ == "__main__":
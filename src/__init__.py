@@ -1,8 +1,12 @@
 import datetime
-from dataclasses import dataclass
 from functools import wraps
 import logging
-from typing import Callable, Iterable, Optional, Type
+from typing import TYPE_CHECKING, Callable, Optional, Sequence, Type
+
+from .stats import stats
+
+if TYPE_CHECKING:
+    from .registry import FrameRecord
 
 
 def logger_factory(name: str) -> logging.Logger:
@@ -32,25 +36,68 @@ for logger_name in ("nmon-parser", "pipe", "line-proto"):
     logger_factory(logger_name)
 
 
-@dataclass
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def epoch_nanoseconds(dt: datetime.datetime) -> int:
+    # exact integer arithmetics (no float rounding),
+    # naive datetimes are treated as local time
+    micros = (dt.astimezone(datetime.timezone.utc) - EPOCH) // MICROSECOND
+    return micros * 1000
+
+
 class TimestampTuple:
-    code: str
-    datetime: datetime.datetime
+    # allocated for each interval, thus slots instead of a dataclass
+    __slots__ = ("code", "datetime", "ns")
+
+    def __init__(
+        self,
+        code: str,
+        datetime: datetime.datetime,
+        ns: Optional[int] = None,
+    ) -> None:
+        self.code = code
+        self.datetime = datetime
+        # nanoseconds since epoch, computed once per
+        # interval and reused by all collectors
+        self.ns = epoch_nanoseconds(datetime) if ns is None else ns
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TimestampTuple):
+            return NotImplemented
+        return (self.code, self.datetime, self.ns) == (
+            other.code,
+            other.datetime,
+            other.ns,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"TimestampTuple(code={self.code!r}, "
+            f"datetime={self.datetime!r}, ns={self.ns!r})"
+        )
 
 
-LineProtocol = Callable[[str, Optional[TimestampTuple]], Iterable[str]]
+# fills series of the frame record from a line (without the section
+# prefix), returns ids of the series it has values of
+Collector = Callable[
+    [str, Optional[TimestampTuple], "FrameRecord"], Sequence[int]
+]
 
 
 def protect_from(exc: Type[Exception], log_prefix: str):
-    def protected(fn: LineProtocol) -> LineProtocol:
+    def protected(fn: Collector) -> Collector:
         log = logging.getLogger("line-proto")
 
         @wraps(fn)
         def _wrapper(*args, **kwds):
             try:
-                yield from fn(*args, **kwds)
+                return fn(*args, **kwds)
             except exc as e:
+                stats.incr("parse_errors")
                 log.error(f"{log_prefix} parsing error: {e}")
+                return ()
 
         return _wrapper
 
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from . import logger_factory
+from .cardinality import SeriesFilters
+from .encoder import LineBuffer
+from .pipeline import line_dispatcher
+
+log = logger_factory("aio")
+
+AsyncWriteFunction = Callable[[bytes], Awaitable[None]]
+
+# marks the end of a stream passed between stages
+_DONE = None
+
+
+@dataclass
+class Summary:
+    """Running summary of a timing metric (constant memory)"""
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "mean": self.mean, "max": self.max}
+
+
+@dataclass
+class AsyncMetrics:
+    # time a line spent in the queue between the reader and the parser
+    read_lag: Summary = field(default_factory=Summary)
+    # duration of write requests
+    write_latency: Summary = field(default_factory=Summary)
+    lines_read: int = 0
+    lines_written: int = 0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "read_lag": self.read_lag.as_dict(),
+            "write_latency": self.write_latency.as_dict(),
+            "lines_read": self.lines_read,
+            "lines_written": self.lines_written,
+        }
+
+
+async def stream_subprocess_stdout_async(
+    args: List[str],
+) -> AsyncIterator[str]:
+    """Async counterpart of stream_subprocess_stdout:
+    yields lines of subprocess stdout (without newlines)
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    assert proc.stdout is not None
+    try:
+        async for line in proc.stdout:
+            yield line.decode().rstrip("\n")
+    finally:
+        if proc.returncode is None:
+            proc.terminate()
+        await proc.wait()
+
+
+def influx_async_write_function(write_api, bucket: str) -> AsyncWriteFunction:
+    """Wraps async influx write api (see InfluxDBClientAsync)
+
+    :param write_api: async write api
+    :type write_api: WriteApiAsync
+    :param bucket: destination bucket name
+    :type bucket: str
+    :return: coroutine function performing a single request per call
+    :rtype: AsyncWriteFunction
+    """
+
+    async def write(payload: bytes):
+        await write_api.write(bucket=bucket, record=payload)
+
+    return write
+
+
+async def run_async_pipeline(
+    args: List[str],
+    run_id: str,
+    write: AsyncWriteFunction,
+    line_filter: Optional[Callable[[str], bool]] = None,
+    read_queue_size: int = 10000,
+    write_queue_size: int = 16,
+    batch_size: int = 5000,
+    metrics: Optional[AsyncMetrics] = None,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+) -> AsyncMetrics:
+    """Runs the nmon script and writes parsed metrics. Reading,
+    parsing and writing are separate tasks connected by bounded queues,
+    so a slow write does not stall reading from nmon (unless the queues
+    are full). Lines of each interval are written in a single request
+
+    :param args: command producing nmon output
+    :type args: List[str]
+    :param run_id: run tag
+    :type run_id: str
+    :param write: async write function
+    :type write: AsyncWriteFunction
+    :param line_filter: predicate selecting lines to parse
+    :type line_filter: Optional[Callable[[str], bool]], optional
+    :param read_queue_size: max lines between reader and parser
+    :type read_queue_size: int, optional
+    :param write_queue_size: max batches between parser and writer
+    :type write_queue_size: int, optional
+    :param batch_size: max lines per write request
+    :type batch_size: int, optional
+    :param filters: include/exclude patterns of columns per section
+    :type filters: Optional[SeriesFilters], optional
+    :param disk_fields: emit read/write/busy of a disk as a single point
+    :type disk_fields: bool, optional
+    :return: collected metrics
+    :rtype: AsyncMetrics
+    """
+    metrics = metrics or AsyncMetrics()
+    lines: "asyncio.Queue[Optional[tuple]]" = asyncio.Queue(read_queue_size)
+    batches: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(
+        write_queue_size
+    )
+    dispatch = line_dispatcher(
+        run_id, filters=filters, disk_fields=disk_fields
+    )
+
+    async def read():
+        try:
+            async for line in stream_subprocess_stdout_async(args):
+                if line_filter is not None and not line_filter(line):
+                    continue
+                metrics.lines_read += 1
+                await lines.put((time.monotonic(), line))
+        finally:
+            await lines.put(_DONE)
+
+    async def parse():
+        # samples are encoded straight into the payload
+        batch = LineBuffer()
+
+        async def flush():
+            if batch:
+                metrics.lines_written += len(batch)
+                await batches.put(batch.take())
+
+        try:
+            while (item := await lines.get()) is not _DONE:
+                read_at, line = item
+                metrics.read_lag.add(time.monotonic() - read_at)
+                if line.startswith("ZZZZ"):
+                    # previous interval is complete
+                    await flush()
+                for entry in dispatch(line):
+                    if isinstance(entry, str):
+                        batch.append(entry)
+                    else:
+                        batch.add(entry)
+                if len(batch) >= batch_size:
+                    await flush()
+            await flush()
+        finally:
+            await batches.put(_DONE)
+
+    async def send():
+        while (payload := await batches.get()) is not _DONE:
+            started = time.monotonic()
+            try:
+                await write(payload)
+            except Exception as e:
+                log.error(f"failed to write batch ({len(payload)}B): {e}")
+            metrics.write_latency.add(time.monotonic() - started)
+
+    await asyncio.gather(read(), parse(), send())
+    log.info(f"async pipeline finished: {metrics.as_dict()}")
+    return metrics
@@ -0,0 +1,308 @@
+import bisect
+import collections
+import functools
+import mmap
+import multiprocessing
+import os
+from multiprocessing.pool import AsyncResult
+from typing import (
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from . import logger_factory
+from .cardinality import SeriesFilters
+from .checkpoint import Checkpoint, CheckpointStore
+from .frames import FrameParser
+from .scraper import NmonHeaderParser, NmonParser, is_header_line
+
+log = logger_factory("backfill")
+
+FRAME_MARKER = b"\nZZZZ,"
+
+# per-process parser state (see _init_worker)
+_worker: Optional["_FrameWorker"] = None
+
+
+def frame_offsets(buffer: mmap.mmap) -> List[int]:
+    """Finds offsets of all ZZZZ lines (frame starts) in the
+    memory-mapped nmon file
+
+    :param buffer: mapped nmon output
+    :type buffer: mmap.mmap
+    :return: sorted list of offsets, each points to the start of ZZZZ line
+    :rtype: List[int]
+    """
+    offsets = []
+    if buffer[:5] == FRAME_MARKER[1:]:
+        offsets.append(0)
+    position = buffer.find(FRAME_MARKER)
+    while position != -1:
+        offsets.append(position + 1)
+        position = buffer.find(FRAME_MARKER, position + 1)
+    return offsets
+
+
+def frame_ranges(
+    offsets: List[int], size: int, frames_per_range: int
+) -> List[Tuple[int, int]]:
+    """Groups consecutive frames into [start, end) byte ranges
+    so that each worker gets several frames at once
+    """
+    bounds = offsets[::frames_per_range] + [size]
+    return list(zip(bounds, bounds[1:]))
+
+
+def frame_code(buffer: mmap.mmap, offset: int) -> str:
+    """T-code of the frame starting at given offset"""
+    start = offset + len(FRAME_MARKER) - 1
+    return buffer[start:buffer.find(b",", start)].decode(errors="replace")
+
+
+def resume_index(
+    buffer: mmap.mmap, offsets: List[int], checkpoint: Checkpoint
+) -> int:
+    """Index of the first frame after the checkpoint. If the checkpoint
+    does not match the file (no frame ends at its offset, or the
+    last committed frame has another T-code), the file is ingested
+    from the start
+    """
+    index = bisect.bisect_left(offsets, checkpoint.offset)
+    at_boundary = checkpoint.offset == (offsets + [len(buffer)])[index]
+    if (
+        index > 0
+        and at_boundary
+        and frame_code(buffer, offsets[index - 1]) == checkpoint.code
+    ):
+        return index
+    log.warning(f"checkpoint {checkpoint} does not match the file")
+    return 0
+
+
+class _FrameWorker:
+    def __init__(
+        self,
+        path: str,
+        header: List[str],
+        measurement: str,
+        run_id: str,
+        filters: Optional[SeriesFilters] = None,
+        disk_fields: bool = False,
+    ) -> None:
+        self.parser = FrameParser(
+            header, measurement, run_id, filters, disk_fields
+        ).parser
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(
+            self.file.fileno(), 0, access=mmap.ACCESS_READ
+        )
+
+    def parse(self, span: Tuple[int, int]) -> List[str]:
+        start, end = span
+        listeners = self.parser.listeners
+        timestamp_prefix = self.parser.timestamp_prefix
+        lines = []
+        chunk = self.buffer[start:end].decode(errors="replace")
+        for line in chunk.splitlines():
+            prefix, _, _ = line.partition(",")
+            # lines of unknown sections are dropped silently,
+            # the same way prefix_filter does for live streams
+            if prefix != timestamp_prefix and prefix not in listeners:
+                continue
+            lines.extend(self.parser.parse(line))
+        return lines
+
+
+def _init_worker(
+    path: str,
+    header: List[str],
+    measurement: str,
+    run_id: str,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+):
+    global _worker
+    _worker = _FrameWorker(
+        path, header, measurement, run_id, filters, disk_fields
+    )
+
+
+def _parse_range(span: Tuple[int, int]) -> List[str]:
+    assert _worker is not None, "worker is not initialized"
+    return _worker.parse(span)
+
+
+def read_header(
+    buffer: mmap.mmap, end: int, first_frame_end: Optional[int] = None
+) -> List[str]:
+    """Reads header lines (ones preceding the first frame and the ones
+    written within it, e.g., VM) and checks that all the collectors
+    can be registered
+
+    :raises ValueError: if header is incomplete
+    """
+    header = buffer[:end].decode(errors="replace").splitlines()
+    if first_frame_end is not None:
+        first_frame = buffer[end:first_frame_end].decode(errors="replace")
+        header += filter(is_header_line, first_frame.splitlines())
+    header_parser = NmonHeaderParser(
+        NmonParser(timestamp_prefix="ZZZZ"),
+        "header-check",
+        "-",
+    )
+    for line in header:
+        header_parser.parse(line)
+    if not header_parser.registered_all:
+        raise ValueError("nmon header is incomplete")
+    return header
+
+
+def ingest_file(
+    path: str,
+    run_id: str,
+    measurement: str = "perf-metrics",
+    processes: Optional[int] = None,
+    frames_per_range: int = 64,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+    checkpoints: Optional[CheckpointStore] = None,
+    acknowledge: Optional[Callable[[Callable[[], None]], None]] = None,
+    max_in_flight: Optional[int] = None,
+) -> Iterator[str]:
+    """Parses archived nmon output file in parallel.
+    The file is memory-mapped and split at ZZZZ boundaries, frame ranges
+    are parsed by a process pool. Results are yielded in file
+    (thus, timestamp) order. At most `max_in_flight` ranges are
+    submitted ahead of the consumer, so that parsed output does not
+    pile up in memory when writes are slower than the workers.
+
+    With checkpoints, ingestion starts after the committed frames and
+    the position is committed after each range. The commit is passed to
+    `acknowledge` (e.g., BatchingWriter.acknowledge, which calls it once
+    the lines are written), otherwise it is done once the range is
+    consumed
+
+    :param path: path to .nmon file
+    :type path: str
+    :param run_id: run tag for emitted lines
+    :type run_id: str
+    :param measurement: measurement name suffix, defaults to "perf-metrics"
+    :type measurement: str, optional
+    :param processes: pool size, defaults to cpu count
+    :type processes: Optional[int], optional
+    :param frames_per_range: frames parsed by a worker at once
+    :type frames_per_range: int, optional
+    :param filters: include/exclude patterns of columns per section
+    :type filters: Optional[SeriesFilters], optional
+    :param disk_fields: emit read/write/busy of a disk as a single point
+    :type disk_fields: bool, optional
+    :param checkpoints: store of committed positions
+    :type checkpoints: Optional[CheckpointStore], optional
+    :param acknowledge: defers commits until the lines are written
+    :type acknowledge: Optional[Callable[[Callable[[], None]], None]]
+    :param max_in_flight: ranges being parsed or waiting to be consumed,
+        defaults to twice the pool size
+    :type max_in_flight: Optional[int], optional
+    :return: iterator over line protocol entries
+    :rtype: Iterator[str]
+    """
+    checkpoint = checkpoints.get(path) if checkpoints else None
+    if checkpoint is not None and checkpoint.offset == os.path.getsize(path):
+        log.info(f"{path}: already ingested (up to {checkpoint.code})")
+        return
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            log.warning(f"{path}: empty file")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            offsets = frame_offsets(buffer)
+            if not offsets:
+                log.warning(f"{path}: no frames found")
+                return
+            header = read_header(
+                buffer, offsets[0], (offsets[1:] + [len(buffer)])[0]
+            )
+            first = 0
+            if checkpoint is not None:
+                first = resume_index(buffer, offsets, checkpoint)
+                log.info(f"{path}: resuming after {first} frames")
+            pending = offsets[first:]
+            spans = frame_ranges(pending, len(buffer), frames_per_range)
+            # T-codes of the last frame of each range
+            codes = [
+                frame_code(buffer, frame)
+                for frame in pending[frames_per_range - 1::frames_per_range]
+                + pending[-1:]
+            ][: len(spans)]
+
+    log.info(f"{path}: {len(pending)} frames, {len(spans)} ranges")
+    if not spans:
+        return
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * processes
+    if max_in_flight < 1:
+        raise ValueError(f"invalid number of ranges: {max_in_flight}")
+
+    def release(end: int, code: str, lines: List[str]) -> Iterator[str]:
+        yield from lines
+        if checkpoints is None:
+            return
+        commit = functools.partial(checkpoints.commit, path, end, code)
+        if acknowledge is None:
+            commit()
+        else:
+            acknowledge(commit)
+
+    with multiprocessing.Pool(
+        processes=processes,
+        initializer=_init_worker,
+        initargs=(path, header, measurement, run_id, filters, disk_fields),
+    ) as pool:
+        # ranges are submitted in file order and released in the same
+        # order, thus frames are merged by timestamp; a range is only
+        # submitted once the consumer has taken the oldest one
+        in_flight: Deque[Tuple[int, str, AsyncResult]] = collections.deque()
+        for span, code in zip(spans, codes):
+            if len(in_flight) >= max_in_flight:
+                end, oldest, result = in_flight.popleft()
+                yield from release(end, oldest, result.get())
+            result = pool.apply_async(_parse_range, (span,))
+            in_flight.append((span[1], code, result))
+        while in_flight:
+            end, oldest, result = in_flight.popleft()
+            yield from release(end, oldest, result.get())
+
+
+def expand_paths(paths: Iterable[str]) -> Iterator[str]:
+    """Replaces directories with the files in them (in name order,
+    hidden files are skipped)"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for name in sorted(os.listdir(path)):
+            file = os.path.join(path, name)
+            if not name.startswith(".") and os.path.isfile(file):
+                yield file
+
+
+def ingest_files(
+    paths: Iterable[str],
+    run_id: Optional[str] = None,
+    **kwds,
+) -> Iterator[str]:
+    """Ingests several files (or directories of files) one after
+    another. If run id is not specified, one is derived from the file
+    name (thus, it is stable across resumed runs)
+    """
+    for path in expand_paths(paths):
+        file_run_id = run_id
+        if file_run_id is None:
+            name, _ = os.path.splitext(os.path.basename(path))
+            file_run_id = f"nmon-{name}"
+        yield from ingest_file(path, file_run_id, **kwds)
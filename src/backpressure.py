@@ -0,0 +1,203 @@
+import threading
+from collections import deque
+from typing import Deque, Generic, Optional, TypeVar
+
+from .stats import stats
+
+T = TypeVar("T")
+
+# what happens when a bounded stage is full:
+# - block: the producer waits, i.e., the slowdown propagates upstream
+#   (eventually to nmon, which is blocked on its output)
+# - drop-oldest: the oldest queued frame/batch is discarded
+# - drop-newest: the incoming frame/batch is discarded
+POLICIES = ("block", "drop-oldest", "drop-newest")
+
+
+def check_policy(policy: str):
+    if policy not in POLICIES:
+        raise ValueError(f"invalid policy: {policy}. expected {POLICIES}")
+
+
+class BoundedQueue(Generic[T]):
+    """FIFO queue with a high-water mark and an overflow policy.
+    Discarded items are counted in stats as `dropped_<name>`.
+    Items put as non-droppable (e.g., end-of-stream markers)
+    are never discarded and may exceed the limit
+    """
+
+    def __init__(
+        self, maxsize: int, policy: str = "block", name: str = "queue"
+    ) -> None:
+        if maxsize < 1:
+            raise ValueError(f"invalid queue size: {maxsize}")
+        check_policy(policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.items: Deque[T] = deque()
+        self.droppable: Deque[bool] = deque()
+        self.dropped = 0
+        self.lock = threading.Condition()
+
+    def qsize(self) -> int:
+        with self.lock:
+            return len(self.items)
+
+    def put(self, item: T, droppable: bool = True) -> Optional[T]:
+        """Enqueues the item, returns the discarded one (if any)"""
+        discarded: Optional[T] = None
+        with self.lock:
+            full = droppable and len(self.items) >= self.maxsize
+            if full and self.policy == "drop-newest":
+                self.dropped += 1
+                stats.incr(f"dropped_{self.name}")
+                return item
+            if full and self.policy == "drop-oldest" and any(self.droppable):
+                discarded = self._pop_oldest_droppable()
+                self.dropped += 1
+                stats.incr(f"dropped_{self.name}")
+            elif full:
+                while len(self.items) >= self.maxsize:
+                    self.lock.wait()
+            self.items.append(item)
+            self.droppable.append(droppable)
+            self.lock.notify_all()
+        return discarded
+
+    def _pop_oldest_droppable(self) -> T:
+        index = self.droppable.index(True)
+        item = self.items[index]
+        del self.items[index]
+        del self.droppable[index]
+        return item
+
+    def get(self) -> T:
+        with self.lock:
+            while not self.items:
+                self.lock.wait()
+            self.droppable.popleft()
+            item = self.items.popleft()
+            self.lock.notify_all()
+            return item
+
+
+class _Frame:
+    __slots__ = ("lines", "droppable")
+
+    def __init__(self, droppable: bool) -> None:
+        self.lines: Deque[str] = deque()
+        self.droppable = droppable
+
+
+class FrameQueue:
+    """Bounded queue of nmon output lines which drops whole frames
+    (ZZZZ line with the records following it), so that parsed intervals
+    are never partial. Lines are available to the consumer as soon as
+    they are put (frames are not held back until complete).
+
+    The header and the first frame (nmon writes some headers in it)
+    are never dropped, neither is a frame the consumer has started
+    reading. Dropped frames and lines are counted in stats as
+    `dropped_frames_<name>` and `dropped_lines_<name>`
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        policy: str = "block",
+        name: str = "read",
+        timestamp_prefix: str = "ZZZZ",
+    ) -> None:
+        if maxsize < 1:
+            raise ValueError(f"invalid queue size: {maxsize}")
+        check_policy(policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.timestamp_prefix = timestamp_prefix
+        # the last frame is the one being written
+        self.frames: Deque[_Frame] = deque()
+        self.size = 0
+        self.started_frames = 0
+        # rest of the incoming frame is discarded (drop-newest)
+        self.discarding = False
+        self.closed = False
+        self.dropped_frames = 0
+        self.dropped_lines = 0
+        self.lock = threading.Condition()
+
+    def qsize(self) -> int:
+        with self.lock:
+            return self.size
+
+    def _drop(self, frame: _Frame, pending: int = 0):
+        lines = len(frame.lines) + pending
+        self.size -= len(frame.lines)
+        frame.lines.clear()
+        self.dropped_frames += 1
+        self.dropped_lines += lines
+        stats.incr(f"dropped_frames_{self.name}")
+        stats.incr(f"dropped_lines_{self.name}", lines)
+
+    def _make_room(self) -> bool:
+        """Frees space according to the policy,
+        returns False if the incoming line should be discarded"""
+        if self.policy == "drop-oldest":
+            # the frame being written can't be dropped
+            for frame in list(self.frames)[:-1]:
+                if frame.droppable:
+                    self._drop(frame)
+                    self.frames.remove(frame)
+                    return True
+        elif self.policy == "drop-newest" and self.frames[-1].droppable:
+            self._drop(self.frames[-1], pending=1)
+            self.discarding = True
+            return False
+        # nothing can be dropped
+        while self.size >= self.maxsize:
+            self.lock.wait()
+        return True
+
+    def put(self, line: str):
+        with self.lock:
+            if line.startswith(self.timestamp_prefix):
+                self.started_frames += 1
+                self.discarding = False
+                self.frames.append(_Frame(droppable=self.started_frames > 1))
+            elif not self.frames:
+                # header
+                self.frames.append(_Frame(droppable=False))
+            elif self.discarding:
+                self.dropped_lines += 1
+                stats.incr(f"dropped_lines_{self.name}")
+                return
+            if self.size >= self.maxsize and not self._make_room():
+                return
+            self.frames[-1].lines.append(line)
+            self.size += 1
+            self.lock.notify_all()
+
+    def close(self):
+        """Marks the end of the stream"""
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def get(self) -> Optional[str]:
+        """Takes the next line, returns None once the
+        stream is closed and all the lines were taken"""
+        with self.lock:
+            while True:
+                while len(self.frames) > 1 and not self.frames[0].lines:
+                    self.frames.popleft()
+                if self.frames and self.frames[0].lines:
+                    frame = self.frames[0]
+                    # partially read frames are not dropped
+                    frame.droppable = False
+                    self.size -= 1
+                    self.lock.notify_all()
+                    return frame.lines.popleft()
+                if self.closed:
+                    return None
+                self.lock.wait()
@@ -0,0 +1,240 @@
+from array import array
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import reactivex as rx
+from reactivex.abc import ObserverBase, SchedulerBase
+from reactivex.observable import Observable
+
+from . import logger_factory
+from .encoder import split_entry
+from .registry import Entry, FrameRecord, Samples, SeriesRegistry
+from .stats import stats
+
+log = logger_factory("cardinality")
+
+
+def parse_patterns(spec: Optional[str]) -> List[str]:
+    """Splits comma-separated glob patterns (e.g., "loop*,sd?1")"""
+    patterns = (pattern.strip() for pattern in (spec or "").split(","))
+    return [pattern for pattern in patterns if pattern]
+
+
+class SeriesFilter:
+    """Decides which columns of a section (disks, CPU ids) become series.
+    Name is accepted if it matches any of include patterns (or there
+    are none) and does not match any of exclude patterns. Patterns are
+    shell-style globs, matching is case-sensitive. Applied once, when
+    collectors are registered from the header
+    """
+
+    def __init__(
+        self,
+        include: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+    ) -> None:
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+
+    def __call__(self, name: str) -> bool:
+        if self.include and not any(
+            fnmatchcase(name, pattern) for pattern in self.include
+        ):
+            return False
+        return not any(fnmatchcase(name, pattern) for pattern in self.exclude)
+
+    def __repr__(self) -> str:
+        return f"SeriesFilter(include={self.include}, exclude={self.exclude})"
+
+
+# section name (e.g., CPU, DISK) -> filter of its columns
+SeriesFilters = Dict[str, SeriesFilter]
+
+
+class _LastValues:
+    # values of the last written point and number of
+    # samples dropped since then
+    __slots__ = ("values", "skipped")
+
+    def __init__(self, values: array) -> None:
+        self.values = values
+        self.skipped = 0
+
+
+class _LastRecord:
+    # last written values of the series of a registry (present if
+    # written at least once) and samples dropped since, by series id
+    __slots__ = ("record", "skipped")
+
+    def __init__(self, registry: SeriesRegistry) -> None:
+        self.record = FrameRecord(registry)
+        self.skipped = array("l")
+        self.grow()
+
+    def grow(self):
+        self.record.grow()
+        missing = len(self.record.present) - len(self.skipped)
+        self.skipped.frombytes(bytes(self.skipped.itemsize * missing))
+
+
+class Deadband:
+    """Change-only emission: a sample is dropped if none of its fields
+    changed by more than `threshold` since the last written point of the
+    series. Every `heartbeat`-th sample is written regardless, so that
+    idle series do not disappear from dashboards. Only the last written
+    values are kept: a FrameRecord per registry (parsed stream) for
+    samples, a float array per series key for line protocol entries
+    """
+
+    def __init__(self, threshold: float = 0.0, heartbeat: int = 60) -> None:
+        if threshold < 0:
+            raise ValueError(f"invalid deadband threshold: {threshold}")
+        if heartbeat < 1:
+            raise ValueError(f"invalid heartbeat: {heartbeat}")
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.series: Dict[str, _LastValues] = {}
+        self.records: Dict[SeriesRegistry, _LastRecord] = {}
+
+    def accept(self, line: str) -> bool:
+        """Tells whether the entry should be written
+
+        :raises ValueError: if entry can't be parsed
+        """
+        key, fields, _ = split_entry(line)
+        values = array(
+            "d",
+            (
+                float(field.partition("=")[2].rstrip("i"))
+                for field in fields.split(",")
+            ),
+        )
+        last = self.series.get(key)
+        if last is None or len(last.values) != len(values):
+            self.series[key] = _LastValues(values)
+            return True
+        if last.skipped + 1 < self.heartbeat and all(
+            abs(value - previous) <= self.threshold
+            for value, previous in zip(values, last.values)
+        ):
+            last.skipped += 1
+            return False
+        last.values = values
+        last.skipped = 0
+        return True
+
+    def accept_samples(self, samples: Samples) -> Sequence[int]:
+        """Same as accept, but compares columns of the record
+        in place, returns ids of the series to be written"""
+        record, series = samples
+        registry = record.registry
+        state = self.records.get(registry)
+        if state is None:
+            state = self.records[registry] = _LastRecord(registry)
+        elif len(state.skipped) != len(registry):
+            # series registered since the last sample
+            state.grow()
+        last, skipped = state.record, state.skipped
+        offsets = registry.offsets
+        values = record.values
+        present = record.present
+        threshold = self.threshold
+        accepted = []
+        for index in series:
+            count = present[index]
+            if not count:
+                continue
+            offset = offsets[index]
+            end = offset + count
+            # rows may be shorter than their section header,
+            # samples of a different length are always written
+            if (
+                last.present[index] == count
+                and skipped[index] + 1 < self.heartbeat
+                and all(
+                    abs(values[column] - last.values[column]) <= threshold
+                    for column in range(offset, end)
+                )
+            ):
+                skipped[index] += 1
+                continue
+            last.values[offset:end] = values[offset:end]
+            last.present[index] = count
+            skipped[index] = 0
+            accepted.append(index)
+        return accepted
+
+
+def deadband(
+    threshold: float = 0.0, heartbeat: int = 60
+) -> Callable[[Observable[Entry]], Observable[Entry]]:
+    """Operator which drops unchanged samples (see Deadband). Samples
+    of frame records are passed on with the ids of the written series
+
+    :param threshold: max absolute change considered as no change
+    :type threshold: float, optional
+    :param heartbeat: each series is written at least once
+        per this number of samples
+    :type heartbeat: int, optional
+    :return: reactivex operator
+    :rtype: Callable[[Observable[Entry]], Observable[Entry]]
+    """
+    # validate before subscription
+    Deadband(threshold, heartbeat)
+
+    def operator(source: Observable[Entry]) -> Observable[Entry]:
+        def subscribe(
+            observer: ObserverBase[Entry],
+            scheduler: Optional[SchedulerBase] = None,
+        ):
+            band = Deadband(threshold, heartbeat)
+
+            def on_samples(samples: Samples):
+                accepted = band.accept_samples(samples)
+                record, series = samples
+                present = record.present
+                dropped = sum(1 for index in series if present[index])
+                dropped -= len(accepted)
+                if dropped:
+                    stats.incr("deadband_dropped", dropped)
+                if accepted:
+                    observer.on_next(Samples(record, accepted))
+
+            def on_next(entry: Entry):
+                if not isinstance(entry, str):
+                    on_samples(entry)
+                    return
+                try:
+                    accepted = band.accept(entry)
+                except ValueError as e:
+                    # entries that can't be compared are passed as is
+                    log.error(f"deadband of '{entry}' failed: {e}")
+                    accepted = True
+                if accepted:
+                    observer.on_next(entry)
+                else:
+                    stats.incr("deadband_dropped")
+
+            return source.subscribe(
+                on_next=on_next,
+                on_error=observer.on_error,
+                on_completed=observer.on_completed,
+                scheduler=scheduler,
+            )
+
+        return rx.create(subscribe)
+
+    return operator
+
+
+def filters_from_patterns(
+    patterns: Dict[str, Tuple[Optional[str], Optional[str]]]
+) -> SeriesFilters:
+    """Builds filters from comma-separated (include, exclude) patterns
+    per section, sections without patterns are omitted
+    """
+    return {
+        section: SeriesFilter(parse_patterns(include), parse_patterns(exclude))
+        for section, (include, exclude) in patterns.items()
+        if include or exclude
+    }
@@ -0,0 +1,58 @@
+import json
+import os
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from . import logger_factory
+
+log = logger_factory("checkpoint")
+
+
+class Checkpoint(NamedTuple):
+    """Committed position in an ingested file: frames preceding
+    `offset` (the last one being `code`) were written"""
+
+    offset: int
+    code: str
+
+
+class CheckpointStore:
+    """Durable backfill progress: a JSON file mapping (absolute)
+    paths of ingested files to their checkpoints. The file is
+    replaced atomically on each commit
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.checkpoints: Dict[str, Checkpoint] = {}
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            self.checkpoints = {
+                file: Checkpoint(int(entry["offset"]), str(entry["code"]))
+                for file, entry in stored.items()
+            }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.error(f"ignoring corrupted checkpoints {path}: {e}")
+
+    def get(self, file: str) -> Optional[Checkpoint]:
+        with self.lock:
+            return self.checkpoints.get(os.path.abspath(file))
+
+    def commit(self, file: str, offset: int, code: str):
+        with self.lock:
+            self.checkpoints[os.path.abspath(file)] = Checkpoint(offset, code)
+            temporary = f"{self.path}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(
+                    {
+                        file: checkpoint._asdict()
+                        for file, checkpoint in self.checkpoints.items()
+                    },
+                    f,
+                    indent=1,
+                )
+            os.replace(temporary, self.path)
@@ -1,9 +1,13 @@
 import subprocess
-from typing import Iterable, List, Tuple
+import threading
+from typing import Iterable, Iterator, List, Tuple
 
 import reactivex as rx
 import reactivex.operators as ops
 
+from .backpressure import FrameQueue
+from .stats import stats
+
 
 def stream_subprocess_stdout(args: List[str]) -> Iterable[str]:
     """
@@ -51,3 +55,51 @@ def parse_nmon_csv(stream: Iterable[str]):
     rx.from_iterable(stream).pipe(
         ops.filter(lambda l: l.startswith(("ZZZZ")))
     ).subscribe(lambda l: print(l, end=""))
+
+
+def bounded_buffer(
+    stream: Iterable[str],
+    maxsize: int,
+    name: str = "read",
+    policy: str = "block",
+) -> Iterator[str]:
+    """Reads given stream on a separate thread into a bounded queue.
+    When the consumer falls behind, either the reader blocks (thus, the
+    subprocess is blocked on its stdout) or whole nmon frames are
+    dropped, depending on the policy (see backpressure.FrameQueue).
+    In any case, unlimited amount of lines is never buffered in memory
+
+    :param stream: source (e.g., subprocess stdout)
+    :type stream: Iterable[str]
+    :param maxsize: max number of lines buffered
+    :type maxsize: int
+    :param name: queue name in stats (its depth is reported as a gauge)
+    :type name: str, optional
+    :param policy: "block", "drop-oldest" or "drop-newest"
+    :type policy: str, optional
+    :return: iterator over the same lines
+    :rtype: Iterator[str]
+    """
+    buffer = FrameQueue(maxsize, policy=policy, name=name)
+    failure: List[BaseException] = []
+    stats.gauge(f"queue_{name}", buffer.qsize)
+
+    def reader():
+        try:
+            for line in stream:
+                buffer.put(line)
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            buffer.close()
+
+    thread = threading.Thread(target=reader, name="reader", daemon=True)
+    thread.start()
+    while True:
+        line = buffer.get()
+        if line is None:
+            break
+        yield line
+    thread.join()
+    if failure:
+        raise failure[0]
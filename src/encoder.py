@@ -0,0 +1,212 @@
+import re
+import threading
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from .registry import Entry, Samples
+
+T = TypeVar("T")
+
+# tag keys/values and measurement names require
+# escaping of commas and spaces (tags also of equal signs)
+_MEASUREMENT_ESCAPES = str.maketrans({",": r"\,", " ": r"\ "})
+_TAG_ESCAPES = str.maketrans({",": r"\,", " ": r"\ ", "=": r"\="})
+
+
+def escape_measurement(value: str) -> str:
+    return value.translate(_MEASUREMENT_ESCAPES)
+
+
+def escape_tag(value: str) -> str:
+    return value.translate(_TAG_ESCAPES)
+
+
+def series_key(measurement: str, **tags: str) -> str:
+    """Builds line protocol series key (measurement with tag set),
+    i.e., `measurement,tag=value,...`. Tags are written in the given order
+
+    :param measurement: measurement name
+    :type measurement: str
+    :return: escaped series key
+    :rtype: str
+    """
+    return ",".join(
+        [escape_measurement(measurement)]
+        + [f"{escape_tag(k)}={escape_tag(v)}" for k, v in tags.items()]
+    )
+
+
+def split_entry(line: str) -> Tuple[str, str, str]:
+    """Splits line protocol entry into series key, fields and timestamp.
+    Handles escaped spaces in the key (field values are expected
+    to be numeric, as collectors emit them)
+
+    :raises ValueError: if entry is malformed
+    """
+    if "\\" not in line:
+        key, fields, timestamp = line.split(" ")
+        return key, fields, timestamp
+    position = 0
+    while True:
+        position = line.index(" ", position)
+        if line[position - 1] != "\\":
+            break
+        position += 1
+    key = line[:position]
+    fields, timestamp = line[position + 1:].split(" ")
+    return key, fields, timestamp
+
+
+def split_key(key: str) -> Tuple[str, str]:
+    """Splits series key into measurement and tag set
+    (the latter keeps its leading comma, if any)"""
+    position = 0
+    while True:
+        position = key.find(",", position)
+        if position == -1:
+            return key, ""
+        if key[position - 1] != "\\":
+            return key[:position], key[position:]
+        position += 1
+
+
+_ESCAPED = re.compile(r"\\([, =])")
+_UNESCAPED_COMMA = re.compile(r"(?<!\\),")
+_UNESCAPED_EQUALS = re.compile(r"(?<!\\)=")
+
+
+def unescape(value: str) -> str:
+    """Reverse of escape_measurement/escape_tag"""
+    return _ESCAPED.sub(r"\1", value)
+
+
+def split_tags(tags: str) -> Dict[str, str]:
+    """Parses tag set (as returned by split_key) into unescaped
+    tag keys and values
+
+    :raises ValueError: if a tag has no value
+    """
+    parsed = {}
+    for pair in _UNESCAPED_COMMA.split(tags)[1:]:
+        key, value = _UNESCAPED_EQUALS.split(pair, 1)
+        parsed[unescape(key)] = unescape(value)
+    return parsed
+
+
+class LineBuffer:
+    """Reusable buffer of encoded line protocol entries. Samples of
+    frame records are formatted into line templates encoded in advance
+    by the registry, so that only field values and timestamps are
+    appended per sample, no string is built per entry
+    """
+
+    __slots__ = ("buffer", "lines")
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.lines = 0
+
+    def __len__(self) -> int:
+        return self.lines
+
+    def add(self, samples: Samples) -> int:
+        """Appends samples present in the record,
+        returns the number of entries appended"""
+        record, series = samples
+        registry = record.registry
+        offsets = registry.offsets
+        values = record.values
+        present = record.present
+        timestamp = b" %d\n" % record.ns
+        buffer = self.buffer
+        appended = 0
+        for index in series:
+            count = present[index]
+            if not count:
+                continue
+            offset = offsets[index]
+            buffer += registry.template(index, count) % tuple(
+                values[offset:offset + count]
+            )
+            buffer += timestamp
+            appended += 1
+        self.lines += appended
+        return appended
+
+    def append(self, line: str):
+        # an entry formatted elsewhere (e.g., rollups, stats)
+        self.buffer += line.encode()
+        self.buffer += b"\n"
+        self.lines += 1
+
+    def take(self) -> bytes:
+        """Returns buffer contents (without the trailing newline)
+        and resets it"""
+        if not self.buffer:
+            return b""
+        del self.buffer[-1]
+        payload = bytes(self.buffer)
+        self.buffer.clear()
+        self.lines = 0
+        return payload
+
+
+class FrameRows(Generic[T]):
+    """Collects rows of several sections which belong to the same
+    interval (e.g., DISKREAD, DISKWRITE and DISKBUSY), so that they
+    can be emitted together. Rows are keyed by T-code, thus frames
+    parsed concurrently do not interfere. Incomplete intervals are
+    evicted once there are more than `max_pending` of them
+    """
+
+    def __init__(self, sections: Iterable[str], max_pending: int = 64):
+        self.sections = frozenset(sections)
+        self.max_pending = max_pending
+        self.pending: Dict[str, Dict[str, T]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, section: str, code: str, row: T) -> Optional[Dict[str, T]]:
+        """Stores the row, returns rows of all the sections
+        once the interval is complete"""
+        with self.lock:
+            rows = self.pending.setdefault(code, {})
+            rows[section] = row
+            if rows.keys() == self.sections:
+                return self.pending.pop(code)
+            if len(self.pending) > self.max_pending:
+                # rows of the oldest interval will never be complete
+                del self.pending[next(iter(self.pending))]
+            return None
+
+
+def render_samples(samples: Samples) -> List[str]:
+    """Line protocol entries of the samples present in the record
+    (field values are written as floats)"""
+    record, series = samples
+    registry = record.registry
+    values = record.values
+    present = record.present
+    entries = []
+    for index in series:
+        count = present[index]
+        if not count:
+            continue
+        offset = registry.offsets[index]
+        fields = ",".join(
+            f"{name}={values[offset + column]!r}"
+            for column, name in enumerate(registry.fields[index][:count])
+        )
+        entries.append(f"{registry.keys[index]} {fields} {record.ns}")
+    return entries
+
+
+def render(entries: Iterable[Entry]) -> List[str]:
+    """Line protocol entries of a parsed stream (samples are rendered,
+    entries are passed as they are), e.g., for consumers of strings"""
+    rendered: List[str] = []
+    for entry in entries:
+        if isinstance(entry, str):
+            rendered.append(entry)
+        else:
+            rendered.extend(render_samples(entry))
+    return rendered
+
@@ -0,0 +1,251 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
+import struct
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from . import logger_factory
+from .stats import stats
+
+log = logger_factory("follow")
+
+# inotify(7) event masks
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+# struct inotify_event header (wd, mask, cookie, len), followed by the name
+EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Minimal inotify binding (via libc), events are only used as
+    wake-ups, apart from telling whether a file has appeared
+
+    :raises OSError: if inotify is not available
+    """
+
+    def __init__(self, directory: str) -> None:
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, directory.encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"can't watch {directory}")
+
+    def wait(self, timeout: float) -> bool:
+        """Waits for events, returns True if a file was created
+        in (or moved into) the directory"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        created = False
+        try:
+            while True:
+                events = os.read(self.fd, 1 << 14)
+                if not events:
+                    break
+                created = created or self._created(events)
+        except BlockingIOError:
+            pass
+        return created
+
+    @staticmethod
+    def _created(events: bytes) -> bool:
+        offset = 0
+        while offset + EVENT.size <= len(events):
+            _, mask, _, length = EVENT.unpack_from(events, offset)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                return True
+            offset += EVENT.size + length
+        return False
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    def wait(self, timeout: float) -> bool:
+        # new files are only noticed by periodic rescans
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class FileFollower:
+    """Follows nmon output written to files (`nmon -f`), like `tail -F`.
+    `path` is either a file or a glob pattern (e.g., `/var/log/nmon/*.nmon`)
+    in which case the newest matching file is followed, and once a newer
+    one appears (nmon is restarted daily), the follower switches to it.
+    A replaced or truncated file is read again from its start.
+
+    Only appended bytes are read. The reader wakes up on inotify events
+    (polls every `poll_interval` seconds if inotify is not available).
+    Partial trailing lines are held back until complete, and so are the
+    lines of a frame: it is released once the next ZZZZ line is read or
+    the file has not grown for `settle` seconds (nmon writes a frame at
+    once, thus the latter keeps the latency low)
+
+    While a file is followed, only its own status is checked on wake-ups.
+    The pattern is matched again once inotify reports a new file in the
+    directory, or every `rescan_interval` seconds (e.g., when polling)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = 1.0,
+        settle: float = 0.2,
+        idle_timeout: Optional[float] = None,
+        rescan_interval: float = 10.0,
+        chunk_size: int = 1 << 16,
+        timestamp_prefix: str = "ZZZZ",
+    ) -> None:
+        if poll_interval <= 0 or settle < 0:
+            raise ValueError("invalid follow intervals")
+        self.path = path
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.idle_timeout = idle_timeout
+        self.rescan_interval = rescan_interval
+        self.chunk_size = chunk_size
+        self.timestamp_prefix = timestamp_prefix
+        self.stopped = threading.Event()
+        self.current: Optional[str] = None
+        self.scanned = 0.0
+        # set while the lines of the last yielded file are not consumed
+        self.following = False
+
+    def stop(self):
+        """Makes the iteration finish (the held back frame is released)"""
+        self.stopped.set()
+
+    def newest(self) -> Optional[str]:
+        """Newest file matching the path (by modification time)"""
+        self.scanned = time.monotonic()
+        candidates = []
+        for path in glob.glob(self.path):
+            try:
+                candidates.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                continue
+        return max(candidates)[1] if candidates else None
+
+    def _watcher(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            return _Inotify(directory)
+        except OSError as e:
+            log.warning(f"inotify is not available ({e}), polling")
+            return _Poller()
+
+    def files(self) -> Iterator[Iterator[str]]:
+        """Iterates over followed files, each one is an iterator over its
+        lines (it should be consumed before the next file is taken)
+
+        :raises RuntimeError: if the next file is requested while
+            the previous one is not consumed
+        """
+        watcher = self._watcher()
+        try:
+            idle_since = time.monotonic()
+            while not self.stopped.is_set():
+                path = self.newest()
+                if path is None:
+                    if self._idle(idle_since):
+                        break
+                    watcher.wait(self.poll_interval)
+                    continue
+                if self.current is not None:
+                    stats.incr("follow_rotations")
+                log.info(f"following {path}")
+                self.current = path
+                # returns once the file is rotated, or the follower
+                # is stopped (explicitly or by the idle timeout)
+                self.following = True
+                yield self._follow(path, watcher)
+                if self.following:
+                    raise RuntimeError(f"lines of {path} are not consumed")
+        finally:
+            watcher.close()
+
+    def lines(self) -> Iterator[str]:
+        for lines in self.files():
+            yield from lines
+
+    def _idle(self, since: float) -> bool:
+        return (
+            self.idle_timeout is not None
+            and time.monotonic() - since >= self.idle_timeout
+        )
+
+    def _rotated(
+        self, path: str, inode: int, position: int, rescan: bool
+    ) -> bool:
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            return self.newest() is not None
+        if status.st_ino != inode or status.st_size < position:
+            return True
+        # matching the pattern stats every file of the directory
+        if not rescan and (
+            time.monotonic() - self.scanned < self.rescan_interval
+        ):
+            return False
+        newest = self.newest()
+        return newest is not None and newest != path
+
+    def _follow(self, path: str, watcher) -> Iterator[str]:
+        frame: List[str] = []
+        tail = b""
+        last_data = time.monotonic()
+        created = False
+        with open(path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            while True:
+                chunk = f.read(self.chunk_size)
+                if chunk:
+                    last_data = time.monotonic()
+                    lines = (tail + chunk).split(b"\n")
+                    tail = lines.pop()
+                    for raw in lines:
+                        line = raw.decode(errors="replace").rstrip("\r")
+                        if line.startswith(self.timestamp_prefix) and frame:
+                            yield from frame
+                            frame = []
+                        frame.append(line)
+                    continue
+
+                # reached the end of written data
+                quiet = time.monotonic() - last_data
+                if frame and quiet >= self.settle:
+                    yield from frame
+                    frame = []
+                if self._idle(last_data):
+                    self.stop()
+                if self.stopped.is_set() or self._rotated(
+                    path, inode, f.tell(), created
+                ):
+                    break
+                timeout = self.poll_interval
+                if frame:
+                    timeout = min(timeout, self.settle - quiet)
+                created = watcher.wait(max(timeout, 0.0))
+        yield from frame
+        if tail:
+            # never completed (the file was rotated or truncated)
+            stats.incr("follow_partial_lines")
+            log.warning(f"{path}: dropped incomplete line {tail[:64]!r}")
+        self.following = False
@@ -0,0 +1,250 @@
+import threading
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import Dict, Generic, List, Optional, TypeVar
+
+import reactivex as rx
+from reactivex.abc import ObserverBase, SchedulerBase
+from reactivex.observable import Observable
+
+from . import logger_factory
+from .cardinality import SeriesFilters
+from .encoder import render
+from .registry import Entry
+from .scraper import NmonHeaderParser, NmonParser, is_header_line
+from .stats import stats
+
+log = logger_factory("pipe")
+
+T = TypeVar("T")
+
+
+class FrameParser:
+    """Parser with collectors registered from given header lines.
+    Frames are parsed independently of each other
+    """
+
+    def __init__(
+        self,
+        header: List[str],
+        measurement: str,
+        run_id: str,
+        filters: Optional[SeriesFilters] = None,
+        disk_fields: bool = False,
+    ):
+        self.parser = NmonParser(timestamp_prefix="ZZZZ")
+        header_parser = NmonHeaderParser(
+            self.parser,
+            measurement,
+            run_id,
+            filters=filters,
+            disk_fields=disk_fields,
+        )
+        for line in header:
+            header_parser.parse(line)
+
+    def parse(self, frame: List[str]) -> List[Entry]:
+        samples = self.parser.parse_frame(frame)
+        return [samples] if samples is not None else []
+
+
+# per-process parser state for process pools
+_frame_parser: Optional[FrameParser] = None
+
+
+def _init_frame_worker(
+    header: List[str],
+    measurement: str,
+    run_id: str,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+):
+    global _frame_parser
+    _frame_parser = FrameParser(
+        header, measurement, run_id, filters, disk_fields
+    )
+
+
+def _parse_frame(frame: List[str]) -> List[str]:
+    # records are bound to the worker's registry, thus
+    # line protocol entries are sent back to the main process
+    assert _frame_parser is not None, "worker is not initialized"
+    return render(_frame_parser.parse(frame))
+
+
+class ReorderBuffer(Generic[T]):
+    """Collects results completed out of order and
+    releases them in the order of sequence numbers
+    """
+
+    def __init__(self) -> None:
+        self.pending: Dict[int, T] = {}
+        self.next_sequence = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def push(self, sequence: int, item: T) -> List[T]:
+        self.pending[sequence] = item
+        ready = []
+        while self.next_sequence in self.pending:
+            ready.append(self.pending.pop(self.next_sequence))
+            self.next_sequence += 1
+        return ready
+
+
+def parallel_frame_pipeline(
+    source: Observable[str],
+    run_id: str,
+    measurement: str = "perf-metrics",
+    workers: int = 4,
+    executor: str = "thread",
+    max_pending: Optional[int] = None,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+) -> Observable[Entry]:
+    """Cuts the stream into frames (ZZZZ line with the records
+    following it) and parses them on a pool. Results are emitted
+    in the order of frames. Lines preceding the first frame are
+    treated as the header, as well as header lines of the first frame
+    (the pool is started once it is complete)
+
+    :param source: nmon output lines (without trailing newlines)
+    :type source: Observable[str]
+    :param run_id: run tag
+    :type run_id: str
+    :param measurement: measurement name suffix
+    :type measurement: str, optional
+    :param workers: pool size
+    :type workers: int, optional
+    :param executor: either "thread" or "process"
+    :type executor: str, optional
+    :param max_pending: max frames in flight, defaults to 4 * workers
+    :type max_pending: Optional[int], optional
+    :param filters: include/exclude patterns of columns per section
+    :type filters: Optional[SeriesFilters], optional
+    :param disk_fields: emit read/write/busy of a disk as a single point
+    :type disk_fields: bool, optional
+    :return: samples of frame records (thread pool) or
+        line protocol entries (process pool)
+    :rtype: Observable[Entry]
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"invalid executor: {executor}")
+    max_pending = max_pending or 4 * workers
+
+    def subscribe(
+        observer: ObserverBase[Entry],
+        scheduler: Optional[SchedulerBase] = None,
+    ):
+        header: List[str] = []
+        frame: List[str] = []
+        pool: Optional[Executor] = None
+        frame_parser: Optional[FrameParser] = None
+        reorder: ReorderBuffer[List[Entry]] = ReorderBuffer()
+        # emission lock keeps observer calls serialized,
+        # semaphore bounds the number of frames in flight
+        lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(max_pending)
+        sequence = 0
+        failed = False
+        stats.gauge("queue_reorder", lambda: len(reorder))
+
+        def start_pool() -> Executor:
+            nonlocal frame_parser
+            if executor == "process":
+                return ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_frame_worker,
+                    initargs=(
+                        header,
+                        measurement,
+                        run_id,
+                        filters,
+                        disk_fields,
+                    ),
+                )
+            frame_parser = FrameParser(
+                header, measurement, run_id, filters, disk_fields
+            )
+            return ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="frame-parser",
+            )
+
+        def on_done(number: int, future: "Future[List[Entry]]"):
+            nonlocal failed
+            with lock:
+                if failed:
+                    in_flight.release()
+                    return
+                try:
+                    ready = reorder.push(number, future.result())
+                except Exception as e:
+                    failed = True
+                    # frames waiting for reordering are dropped
+                    for _ in range(len(reorder) + 1):
+                        in_flight.release()
+                    reorder.pending.clear()
+                    observer.on_error(e)
+                    return
+                for entries in ready:
+                    for entry in entries:
+                        observer.on_next(entry)
+                    in_flight.release()
+
+        def submit(lines: List[str]):
+            nonlocal sequence, pool
+            if pool is None:
+                # some headers (e.g., VM) are written within the first frame
+                header.extend(filter(is_header_line, lines))
+                pool = start_pool()
+            in_flight.acquire()
+            if frame_parser is not None:
+                future = pool.submit(frame_parser.parse, lines)
+            else:
+                future = pool.submit(_parse_frame, lines)
+            number = sequence
+            sequence += 1
+            future.add_done_callback(lambda f: on_done(number, f))
+
+        def on_next(line: str):
+            nonlocal frame
+            if line.startswith("ZZZZ"):
+                if frame:
+                    submit(frame)
+                frame = [line]
+            elif frame:
+                frame.append(line)
+            else:
+                header.append(line)
+
+        def shutdown():
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        def on_error(e: Exception):
+            shutdown()
+            with lock:
+                observer.on_error(e)
+
+        def on_completed():
+            if frame:
+                submit(frame)
+            shutdown()
+            with lock:
+                if not failed:
+                    observer.on_completed()
+
+        return source.subscribe(
+            on_next=on_next,
+            on_error=on_error,
+            on_completed=on_completed,
+            scheduler=scheduler,
+        )
+
+    return rx.create(subscribe)
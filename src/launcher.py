@@ -0,0 +1,167 @@
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+from collections import Counter
+from typing import Iterator, Optional, Sequence, Tuple
+
+from . import logger_factory
+from .stats import stats
+
+log = logger_factory("launcher")
+
+
+class NmonLauncher:
+    """Runs nmon writing into a FIFO owned by the launcher (a replacement
+    for scripts/nmon-to-stdout.sh). The FIFO is read in large binary
+    chunks and split into lines here, lines with rejected prefixes are
+    dropped before they are decoded. nmon is stopped with SIGUSR2
+    (its graceful shutdown) using the PID it prints on start
+    """
+
+    def __init__(
+        self,
+        interval: int = 1,
+        count: int = 120,
+        nmon: str = "nmon",
+        extra_args: Sequence[str] = (),
+        reject: Tuple[bytes, ...] = (b"AAA", b"BBBP"),
+        chunk_size: int = 1 << 16,
+    ) -> None:
+        if interval < 1 or count < 1:
+            raise ValueError(f"invalid nmon -s {interval} -c {count}")
+        self.interval = interval
+        self.count = count
+        self.nmon = nmon
+        self.extra_args = list(extra_args)
+        self.reject = reject
+        self.chunk_size = chunk_size
+        self.directory: Optional[str] = None
+        self.pid: Optional[int] = None
+
+    @property
+    def fifo(self) -> str:
+        assert self.directory is not None, "launcher is not started"
+        return os.path.join(self.directory, "source")
+
+    def command(self) -> Sequence[str]:
+        return [
+            self.nmon,
+            "-F",
+            self.fifo,
+            "-p",
+            "-s",
+            str(self.interval),
+            "-c",
+            str(self.count),
+            *self.extra_args,
+        ]
+
+    def start(self) -> "NmonLauncher":
+        """Creates the FIFO and starts nmon, which daemonizes itself
+        and prints the PID of the background process
+
+        :raises RuntimeError: if nmon fails to start
+        """
+        self.directory = tempfile.mkdtemp(prefix="nmon-")
+        os.mkfifo(self.fifo)
+        try:
+            process = subprocess.Popen(
+                self.command(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+            )
+            assert process.stdout is not None
+            # the background process might keep stdout open,
+            # thus only the first line (its PID) is read
+            with process.stdout:
+                first = process.stdout.readline()
+            if process.wait(timeout=30) != 0:
+                raise RuntimeError(f"exit code {process.returncode}")
+            self.pid = int(first.split()[0])
+        except (
+            RuntimeError,
+            OSError,
+            IndexError,
+            ValueError,
+            subprocess.SubprocessError,
+        ) as e:
+            self.cleanup()
+            raise RuntimeError(f"failed to start nmon: {e}") from e
+        log.info(f"nmon started (pid {self.pid}), writes to {self.fifo}")
+        return self
+
+    def lines(self) -> Iterator[str]:
+        """Iterates over nmon output lines (without newlines)
+        until nmon closes the FIFO. nmon is stopped if the
+        iteration is interrupted
+        """
+        if self.pid is None:
+            self.start()
+        tail = b""
+        counts: Counter = Counter()
+        try:
+            with open(self.fifo, "rb", buffering=0) as fifo:
+                while True:
+                    chunk = fifo.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    lines = (tail + chunk).split(b"\n")
+                    tail = lines.pop()
+                    yield from self._accept(lines, counts)
+                    # counts are reported once per chunk
+                    self._report(counts)
+            if tail:
+                yield from self._accept([tail], counts)
+                self._report(counts)
+        finally:
+            self.stop()
+
+    def _accept(self, lines: Sequence[bytes], counts: Counter):
+        for line in lines:
+            counts[line.partition(b",")[0]] += 1
+            if line.startswith(self.reject):
+                counts[None] += 1
+                continue
+            yield line.decode(errors="replace")
+
+    def _report(self, counts: Counter):
+        filtered = counts.pop(None, 0)
+        if filtered:
+            stats.incr("lines_filtered", filtered)
+        stats.incr("lines_read", sum(counts.values()))
+        for prefix, count in counts.items():
+            stats.incr(f"lines_{prefix.decode(errors='replace')}", count)
+        counts.clear()
+
+    def running(self) -> bool:
+        if self.pid is None:
+            return False
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def stop(self):
+        """Stops nmon (if it is still running) and removes the FIFO"""
+        if self.running():
+            assert self.pid is not None
+            log.info(f"stopping nmon (pid {self.pid})")
+            os.kill(self.pid, signal.SIGUSR2)
+        self.pid = None
+        self.cleanup()
+
+    def cleanup(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self) -> "NmonLauncher":
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
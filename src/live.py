@@ -0,0 +1,337 @@
+import bisect
+import datetime
+import json
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from . import logger_factory
+from .encoder import split_entry, split_key, split_tags
+from .registry import Entry, Samples, SeriesRegistry
+from .stats import stats
+
+log = logger_factory("live")
+
+# [value, epoch milliseconds] pairs, as SimpleJSON expects them
+DataPoints = List[List[float]]
+
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent samples of a series.
+    Timestamps and values are kept in preallocated arrays, the oldest
+    sample is overwritten once the buffer is full
+    """
+
+    __slots__ = ("times", "values", "head", "count")
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError(f"invalid capacity: {capacity}")
+        self.times = array("q", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        # index of the oldest sample
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> int:
+        # timestamps in chronological order (used by bisect)
+        return self.times[(self.head + index) % len(self.times)]
+
+    def append(self, ns: int, value: float):
+        capacity = len(self.times)
+        if self.count < capacity:
+            position = (self.head + self.count) % capacity
+            self.count += 1
+        else:
+            position = self.head
+            self.head = (self.head + 1) % capacity
+        self.times[position] = ns
+        self.values[position] = value
+
+    def window(self, start: int, end: int) -> List[Tuple[int, float]]:
+        """Samples with start <= timestamp <= end (samples are
+        expected to be appended in timestamp order)"""
+        first = bisect.bisect_left(self, start)
+        last = bisect.bisect_right(self, end)
+        capacity = len(self.times)
+        return [
+            (self.times[position], self.values[position])
+            for position in (
+                (self.head + index) % capacity for index in range(first, last)
+            )
+        ]
+
+
+def mean_buckets(
+    samples: List[Tuple[int, float]], interval_ms: int
+) -> DataPoints:
+    """Averages samples over buckets of `interval_ms` (aligned to the
+    epoch), points are stamped with the start of their bucket"""
+    if interval_ms <= 0:
+        return [[value, ns // 1_000_000] for ns, value in samples]
+    sums: Dict[int, List[float]] = {}
+    for ns, value in samples:
+        bucket = ns // 1_000_000 // interval_ms * interval_ms
+        total = sums.setdefault(bucket, [0.0, 0])
+        total[0] += value
+        total[1] += 1
+    return [
+        [total / count, bucket]
+        for bucket, (total, count) in sorted(sums.items())
+    ]
+
+
+class LiveStore:
+    """Keeps the last `capacity` samples of each series field in memory
+    (a RingBuffer per target), so that live panels can be served without
+    querying InfluxDB. Targets are named `<series key> <field>`, e.g.,
+    `cpu-perf-metrics,run=0,cpus=CPU_ALL user`. Once `max_targets` are
+    known, new ones are ignored (counted as `live_rejected_targets`).
+    The first sample of each run is kept as an annotation. Buffers of
+    series of frame records are looked up by series id, not by name
+    """
+
+    def __init__(self, capacity: int = 600, max_targets: int = 100_000):
+        self.capacity = capacity
+        self.max_targets = max_targets
+        self.lock = threading.Lock()
+        self.buffers: Dict[str, RingBuffer] = {}
+        # (epoch milliseconds, run tag)
+        self.runs: List[Tuple[int, str]] = []
+        self.known_keys: Dict[str, str] = {}
+        # registry -> buffers of the fields present so far per series id
+        # (None in place of rejected targets)
+        self.records: Dict[
+            SeriesRegistry, List[Optional[List[Optional[RingBuffer]]]]
+        ] = {}
+        stats.gauge("live_targets", lambda: len(self.buffers))
+
+    def _buffer(self, target: str) -> Optional[RingBuffer]:
+        buffer = self.buffers.get(target)
+        if buffer is None:
+            if len(self.buffers) >= self.max_targets:
+                stats.incr("live_rejected_targets")
+                return None
+            buffer = self.buffers[target] = RingBuffer(self.capacity)
+        return buffer
+
+    def add(self, entry: Entry):
+        """Stores fields of a line protocol entry or samples of a frame
+        record (can be used as an observer of the parsed stream)"""
+        if not isinstance(entry, str):
+            self.add_samples(entry)
+            return
+        line = entry
+        try:
+            key, fields, timestamp = split_entry(line)
+            ns = int(timestamp)
+            values = [
+                (name, float(value.rstrip("i")))
+                for name, _, value in (
+                    field.partition("=") for field in fields.split(",")
+                )
+            ]
+        except ValueError as e:
+            stats.incr("live_parse_errors")
+            log.error(f"can't store '{line}': {e}")
+            return
+        with self.lock:
+            if key not in self.known_keys:
+                self._new_key(key, ns)
+            for name, value in values:
+                buffer = self._buffer(f"{key} {name}")
+                if buffer is not None:
+                    buffer.append(ns, value)
+
+    def add_samples(self, samples: Samples):
+        record, series = samples
+        registry = record.registry
+        ns = record.ns
+        values = record.values
+        present = record.present
+        with self.lock:
+            targets = self.records.setdefault(registry, [])
+            if len(targets) < len(registry):
+                targets.extend([None] * (len(registry) - len(targets)))
+            for index in series:
+                count = present[index]
+                if not count:
+                    continue
+                buffers = targets[index]
+                if buffers is None or len(buffers) < count:
+                    key = registry.keys[index]
+                    if key not in self.known_keys:
+                        self._new_key(key, ns)
+                    buffers = targets[index] = [
+                        self._buffer(f"{key} {name}")
+                        for name in registry.fields[index][:count]
+                    ]
+                offset = registry.offsets[index]
+                for column, buffer in enumerate(buffers[:count], offset):
+                    if buffer is not None:
+                        buffer.append(ns, values[column])
+
+    def _new_key(self, key: str, ns: int):
+        _, tags = split_key(key)
+        run = split_tags(tags).get("run", "")
+        self.known_keys[key] = run
+        if run and run not in {name for _, name in self.runs}:
+            self.runs.append((ns // 1_000_000, run))
+
+    def search(self, target: str = "") -> List[str]:
+        """Targets containing the given substring"""
+        with self.lock:
+            return sorted(name for name in self.buffers if target in name)
+
+    def query(
+        self, target: str, start_ms: int, end_ms: int, interval_ms: int = 0
+    ) -> DataPoints:
+        """Points of the target within [start, end], averaged over
+        `interval_ms` buckets (raw points if it is not positive)"""
+        with self.lock:
+            buffer = self.buffers.get(target)
+            if buffer is None:
+                return []
+            samples = buffer.window(
+                start_ms * 1_000_000, end_ms * 1_000_000 + 999_999
+            )
+        return mean_buckets(samples, interval_ms)
+
+    def annotations(
+        self, start_ms: int, end_ms: int, query: str = ""
+    ) -> List[Tuple[int, str]]:
+        """Starts of runs (matching the query) within [start, end]"""
+        with self.lock:
+            return [
+                (ms, run)
+                for ms, run in self.runs
+                if start_ms <= ms <= end_ms and query in run
+            ]
+
+
+def epoch_milliseconds(value: str) -> int:
+    # grafana sends ranges as ISO 8601 strings in UTC
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+class SimpleJsonHandler(BaseHTTPRequestHandler):
+    """Endpoints of grafana-simple-json-datasource:
+    `/` (connection test), `/search`, `/query` and `/annotations`"""
+
+    server: "LiveServer"
+
+    def do_GET(self):
+        self._reply(200, "OK")
+
+    def do_POST(self):
+        routes = {
+            "/search": self._search,
+            "/query": self._query,
+            "/annotations": self._annotations,
+        }
+        route = routes.get(self.path.split("?", 1)[0].rstrip("/"))
+        if route is None:
+            self._reply(404, {"error": f"unknown endpoint: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            self._reply(200, route(request))
+        except (ValueError, KeyError, TypeError) as e:
+            stats.incr("live_bad_requests")
+            self._reply(400, {"error": str(e)})
+
+    def _search(self, request: dict) -> List[str]:
+        return self.server.store.search(request.get("target", ""))
+
+    def _range(self, request: dict) -> Tuple[int, int]:
+        return (
+            epoch_milliseconds(request["range"]["from"]),
+            epoch_milliseconds(request["range"]["to"]),
+        )
+
+    def _query(self, request: dict) -> List[dict]:
+        start, end = self._range(request)
+        interval = int(request.get("intervalMs", 0))
+        return [
+            {
+                "target": target["target"],
+                "datapoints": self.server.store.query(
+                    target["target"], start, end, interval
+                ),
+            }
+            for target in request.get("targets", [])
+            if target.get("target")
+        ]
+
+    def _annotations(self, request: dict) -> List[dict]:
+        start, end = self._range(request)
+        annotation = request.get("annotation", {})
+        return [
+            {
+                "annotation": annotation,
+                "time": ms,
+                "title": f"run {run} started",
+                "tags": ["run"],
+                "text": run,
+            }
+            for ms, run in self.server.store.annotations(
+                start, end, annotation.get("query") or ""
+            )
+        ]
+
+    def _reply(self, status: int, body: object):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *_):
+        pass
+
+
+class LiveServer(ThreadingHTTPServer):
+    """Serves the store over SimpleJSON protocol on a background thread"""
+
+    daemon_threads = True
+
+    def __init__(
+        self, store: LiveStore, host: str = "0.0.0.0", port: int = 3003
+    ) -> None:
+        super().__init__((host, port), SimpleJsonHandler)
+        self.store = store
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "LiveServer":
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="live-server", daemon=True
+        )
+        self.thread.start()
+        log.info(f"serving live data on {self.url}")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self) -> "LiveServer":
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
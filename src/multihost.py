@@ -0,0 +1,230 @@
+import queue
+import shlex
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from . import logger_factory
+from .cardinality import SeriesFilters
+from .client import stream_subprocess_stdout
+from .follow import FileFollower
+from .pipeline import line_dispatcher
+from .registry import Entry, SeriesRegistry
+from .schema import SchemaCache, cached_schema
+
+log = logger_factory("multihost")
+
+# marks the end of a source stream
+_DONE = object()
+# marks the start of a followed file (it has its own header)
+_NEW_FILE = object()
+
+
+@dataclass
+class NmonSource:
+    """Single nmon output source. Either a command (local script,
+    ssh command line), a path (FIFO, file read once) or a followed
+    file (`nmon -f` output tailed with FileFollower, a glob pattern
+    switches to the newest matching file)
+
+    Specification format: `HOST=COMMAND`, `HOST=file:PATH`,
+    `HOST=fifo:PATH` or `HOST=follow:PATH`
+    """
+
+    host: str
+    command: Optional[List[str]] = None
+    path: Optional[str] = None
+    follow: bool = False
+    # FileFollower options (e.g., poll_interval, idle_timeout)
+    follow_options: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_spec(cls, spec: str, **follow_options) -> "NmonSource":
+        host, sep, target = spec.partition("=")
+        if not sep or not host or not target:
+            raise ValueError(f"invalid source: {spec}. expected HOST=SOURCE")
+        if target.startswith("follow:"):
+            return cls(
+                host,
+                path=target[len("follow:"):],
+                follow=True,
+                follow_options=follow_options,
+            )
+        for scheme in ("file:", "fifo:"):
+            if target.startswith(scheme):
+                return cls(host, path=target[len(scheme):])
+        return cls(host, command=shlex.split(target))
+
+    def files(self) -> Iterator[Iterator[str]]:
+        """Outputs of the source, each one starts with its own header.
+        Followed files are rotated, other sources have a single output
+        """
+        if self.follow:
+            assert self.path is not None
+            yield from FileFollower(self.path, **self.follow_options).files()
+            return
+        yield self.lines()
+
+    def lines(self) -> Iterator[str]:
+        if self.follow:
+            for lines in self.files():
+                yield from lines
+            return
+        if self.path is not None:
+            # FIFOs are opened the same way, reads block until
+            # the writer sends more data or closes the pipe
+            with open(self.path, "r") as f:
+                yield from f
+            return
+        assert self.command is not None
+        yield from stream_subprocess_stdout(self.command)
+
+
+class _SourceState:
+    def __init__(
+        self,
+        source: NmonSource,
+        run_id: str,
+        measurement: str,
+        queue_size: int,
+        filters: Optional[SeriesFilters] = None,
+        disk_fields: bool = False,
+    ) -> None:
+        self.source = source
+        self.run_id = run_id
+        self.measurement = measurement
+        self.filters = filters
+        self.disk_fields = disk_fields
+        # series of the source's files keep their ids
+        self.registry = SeriesRegistry()
+        self.restart()
+        self.lines: "queue.Queue[object]" = queue.Queue(maxsize=queue_size)
+        self.finished = False
+
+    def restart(self):
+        # each source (and each of its followed files)
+        # has its own collectors and header state
+        self.dispatch = line_dispatcher(
+            self.run_id,
+            self.measurement,
+            tags={"host": self.source.host},
+            filters=self.filters,
+            disk_fields=self.disk_fields,
+            registry=self.registry,
+        )
+
+
+class MultiHostCollector:
+    """Ingests several nmon sources in a single process.
+    Each source is read by its own thread into a bounded queue,
+    parsing is done on the calling thread which visits sources in
+    round-robin fashion, taking at most `quantum` lines from each one
+    per turn (so a chatty host can't starve the others)
+    """
+
+    def __init__(
+        self,
+        sources: Iterable[NmonSource],
+        run_id: str,
+        write: Callable[[Entry], None],
+        measurement: str = "perf-metrics",
+        line_filter: Optional[Callable[[str], bool]] = None,
+        queue_size: int = 10000,
+        quantum: int = 256,
+        filters: Optional[SeriesFilters] = None,
+        disk_fields: bool = False,
+        schema_cache: Optional[SchemaCache] = None,
+    ) -> None:
+        self.states = [
+            _SourceState(
+                source, run_id, measurement, queue_size, filters, disk_fields
+            )
+            for source in sources
+        ]
+        hosts = [state.source.host for state in self.states]
+        if len(set(hosts)) != len(hosts):
+            raise ValueError(f"duplicate hosts: {hosts}")
+        self.run_id = run_id
+        self.write = write
+        self.line_filter = line_filter
+        # lets a restarted collector resume mid-run sources
+        self.schema_cache = schema_cache
+        self.quantum = quantum
+        # readers notify the scheduler when new lines are available
+        self.available = threading.Condition()
+
+    def _lines(self, state: _SourceState, output: Iterable[str]):
+        lines = (line.rstrip("\n") for line in output)
+        if self.line_filter is not None:
+            lines = filter(self.line_filter, lines)
+        if self.schema_cache is not None and not state.source.follow:
+            # followed files are read from their start (header included)
+            lines = cached_schema(
+                lines, self.schema_cache, state.source.host, self.run_id
+            )
+        return lines
+
+    def _put(self, state: _SourceState, item: object):
+        state.lines.put(item)
+        # the scheduler is only waiting if queues were empty
+        if state.lines.qsize() == 1:
+            with self.available:
+                self.available.notify()
+
+    def _read(self, state: _SourceState):
+        try:
+            for index, output in enumerate(state.source.files()):
+                if index:
+                    self._put(state, _NEW_FILE)
+                for line in self._lines(state, output):
+                    self._put(state, line)
+        except Exception as e:
+            log.error(f"{state.source.host}: source failed: {e}")
+        finally:
+            state.lines.put(_DONE)
+            with self.available:
+                self.available.notify()
+
+    def _drain(self, state: _SourceState) -> int:
+        taken = 0
+        while taken < self.quantum:
+            try:
+                line = state.lines.get_nowait()
+            except queue.Empty:
+                break
+            if line is _DONE:
+                log.info(f"{state.source.host}: source finished")
+                state.finished = True
+                break
+            if line is _NEW_FILE:
+                state.restart()
+                continue
+            taken += 1
+            for entry in state.dispatch(line):  # type: ignore
+                self.write(entry)
+        return taken
+
+    def run(self):
+        readers = [
+            threading.Thread(
+                target=self._read,
+                args=(state,),
+                name=f"reader-{state.source.host}",
+                daemon=True,
+            )
+            for state in self.states
+        ]
+        for reader in readers:
+            reader.start()
+
+        active = list(self.states)
+        while active:
+            taken = sum(self._drain(state) for state in active)
+            active = [state for state in active if not state.finished]
+            if not taken and active:
+                with self.available:
+                    # timeout guards against a missed notification
+                    self.available.wait(timeout=0.1)
+
+        for reader in readers:
+            reader.join()
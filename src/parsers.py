@@ -1,13 +1,29 @@
 import datetime
-from typing import Iterable, Optional
-from datetime import timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-from influxdb_client.client.write.point import EPOCH
-
-from . import LineProtocol, TimestampTuple, protect_from, logger_factory
+from . import (
+    Collector,
+    TimestampTuple,
+    epoch_nanoseconds,
+    protect_from,
+    logger_factory,
+)
+from .encoder import FrameRows, escape_tag, series_key
+from .registry import FrameRecord, SeriesRegistry
 
 log = logger_factory("line-proto")
 
+# fields of the series, in the order of record columns
+CPU_FIELDS = ("user", "sys", "wait", "idle", "steal")
+MEM_FIELDS = (
+    "memtotal", "swaptotal", "memfree", "swapfree", "memshared",
+    "cached", "active", "buffers", "swapcached", "inactive",
+)
+# positions of MEM_FIELDS within MEM rows (high/low/bigfree are skipped)
+MEM_COLUMNS = (0, 3, 4, 7, 8, 9, 10, 12, 13, 14)
+DISK_FIELDS = ("read", "write", "busy")
+VALUE_FIELDS = ("value",)
+
 
 def to_influx_timestamp(dt: datetime.datetime) -> int:
     """Converts python datetime.datetime object
@@ -18,102 +34,149 @@ def to_influx_timestamp(dt: datetime.datetime) -> int:
     :return: timestep as integer value
     :rtype: int
     """
-    time = (dt.astimezone(timezone.utc) - EPOCH).total_seconds() * 1e9
-    return int(time)
+    return epoch_nanoseconds(dt)
+
+
+def register(
+    registry: SeriesRegistry,
+    keys: Iterable[Optional[str]],
+    fields: Sequence[str],
+) -> List[Optional[Tuple[int, int]]]:
+    # (series id, offset of the first column) per key,
+    # series of filtered out columns (None) are not registered
+    slots: List[Optional[Tuple[int, int]]] = []
+    for key in keys:
+        if key is None:
+            slots.append(None)
+            continue
+        series = registry.register(key, fields)
+        slots.append((series, registry.offsets[series]))
+    return slots
+
+
+def series_ids(slots: Iterable[Optional[Tuple[int, int]]]) -> Tuple[int, ...]:
+    return tuple(slot[0] for slot in slots if slot is not None)
 
 
 def nmon_cpu_mertic_collector(
-    measurement: str, run_id: str, cpu_id: str
-) -> LineProtocol:
+    registry: SeriesRegistry,
+    measurement: str,
+    run_id: str,
+    cpu_id: str,
+    tags: Optional[Dict[str, str]] = None,
+) -> Collector:
     """Factory utility for CPU metric collection
-    Creates a line protocol for parsing nmon outputs
+    Creates a collector filling frame records from nmon outputs
 
+    :param registry: registry of the parser's series
+    :type registry: SeriesRegistry
     :param measurement: measurement name in influx
     :type measurement: str
     :param run_name: tag specifying run parameters
     :type run_name: str
     :param cpu_id: core number/core average
     :type cpu_id: str
-    :return: line protocol for cpu metric collection
-    :rtype: LineProtocol
+    :param tags: extra tags (e.g., host), defaults to None
+    :type tags: Optional[Dict[str, str]], optional
+    :return: collector of cpu metrics
+    :rtype: Collector
     """
+    ((series, offset),) = register(
+        registry,
+        [series_key(measurement, run=run_id, **(tags or {}), cpus=cpu_id)],
+        CPU_FIELDS,
+    )
+    ids = (series,)
 
     @protect_from(ValueError, "cpu")
     def parse_cpu_all(
-        line: str, ts: Optional[TimestampTuple]
-    ) -> Iterable[str]:
+        line: str, ts: Optional[TimestampTuple], record: FrameRecord
+    ) -> Sequence[int]:
         if ts is None:
             log.warning(f"cpu={cpu_id}: no ts specified")
-            return
+            return ()
         # CPU_ALL,CPU Total username,User%,Sys%,Wait%,Idle%,Steal%,Busy,CPUs
         # CPU_ALL,T0001,2.4,1.0,0.3,96.4,0.0,,12
-        index, *metrics = map(lambda x: x if x else 0, line.split(",", 8))
+        index, *metrics = line.split(",", 6)
         if index != ts.code:
             # timestep got shifted for some reason
-            return
-        user, sys, wait, idle, steal, *_ = map(float, metrics)
-
-        yield (
-            f"{measurement},"
-            f"run={run_id},cpus={cpu_id}"
-            f" user={user},sys={sys},wait={wait},idle={idle},steal={steal}"
-            f" {to_influx_timestamp(ts.datetime)}"
-        )
+            return ()
+        if len(metrics) < 5:
+            raise ValueError(f"expected 5 values, got {len(metrics)}")
+        values = record.values
+        for column in range(5):
+            values[offset + column] = float(metrics[column] or 0)
+        record.present[series] = 5
+        return ids
 
     return parse_cpu_all
 
 
-def nmon_mem_metric_collector(measurement: str, run_id: str) -> LineProtocol:
+def nmon_mem_metric_collector(
+    registry: SeriesRegistry,
+    measurement: str,
+    run_id: str,
+    tags: Optional[Dict[str, str]] = None,
+) -> Collector:
+    ((series, offset),) = register(
+        registry,
+        [series_key(measurement, run=run_id, **(tags or {}))],
+        MEM_FIELDS,
+    )
+    ids = (series,)
+
     @protect_from(ValueError, "mem")
-    def parse_mem(line: str, ts: Optional[TimestampTuple]) -> Iterable[str]:
+    def parse_mem(
+        line: str, ts: Optional[TimestampTuple], record: FrameRecord
+    ) -> Sequence[int]:
         if ts is None:
             log.warning("mem: no ts specified")
-            return
+            return ()
         # MEM,Memory MB shitbarn,memtotal,hightotal,lowtotal,swaptotal,
         # memfree,highfree,lowfree,swapfree,memshared,
         # cached,active,bigfree,buffers,swapcached,inactive
         # MEM,T0001,13841.9,-0.0,-0.0,0.0,7762.2,-0.0,-0.0,0.0,188.6,1981.8,780.1,-1.0,172.1,0.0,4513.8
-        index, *metrics = map(lambda x: x if x else 0, line.split(",", 16))
+        index, *metrics = line.split(",")
         if index != ts.code:
-            return
-        (
-            memtotal,
-            hightotal,
-            lowtotal,
-            swaptotal,
-            memfree,
-            highfree,
-            lowfree,
-            swapfree,
-            memshared,
-            cached,
-            active,
-            bigfree,
-            buffers,
-            swapcached,
-            inactive,
-        ) = map(float, metrics)
-        yield (
-            f"{measurement},"
-            f"run={run_id}"
-            f" memtotal={memtotal},swaptotal={swaptotal},"
-            f"memfree={memfree},swapfree={swapfree},"
-            f"memshared={memshared},cached={cached},"
-            f"active={active},buffers={buffers},"
-            f"swapcached={swapcached},inactive={inactive}"
-            f" {to_influx_timestamp(ts.datetime)}"
-        )
+            return ()
+        if len(metrics) != 15:
+            raise ValueError(f"expected 15 values, got {len(metrics)}")
+        values = record.values
+        for column, position in enumerate(MEM_COLUMNS):
+            values[offset + column] = float(metrics[position] or 0)
+        record.present[series] = len(MEM_COLUMNS)
+        return ids
 
     return parse_mem
 
 
 def nmon_disk_metric_collector(
-    measurement: str, run_id: str, disk_names: Iterable[str], mode: str
-) -> LineProtocol:
+    registry: SeriesRegistry,
+    measurement: str,
+    run_id: str,
+    disk_names: Iterable[Optional[str]],
+    mode: str,
+    tags: Optional[Dict[str, str]] = None,
+) -> Collector:
     modes = {"r": "read", "w": "write", "b": "busy"}
     if mode not in modes:
         raise ValueError(f"invalid mode: {mode}. expected 'r', 'w', 'b'")
     mode = modes[mode]
+    # series of all the disks are registered once,
+    # columns of filtered out disks (None) are skipped
+    slots = register(
+        registry,
+        [
+            series_key(
+                measurement, run=run_id, **(tags or {}), disk=name, mode=mode
+            )
+            if name is not None
+            else None
+            for name in disk_names
+        ],
+        VALUE_FIELDS,
+    )
+    ids = series_ids(slots)
 
     # nmon disk format is a bit challenging:
     # all system disks are listed as columns, thus we can't tell
@@ -123,22 +186,199 @@ def nmon_disk_metric_collector(
     # DISKBUSY,T0001,4.7,0.0,0.0,0.0,0.0,4.7,0.0
 
     @protect_from(ValueError, f"disk-{mode}")
-    def parse_disk(line: str, ts: Optional[TimestampTuple]) -> Iterable[str]:
+    def parse_disk(
+        line: str, ts: Optional[TimestampTuple], record: FrameRecord
+    ) -> Sequence[int]:
         if ts is None:
             log.warning("disk: no ts specified")
-            return
+            return ()
 
         index, *disk_metrics = line.split(",")
         if index != ts.code:
-            return
-
-        timestamp = to_influx_timestamp(ts.datetime)
-        for name, metric in zip(disk_names, disk_metrics):
-            yield (
-                f"{measurement},"
-                f"run={run_id},disk={name},mode={mode}"
-                f" value={metric}"
-                f" {timestamp}"
-            )
+            return ()
+
+        values, present = record.values, record.present
+        for slot, metric in zip(slots, disk_metrics):
+            if slot is None:
+                continue
+            series, offset = slot
+            values[offset] = float(metric or 0)
+            present[series] = 1
+        return ids
 
     return parse_disk
+
+
+def nmon_section_collector(
+    registry: SeriesRegistry,
+    measurement: str,
+    run_id: str,
+    columns: Sequence[Optional[str]],
+    column_tag: Optional[str] = None,
+    tags: Optional[Dict[str, str]] = None,
+) -> Collector:
+    """Table-driven collector for sections without dedicated parsers.
+    Columns are taken from the section header, data rows are mapped
+    onto them by position: either into fields of a single series, or,
+    if `column_tag` is given, into a series per column (tagged by
+    column name) with a single `value` field
+
+    :param registry: registry of the parser's series
+    :type registry: SeriesRegistry
+    :param measurement: measurement name in influx
+    :type measurement: str
+    :param run_id: tag specifying run parameters
+    :type run_id: str
+    :param columns: column names from the header, columns set to
+        None are skipped
+    :type columns: Sequence[Optional[str]]
+    :param column_tag: tag name for series per column layout
+    :type column_tag: Optional[str], optional
+    :param tags: extra tags (e.g., host), defaults to None
+    :type tags: Optional[Dict[str, str]], optional
+    :return: collector of the section metrics
+    :rtype: Collector
+    """
+    # NET,Network I/O username,lo-read-KB/s,eth0-read-KB/s,...
+    # NET,T0001,0.0,0.6,0.0,0.8
+    if column_tag is None:
+        # field names are escaped once
+        names = [escape_tag(name) for name in columns if name is not None]
+        ((series, offset),) = register(
+            registry,
+            [series_key(measurement, run=run_id, **(tags or {}))],
+            names,
+        )
+        ids: Tuple[int, ...] = (series,)
+        # column of each row position (None if skipped)
+        positions: List[Optional[int]] = []
+        column = 0
+        for name in columns:
+            if name is None:
+                positions.append(None)
+                continue
+            positions.append(column)
+            column += 1
+        slots: List[Optional[Tuple[int, int]]] = []
+    else:
+        slots = register(
+            registry,
+            [
+                series_key(
+                    measurement,
+                    run=run_id,
+                    **(tags or {}),
+                    **{column_tag: name},
+                )
+                if name is not None
+                else None
+                for name in columns
+            ],
+            VALUE_FIELDS,
+        )
+        ids = series_ids(slots)
+
+    @protect_from(ValueError, measurement)
+    def parse_fields(
+        line: str, ts: Optional[TimestampTuple], record: FrameRecord
+    ) -> Sequence[int]:
+        if ts is None:
+            log.warning(f"{measurement}: no ts specified")
+            return ()
+        index, *metrics = line.split(",")
+        if index != ts.code:
+            return ()
+        values = record.values
+        # rows may be shorter than the header, the fields present
+        # are the leading columns of the series
+        count = 0
+        for column, metric in zip(positions, metrics):
+            if column is None:
+                continue
+            values[offset + column] = float(metric or 0)
+            count += 1
+        record.present[series] = count
+        return ids
+
+    @protect_from(ValueError, measurement)
+    def parse_columns(
+        line: str, ts: Optional[TimestampTuple], record: FrameRecord
+    ) -> Sequence[int]:
+        if ts is None:
+            log.warning(f"{measurement}: no ts specified")
+            return ()
+        index, *metrics = line.split(",")
+        if index != ts.code:
+            return ()
+        values, present = record.values, record.present
+        for slot, metric in zip(slots, metrics):
+            if slot is None:
+                continue
+            series, offset = slot
+            values[offset] = float(metric or 0)
+            present[series] = 1
+        return ids
+
+    return parse_fields if column_tag is None else parse_columns
+
+
+def nmon_disk_fields_collector(
+    registry: SeriesRegistry,
+    measurement: str,
+    run_id: str,
+    disk_names: Iterable[Optional[str]],
+    mode: str,
+    rows: FrameRows[str],
+    tags: Optional[Dict[str, str]] = None,
+) -> Collector:
+    """Same as nmon_disk_metric_collector, but read, write and busy
+    values of a disk are fields of a single series, i.e.,
+    `measurement,run=...,disk=sda read=...,write=...,busy=...`.
+    Collectors of the three modes share `rows`, the record is filled
+    once all of them got the interval's row. Cuts the number of lines
+    (and series) for hosts with many disks threefold
+    """
+    modes = {"r": "read", "w": "write", "b": "busy"}
+    if mode not in modes:
+        raise ValueError(f"invalid mode: {mode}. expected 'r', 'w', 'b'")
+    mode = modes[mode]
+    slots = register(
+        registry,
+        [
+            series_key(measurement, run=run_id, **(tags or {}), disk=name)
+            if name is not None
+            else None
+            for name in disk_names
+        ],
+        DISK_FIELDS,
+    )
+    ids = series_ids(slots)
+
+    @protect_from(ValueError, f"disk-{mode}")
+    def parse_disk_fields(
+        line: str, ts: Optional[TimestampTuple], record: FrameRecord
+    ) -> Sequence[int]:
+        if ts is None:
+            log.warning("disk: no ts specified")
+            return ()
+        index, _, metrics = line.partition(",")
+        if index != ts.code:
+            return ()
+        complete = rows.add(mode, index, metrics)
+        if complete is None:
+            return ()
+        read, write, busy = (
+            complete[name].split(",") for name in DISK_FIELDS
+        )
+        values, present = record.values, record.present
+        for slot, r, w, b in zip(slots, read, write, busy):
+            if slot is None:
+                continue
+            series, offset = slot
+            values[offset] = float(r or 0)
+            values[offset + 1] = float(w or 0)
+            values[offset + 2] = float(b or 0)
+            present[series] = 3
+        return ids
+
+    return parse_disk_fields
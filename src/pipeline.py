@@ -1,33 +1,174 @@
-import multiprocessing
+from typing import Callable, Dict, Iterable, Optional, Sequence
 
+import reactivex as rx
 import reactivex.operators as ops
+from reactivex.abc import ObserverBase, SchedulerBase
 from reactivex.observable import Observable
-from reactivex.scheduler import ThreadPoolScheduler
 
+from .cardinality import SeriesFilters
+from .frames import parallel_frame_pipeline
+from .registry import Entry, SeriesRegistry
+from .rollup import rollup
 from .scraper import NmonHeaderParser, NmonParser
 
 
-def nmon_parsing_pipeline(source: Observable[str], run_id: str):
-    parser = NmonParser(timestamp_prefix="ZZZZ")
-    header_parser = NmonHeaderParser(parser, "perf-metrics", run_id)
+def line_dispatcher(
+    run_id: str,
+    measurement: str = "perf-metrics",
+    tags: Optional[Dict[str, str]] = None,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+    registry: Optional[SeriesRegistry] = None,
+) -> Callable[[str], Iterable[Entry]]:
+    """Creates stateful function which parses nmon output line by line:
+    header lines (the ones preceding the first timestamp) register
+    collectors, the rest are passed to the parser. Headers of
+    sections written later (e.g., VM) are registered once they appear.
+    Each dispatcher has its own registry of series unless one is given
+    (e.g., shared by dispatchers of consecutive files of a host)
 
-    optimal_thread_count = multiprocessing.cpu_count() * 5
-    pool_scheduler = ThreadPoolScheduler(optimal_thread_count)
-
-    collectors_registered = source.pipe(
-        ops.observe_on(pool_scheduler),
-        ops.take_while(
-            lambda _: not header_parser.registered_all,
-            inclusive=True,
-        ),
-        ops.map(header_parser.parse),
-        ops.last(),
+    :param run_id: run tag
+    :type run_id: str
+    :param measurement: measurement name suffix
+    :type measurement: str, optional
+    :param tags: extra tags attached to each series
+    :type tags: Optional[Dict[str, str]], optional
+    :param filters: include/exclude patterns of columns per section
+    :type filters: Optional[SeriesFilters], optional
+    :param disk_fields: emit read/write/busy of a disk as a single point
+    :type disk_fields: bool, optional
+    :param registry: registry of series, defaults to a new one
+    :type registry: Optional[SeriesRegistry], optional
+    :return: function mapping nmon line to samples of frame records
+    :rtype: Callable[[str], Iterable[Entry]]
+    """
+    parser = NmonParser(timestamp_prefix="ZZZZ", registry=registry)
+    header_parser = NmonHeaderParser(
+        parser, measurement, run_id, tags, filters, disk_fields
     )
-    collectors_registered.subscribe()
+    parser.on_unknown = header_parser.parse
+    headers_done = False
 
-    line_proto_stream = source.pipe(
-        ops.observe_on(pool_scheduler),
-        ops.map(parser.parse),
-        ops.flat_map(lambda x: x),
-    )
-    return line_proto_stream
+    def dispatch(line: str) -> Iterable[Entry]:
+        nonlocal headers_done
+        if not headers_done:
+            if not line.startswith(parser.timestamp_prefix):
+                header_parser.parse(line)
+                return ()
+            headers_done = True
+        samples = parser.collect(line)
+        return (samples,) if samples is not None else ()
+
+    return dispatch
+
+
+def dispatch_lines(
+    dispatcher: Callable[[], Callable[[str], Iterable[Entry]]]
+) -> Callable[[Observable[str]], Observable[Entry]]:
+    """Operator which parses each line with a dispatcher (created
+    per subscription) and emits the entries directly, on the thread
+    that emitted the line. Unlike flat_map, no inner observable is
+    created per line and nothing is queued on a scheduler, thus a
+    slow subscriber slows down the source instead of piling up entries
+
+    :param dispatcher: factory of stateful parsing functions
+        (e.g., bound line_dispatcher)
+    :type dispatcher: Callable[[], Callable[[str], Iterable[Entry]]]
+    :return: reactivex operator
+    :rtype: Callable[[Observable[str]], Observable[Entry]]
+    """
+
+    def operator(source: Observable[str]) -> Observable[Entry]:
+        def subscribe(
+            observer: ObserverBase[Entry],
+            scheduler: Optional[SchedulerBase] = None,
+        ):
+            dispatch = dispatcher()
+            emit = observer.on_next
+
+            def on_next(line: str):
+                try:
+                    # parsers are generators, errors surface on iteration
+                    entries = list(dispatch(line))
+                except Exception as e:
+                    observer.on_error(e)
+                    return
+                for entry in entries:
+                    emit(entry)
+
+            return source.subscribe(
+                on_next=on_next,
+                on_error=observer.on_error,
+                on_completed=observer.on_completed,
+                scheduler=scheduler,
+            )
+
+        return rx.create(subscribe)
+
+    return operator
+
+
+def nmon_parsing_pipeline(
+    source: Observable[str],
+    run_id: str,
+    workers: int = 0,
+    executor: str = "thread",
+    rollup_windows: Sequence[str] = (),
+    keep_raw: bool = True,
+    filters: Optional[SeriesFilters] = None,
+    disk_fields: bool = False,
+    max_pending: Optional[int] = None,
+):
+    """Single-pass parsing pipeline: header lines (the ones preceding
+    the first timestamp) register collectors in-line, data lines are
+    parsed in order on the thread that emits them. Thus, each line is
+    paired with the correct interval and output is deterministic
+
+    :param source: nmon output lines (without trailing newlines)
+    :type source: Observable[str]
+    :param run_id: run tag
+    :type run_id: str
+    :param workers: if positive, frames are parsed on a pool of
+        given size and reassembled in order (see parallel_frame_pipeline)
+    :type workers: int, optional
+    :param executor: pool kind, either "thread" or "process"
+    :type executor: str, optional
+    :param rollup_windows: if given, aggregates over these windows
+        (e.g., "10s", "1m") are emitted as separate measurements
+    :type rollup_windows: Sequence[str], optional
+    :param keep_raw: emit raw entries alongside the aggregates
+    :type keep_raw: bool, optional
+    :param filters: include/exclude patterns of columns per section
+        (e.g., {"DISK": SeriesFilter(exclude=["loop*"])})
+    :type filters: Optional[SeriesFilters], optional
+    :param disk_fields: emit read/write/busy of a disk as a single point
+    :type disk_fields: bool, optional
+    :param max_pending: max frames being parsed on the pool
+        (the source is blocked once reached), defaults to 4 * workers
+    :type max_pending: Optional[int], optional
+    :return: shared (hot once subscribed) stream of samples of frame
+        records (and line protocol entries of rollups)
+    :rtype: Observable[Entry]
+    """
+    if workers > 0:
+        parsed = parallel_frame_pipeline(
+            source,
+            run_id,
+            workers=workers,
+            executor=executor,
+            filters=filters,
+            disk_fields=disk_fields,
+            max_pending=max_pending,
+        )
+    else:
+        parsed = source.pipe(
+            dispatch_lines(
+                lambda: line_dispatcher(
+                    run_id, filters=filters, disk_fields=disk_fields
+                )
+            )
+        )
+
+    if rollup_windows:
+        parsed = parsed.pipe(rollup(rollup_windows, keep_raw=keep_raw))
+    return parsed.pipe(ops.share())
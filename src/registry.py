@@ -0,0 +1,124 @@
+import sys
+import threading
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from .stats import stats
+
+
+class SeriesRegistry:
+    """Assigns each series (measurement with tag set) of a pipeline an
+    integer id. Keys are interned, fields of a series occupy consecutive
+    columns starting at `offsets[id]`, thus values of all the series of
+    a frame fit into a single float array (see FrameRecord). Keys and
+    field names are also encoded once into a line protocol template per
+    series (see LineBuffer). Series are registered by collectors as
+    NmonHeaderParser creates them, ids are never reused. Each pipeline
+    (parser) has its own registry, it may be shared by parsers of
+    consecutive files of the same host
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.fields: List[Tuple[str, ...]] = []
+        self.offsets = array("q")
+        self.columns = 0
+        # b"key name=%r,..." per series, values are formatted into it
+        self.templates: List[bytes] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def register(self, key: str, fields: Sequence[str]) -> int:
+        """Returns id of the series, registers it if it is new
+
+        :param key: escaped series key (see series_key)
+        :type key: str
+        :param fields: escaped field names in the order of columns
+        :type fields: Sequence[str]
+        :return: series id
+        :rtype: int
+        """
+        fields = tuple(fields)
+        with self.lock:
+            series = self.ids.get(key)
+            if series is not None and self.fields[series] == fields:
+                return series
+            # series of a changed header (e.g., the next file
+            # of a host) gets a new id, the key points to it
+            series = len(self.keys)
+            key = sys.intern(key)
+            self.keys.append(key)
+            self.fields.append(tuple(map(sys.intern, fields)))
+            self.offsets.append(self.columns)
+            self.columns += len(fields)
+            self.templates.append(line_template(key, fields))
+            self.ids[key] = series
+        stats.incr("series_registered")
+        return series
+
+    def id(self, key: str) -> Optional[int]:
+        return self.ids.get(key)
+
+    def template(self, series: int, count: int) -> bytes:
+        """Line protocol template of the series with `count` leading
+        fields present (rows may be shorter than their header)"""
+        if count == len(self.fields[series]):
+            return self.templates[series]
+        return line_template(self.keys[series], self.fields[series][:count])
+
+
+def line_template(key: str, fields: Sequence[str]) -> bytes:
+    # escaped key and field names are copied as they are,
+    # percent signs are doubled for %-formatting
+    return b"%s %s" % (
+        key.encode().replace(b"%", b"%%"),
+        b",".join(
+            name.encode().replace(b"%", b"%%") + b"=%r" for name in fields
+        ),
+    )
+
+
+class FrameRecord:
+    """Values of a parsed frame (interval): a flat float array indexed
+    by column (see SeriesRegistry.offsets) and the number of fields
+    present per series id (leading columns, 0 if the series has no
+    sample). Collectors fill it in place, no object is allocated
+    per sample
+    """
+
+    __slots__ = ("registry", "ns", "values", "present")
+
+    def __init__(self, registry: SeriesRegistry, ns: int = 0) -> None:
+        self.registry = registry
+        self.ns = ns
+        self.values = array("d", bytes(8 * registry.columns))
+        self.present = array("H", bytes(2 * len(registry)))
+
+    def grow(self):
+        """Makes room for series registered since the record was made
+        (e.g., headers nmon writes within the first frame)"""
+        columns = self.registry.columns - len(self.values)
+        if columns > 0:
+            self.values.frombytes(bytes(8 * columns))
+        series = len(self.registry) - len(self.present)
+        if series > 0:
+            self.present.frombytes(bytes(2 * series))
+
+
+class Samples(NamedTuple):
+    """Series of a frame record filled by a line (or a whole frame),
+    emitted by the parsing pipeline in place of line protocol entries.
+    `series` may list ids which are not present (e.g., short rows
+    or samples dropped by deadband)
+    """
+
+    record: FrameRecord
+    series: Sequence[int]
+
+
+# items of parsed streams: either samples of a frame record,
+# or line protocol entries (e.g., frames parsed on a process pool)
+Entry = Union[str, Samples]
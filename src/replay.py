@@ -0,0 +1,236 @@
+import datetime
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import reactivex as rx
+
+from . import logger_factory
+from .pipeline import nmon_parsing_pipeline
+from .scraper import parse_nmon_date
+from .stats import Distribution, stats
+from .synthetic import nmon_date
+from .writer import BatchingWriter, WriteFunction
+
+log = logger_factory("replay")
+
+# latency samples kept for the report
+LATENCY_SAMPLES = 1 << 16
+
+
+@dataclass
+class Recording:
+    """nmon output split into the header and frames,
+    along with the time of each frame"""
+
+    header: List[str]
+    frames: List[List[str]]
+    times: List[datetime.datetime]
+
+    @classmethod
+    def from_lines(
+        cls, lines: Iterable[str], timestamp_prefix: str = "ZZZZ"
+    ) -> "Recording":
+        """
+        :raises ValueError: if there are no frames
+        """
+        header: List[str] = []
+        frames: List[List[str]] = []
+        times: List[datetime.datetime] = []
+        for line in lines:
+            line = line.rstrip("\n")
+            if line.startswith(timestamp_prefix):
+                # ZZZZ,T0001,21:48:19,31-JAN-2023
+                _, _, date = line.split(",", 2)
+                times.append(parse_nmon_date(date))
+                frames.append([line])
+            elif frames:
+                frames[-1].append(line)
+            else:
+                header.append(line)
+        if not frames:
+            raise ValueError("recording has no frames")
+        return cls(header, frames, times)
+
+    @property
+    def step(self) -> datetime.timedelta:
+        """Time between frames (nmon -s)"""
+        if len(self.times) < 2:
+            return datetime.timedelta(seconds=1)
+        return self.times[1] - self.times[0]
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        """Time span of the frames, including the last interval"""
+        return self.times[-1] - self.times[0] + self.step
+
+    def replay(
+        self, start: datetime.datetime, loops: int = 1
+    ) -> Iterator[Tuple[float, List[str]]]:
+        """Yields frames with timestamps shifted, so that the first one
+        is at `start`, along with their offsets (seconds) from it.
+        The recording is repeated `loops` times, back to back.
+        Records keep their T-codes, only ZZZZ lines are rewritten
+        """
+        for loop in range(loops):
+            shift = start - self.times[0] + loop * self.duration
+            for frame, dt in zip(self.frames, self.times):
+                first, *records = frame
+                prefix, code, _ = first.split(",", 2)
+                shifted = dt + shift
+                offset = (shifted - start).total_seconds()
+                yield offset, [
+                    f"{prefix},{code},{nmon_date(shifted)}",
+                    *records,
+                ]
+
+
+@dataclass
+class LoadReport:
+    hosts: int
+    frames: int = 0
+    elapsed: float = 0.0
+    points_written: int = 0
+    # dropped by the writer (see INFLUX_WRITE_POLICY)
+    points_dropped: int = 0
+    points_failed: int = 0
+    # how far behind the schedule frames were emitted, e.g.,
+    # when the pipeline can't keep up with the requested speed-up
+    schedule_lag: Distribution = field(default_factory=Distribution)
+    write_latency: Distribution = field(
+        default_factory=lambda: Distribution(LATENCY_SAMPLES)
+    )
+
+    @property
+    def points_per_sec(self) -> float:
+        return self.points_written / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "hosts": self.hosts,
+            "frames": self.frames,
+            "elapsed": self.elapsed,
+            "points_written": self.points_written,
+            "points_per_sec": self.points_per_sec,
+            "points_dropped": self.points_dropped,
+            "points_failed": self.points_failed,
+            "write_latency": self.write_latency.summary(),
+            "schedule_lag": self.schedule_lag.summary(),
+        }
+
+
+def run_load(
+    recording: Recording,
+    write: WriteFunction,
+    run_id: str,
+    hosts: int = 1,
+    speedup: float = 1.0,
+    loops: int = 1,
+    start: Optional[datetime.datetime] = None,
+    line_filter: Optional[Callable[[str], bool]] = None,
+    batch_size: int = 5000,
+    flush_interval: float = 1.0,
+    max_pending: int = 16,
+    policy: str = "block",
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+) -> LoadReport:
+    """Replays the recording as `hosts` simulated hosts (run ids
+    `<run_id>-host000`, ...) through the parsing pipeline and the
+    batching writer, e.g., to size InfluxDB. Timestamps are shifted
+    to `start` (now by default); frames are emitted as the recording
+    went, `speedup` times faster (0 - as fast as possible). Written,
+    dropped and failed points are counted along with write latencies
+
+    :param recording: recorded (or synthetic) nmon output
+    :type recording: Recording
+    :param write: destination (e.g., influx write function or a stub)
+    :type write: WriteFunction
+    :param run_id: run tag prefix of the simulated hosts
+    :type run_id: str
+    :param hosts: number of simulated hosts, each one replays
+        the recording on its own thread
+    :type hosts: int, optional
+    :param speedup: replay speed relative to the recording
+    :type speedup: float, optional
+    :param loops: times the recording is repeated
+    :type loops: int, optional
+    :param start: time of the first frame, defaults to now
+    :type start: Optional[datetime.datetime], optional
+    :param line_filter: predicate selecting lines to parse
+    :type line_filter: Optional[Callable[[str], bool]], optional
+    :return: load summary
+    :rtype: LoadReport
+    """
+    if hosts < 1 or loops < 1 or speedup < 0:
+        raise ValueError(f"invalid load: {hosts} hosts, {loops}x{speedup}")
+    start = start or datetime.datetime.now().replace(microsecond=0)
+    report = LoadReport(hosts)
+    lock = threading.Lock()
+
+    def measured_write(payload: bytes):
+        lines = payload.count(b"\n") + 1
+        started = clock()
+        try:
+            write(payload)
+        except Exception:
+            with lock:
+                report.points_failed += lines
+            raise
+        with lock:
+            report.write_latency.add(clock() - started)
+            report.points_written += lines
+
+    dropped_before = stats.snapshot().get("dropped_lines_write", 0)
+    with BatchingWriter(
+        measured_write,
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        max_pending=max_pending,
+        # hosts interleave, thus batches are limited by size/time
+        split_intervals=False,
+        policy=policy,
+    ) as writer:
+        began = clock()
+
+        def paced() -> Iterator[str]:
+            for offset, lines in recording.replay(start, loops):
+                if speedup:
+                    delay = began + offset / speedup - clock()
+                    if delay > 0:
+                        sleep(delay)
+                    with lock:
+                        report.schedule_lag.add(max(-delay, 0.0))
+                yield from lines
+
+        def replay_host(host: int):
+            lines: Iterable[str] = itertools.chain(recording.header, paced())
+            if line_filter is not None:
+                lines = filter(line_filter, lines)
+            # emitted on this thread, thus returns once replayed
+            nmon_parsing_pipeline(
+                rx.from_iterable(lines), run_id=f"{run_id}-host{host:03}"
+            ).subscribe(
+                on_next=writer.write,
+                on_error=lambda e: log.error(f"host {host} failed: {e}"),
+            )
+
+        threads = [
+            threading.Thread(
+                target=replay_host, args=(host,), name=f"replay-{host}"
+            )
+            for host in range(hosts)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    report.elapsed = clock() - began
+    report.frames = hosts * loops * len(recording.frames)
+    report.points_dropped = (
+        stats.snapshot().get("dropped_lines_write", 0) - dropped_before
+    )
+    log.info(f"replay finished: {report.as_dict()}")
+    return report
@@ -0,0 +1,278 @@
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import reactivex as rx
+from reactivex.abc import ObserverBase, SchedulerBase
+from reactivex.observable import Observable
+
+from . import logger_factory
+from .encoder import split_entry, split_key
+from .registry import Entry, Samples, SeriesRegistry
+from .stats import stats
+
+log = logger_factory("rollup")
+
+_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_window(window: str) -> int:
+    """Converts window specification (e.g., 10s, 1m, 1h)
+    into nanoseconds
+
+    :raises ValueError: if specification is invalid
+    """
+    match = re.fullmatch(r"(\d+)([smh])", window.strip())
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"invalid window: {window}. expected e.g. 10s, 1m")
+    amount, unit = match.groups()
+    return int(amount) * _UNITS[unit] * 10**9
+
+
+class Aggregate:
+    """Running aggregate of a single field within a window"""
+
+    __slots__ = ("count", "total", "min", "max", "last")
+
+    def __init__(self, value: float) -> None:
+        self.count = 1
+        self.total = value
+        self.min = value
+        self.max = value
+        self.last = value
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.last = value
+
+    def fields(self, name: str) -> str:
+        return (
+            f"{name}_mean={self.total / self.count},"
+            f"{name}_min={self.min},"
+            f"{name}_max={self.max},"
+            f"{name}_last={self.last}"
+        )
+
+
+class _SeriesWindow:
+    __slots__ = ("start", "fields")
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.fields: Dict[str, Aggregate] = {}
+
+    def add(self, name: str, value: float):
+        aggregate = self.fields.get(name)
+        if aggregate is None:
+            self.fields[name] = Aggregate(value)
+        else:
+            aggregate.add(value)
+
+
+class Rollup:
+    """Keeps running aggregates (mean/min/max/last) per series and field
+    over tumbling windows aligned to the epoch. When a sample of a series
+    falls into a later window, aggregates of the previous one are emitted
+    as `<measurement>-<label>` (e.g., cpu-perf-metrics-1m) with the window
+    start as timestamp. Memory is constant per series and window.
+    Windows of samples of frame records are kept in lists indexed by
+    series id (per registry), their values are read from the record
+    """
+
+    def __init__(self, windows: Sequence[str]) -> None:
+        self.windows: List[Tuple[str, int]] = [
+            (label, parse_window(label)) for label in windows
+        ]
+        # (series key, window label) -> current window state
+        self.state: Dict[Tuple[str, str], _SeriesWindow] = {}
+        # (series key, window label) -> key of the rollup series
+        self.keys: Dict[Tuple[str, str], str] = {}
+        # registry -> current window state per window and series id
+        self.records: Dict[
+            SeriesRegistry, List[List[Optional[_SeriesWindow]]]
+        ] = {}
+
+    def _rollup_key(self, key: str, label: str) -> str:
+        if (key, label) not in self.keys:
+            measurement, tags = split_key(key)
+            self.keys[key, label] = f"{measurement}-{label}{tags}"
+        return self.keys[key, label]
+
+    def _emit(self, key: str, label: str, window: _SeriesWindow) -> str:
+        fields = ",".join(
+            aggregate.fields(name)
+            for name, aggregate in window.fields.items()
+        )
+        return f"{self._rollup_key(key, label)} {fields} {window.start}"
+
+    def _advance(
+        self,
+        key: str,
+        label: str,
+        window: Optional[_SeriesWindow],
+        start: int,
+        completed: List[str],
+    ) -> Optional[_SeriesWindow]:
+        # window of the sample, the previous one is completed by it,
+        # None for late samples of an already emitted window
+        if window is not None and window.start == start:
+            return window
+        if window is not None and window.start > start:
+            stats.incr("rollup_late_samples")
+            return None
+        if window is not None:
+            completed.append(self._emit(key, label, window))
+        return _SeriesWindow(start)
+
+    def add(self, line: str) -> List[str]:
+        """Accounts entry in the aggregates, returns
+        rollup entries of the windows completed by it"""
+        key, fields, timestamp = split_entry(line)
+        ns = int(timestamp)
+        values = [
+            (name, float(value.rstrip("i")))
+            for name, _, value in (f.partition("=") for f in fields.split(","))
+        ]
+        completed: List[str] = []
+        for label, size in self.windows:
+            window = self._advance(
+                key, label, self.state.get((key, label)), ns - ns % size,
+                completed,
+            )
+            if window is None:
+                continue
+            self.state[key, label] = window
+            for name, value in values:
+                window.add(name, value)
+        return completed
+
+    def add_samples(self, samples: Samples) -> List[str]:
+        """Same as add, for samples of a frame record"""
+        record, series = samples
+        registry = record.registry
+        states = self.records.get(registry)
+        if states is None:
+            states = self.records[registry] = [[] for _ in self.windows]
+        ns = record.ns
+        values = record.values
+        present = record.present
+        completed: List[str] = []
+        for (label, size), windows in zip(self.windows, states):
+            if len(windows) < len(registry):
+                # series registered since the last sample
+                windows.extend([None] * (len(registry) - len(windows)))
+            start = ns - ns % size
+            for index in series:
+                count = present[index]
+                if not count:
+                    continue
+                window = self._advance(
+                    registry.keys[index], label, windows[index], start,
+                    completed,
+                )
+                if window is None:
+                    continue
+                windows[index] = window
+                offset = registry.offsets[index]
+                for column, name in enumerate(
+                    registry.fields[index][:count], start=offset
+                ):
+                    window.add(name, values[column])
+        return completed
+
+    def flush(self) -> List[str]:
+        """Emits all the (incomplete) windows"""
+        emitted = [
+            self._emit(key, label, window)
+            for (key, label), window in self.state.items()
+        ]
+        self.state.clear()
+        for registry, states in self.records.items():
+            for (label, _), windows in zip(self.windows, states):
+                emitted.extend(
+                    self._emit(registry.keys[index], label, window)
+                    for index, window in enumerate(windows)
+                    if window is not None
+                )
+        self.records.clear()
+        return emitted
+
+
+def rollup(
+    windows: Sequence[str], keep_raw: bool = True
+) -> Callable[[Observable[Entry]], Observable[Entry]]:
+    """Operator which adds rolled up series (line protocol entries)
+    to the parsed stream. Windows are completed by samples of the next
+    frame, their entries are held until the frame ends (i.e., the first
+    entry of another interval arrives) and emitted as a block, ordered
+    by window start.
+    Thus, BatchingWriter sends them in a request per window instead of
+    flushing interleaved raw and rollup entries one by one
+
+    :param windows: window specifications, e.g. ("10s", "1m")
+    :type windows: Sequence[str]
+    :param keep_raw: emit raw entries alongside the aggregates
+    :type keep_raw: bool, optional
+    :return: reactivex operator
+    :rtype: Callable[[Observable[Entry]], Observable[Entry]]
+    """
+    # validate before subscription
+    for window in windows:
+        parse_window(window)
+
+    def operator(source: Observable[Entry]) -> Observable[Entry]:
+        def subscribe(
+            observer: ObserverBase[Entry],
+            scheduler: Optional[SchedulerBase] = None,
+        ):
+            aggregates = Rollup(windows)
+            held: List[str] = []
+            frame_timestamp = None
+
+            def emit(lines: Iterable[str]):
+                for line in sorted(
+                    lines, key=lambda line: int(line.rpartition(" ")[2])
+                ):
+                    observer.on_next(line)
+
+            def on_next(entry: Entry):
+                nonlocal frame_timestamp
+                timestamp: object = (
+                    entry.rpartition(" ")[2]
+                    if isinstance(entry, str)
+                    else entry.record.ns
+                )
+                if timestamp != frame_timestamp:
+                    frame_timestamp = timestamp
+                    if held:
+                        emit(held)
+                        held.clear()
+                try:
+                    if isinstance(entry, str):
+                        held.extend(aggregates.add(entry))
+                    else:
+                        held.extend(aggregates.add_samples(entry))
+                except ValueError as e:
+                    stats.incr("rollup_errors")
+                    log.error(f"rollup of '{entry}' failed: {e}")
+                if keep_raw:
+                    observer.on_next(entry)
+
+            def on_completed():
+                emit(held + aggregates.flush())
+                observer.on_completed()
+
+            return source.subscribe(
+                on_next=on_next,
+                on_error=observer.on_error,
+                on_completed=on_completed,
+                scheduler=scheduler,
+            )
+
+        return rx.create(subscribe)
+
+    return operator
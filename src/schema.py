@@ -0,0 +1,124 @@
+import json
+import os
+import re
+from typing import Iterable, Iterator, List
+
+from . import logger_factory
+from .scraper import is_header_line
+from .stats import stats
+
+log = logger_factory("schema")
+
+
+def _file_name(host: str, run_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", f"{host}--{run_id}") + ".json"
+
+
+class SchemaCache:
+    """On-disk cache of nmon header lines (CPU ids, disk columns and
+    other section layouts), a file per host and run. Collectors are
+    registered from header lines, thus a collector restarted in the
+    middle of a run (or attached to a stream late) can rebuild them
+    from the cache instead of dropping every data line as unknown
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, host: str, run_id: str) -> str:
+        return os.path.join(self.directory, _file_name(host, run_id))
+
+    def load(self, host: str, run_id: str) -> List[str]:
+        """Returns cached header lines, empty if there are none"""
+        try:
+            with open(self.path(host, run_id)) as f:
+                schema = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            log.error(f"failed to load schema of {host}/{run_id}: {e}")
+            return []
+        if (schema.get("host"), schema.get("run_id")) != (host, run_id):
+            # sanitized file names of different runs may collide
+            return []
+        return list(schema.get("headers", []))
+
+    def save(self, host: str, run_id: str, headers: List[str]):
+        path = self.path(host, run_id)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"host": host, "run_id": run_id, "headers": headers}, f)
+        os.replace(temporary, path)
+
+
+def cached_schema(
+    lines: Iterable[str],
+    cache: SchemaCache,
+    host: str,
+    run_id: str,
+    timestamp_prefix: str = "ZZZZ",
+) -> Iterator[str]:
+    """Passes nmon output lines through, persisting the header.
+    If the stream starts without a header (the collector was
+    restarted mid-run), the cached header lines are emitted before
+    the first timestamp, so that parsing resumes from that frame.
+    Data lines preceding it (a partial frame) are skipped
+
+    :param lines: nmon output lines (without trailing newlines)
+    :type lines: Iterable[str]
+    :param cache: header cache
+    :type cache: SchemaCache
+    :param host: host the output comes from
+    :type host: str
+    :param run_id: run tag, should be the same across restarts
+    :type run_id: str
+    :param timestamp_prefix: prefix of frame timestamp lines
+    :type timestamp_prefix: str, optional
+    :return: the same lines, possibly preceded by the cached header
+    :rtype: Iterator[str]
+    """
+    lines = iter(lines)
+    headers: List[str] = []
+    for line in lines:
+        if line.startswith(timestamp_prefix):
+            break
+        if is_header_line(line):
+            headers.append(line)
+            yield line
+        else:
+            stats.incr("lines_skipped")
+    else:
+        if headers:
+            cache.save(host, run_id, headers)
+        return
+
+    if headers:
+        cache.save(host, run_id, headers)
+    else:
+        headers = cache.load(host, run_id)
+        if headers:
+            log.info(f"{host}: restored {len(headers)} header lines")
+            stats.incr("schema_restored")
+            yield from headers
+        else:
+            log.warning(f"{host}: no header and no cached schema")
+    yield line
+
+    # nmon writes some headers (e.g., VM) within the first frame
+    late = False
+    try:
+        for line in lines:
+            if line.startswith(timestamp_prefix):
+                break
+            if is_header_line(line) and line not in headers:
+                headers.append(line)
+                late = True
+            yield line
+        else:
+            return
+    finally:
+        if late:
+            cache.save(host, run_id, headers)
+    yield line
+    yield from lines
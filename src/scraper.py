@@ -1,20 +1,38 @@
 import datetime
 import logging
-from typing import Dict, Iterable, Optional, Set
+from functools import lru_cache
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+)
 
+from .cardinality import SeriesFilters
+from .registry import FrameRecord, Samples, SeriesRegistry
+from .encoder import FrameRows, render_samples
 from .parsers import (
     nmon_cpu_mertic_collector,
+    nmon_disk_fields_collector,
     nmon_disk_metric_collector,
     nmon_mem_metric_collector,
+    nmon_section_collector,
 )
 
-from . import TimestampTuple, LineProtocol
+from . import Collector, TimestampTuple
+from .stats import stats
 
 
 class WithListeners:
-    listeners: Dict[str, LineProtocol]
+    listeners: Dict[str, Collector]
+    # series of the collectors, each parser has its own
+    registry: SeriesRegistry
 
-    def add_listener(self, prefix: str, collector: LineProtocol):
+    def add_listener(self, prefix: str, collector: Collector):
         self.listeners[prefix] = collector
 
 
@@ -22,34 +40,105 @@ class NmonParser(WithListeners):
     """Basic parser. Stores metrics parsers
     as listeners, invokes them when corresponding prefix is found.
     Also parses timestamps as these are stored as a separate line
-    so someone has to keep track of them
+    so someone has to keep track of them. Collectors fill a record
+    per timestamp (frame), lines yield samples of the record
     """
     timestamp: Optional[TimestampTuple]
     timestamp_prefix: str
+    record: Optional[FrameRecord]
 
     def __init__(
         self,
         timestamp_prefix: str,
+        on_unknown: Optional[Callable[[str], bool]] = None,
+        registry: Optional[SeriesRegistry] = None,
     ) -> None:
         self.log = logging.getLogger("nmon-parser")
         self.listeners = {}
+        self.registry = registry if registry is not None else SeriesRegistry()
         self.timestamp = None
         self.timestamp_prefix = timestamp_prefix
+        # record of the current frame, created once it gets a sample
+        self.record = None
+        # invoked with lines of unknown sections, returns True if the
+        # line was consumed (e.g., header written after the first frame)
+        self.on_unknown = on_unknown
+
+    def unknown(self, prefix: str, line: str):
+        if self.on_unknown is not None and self.on_unknown(line):
+            return
+        stats.incr("unknown_prefix")
+        self.log.warning(f"omit unknown prefix: {prefix}")
 
-    def add_listener(self, prefix: str, collector: LineProtocol):
+    def add_listener(self, prefix: str, collector: Collector):
         self.log.debug(f"adding listener: {prefix}")
         return super().add_listener(prefix, collector)
 
-    def parse(self, line: str) -> Iterable[str]:
-        # self.log.info(f"given: {line}")
+    def frame_record(self) -> FrameRecord:
+        record = self.record
+        if record is None:
+            ns = self.timestamp.ns if self.timestamp is not None else 0
+            record = self.record = FrameRecord(self.registry, ns)
+        elif len(record.present) != len(self.registry):
+            # headers written within the frame (e.g., VM)
+            record.grow()
+        return record
+
+    def collect(self, line: str) -> Optional[Samples]:
+        """Parses a line into the record of the current frame
+
+        :param line: nmon line
+        :type line: str
+        :return: samples filled by the line, if any
+        :rtype: Optional[Samples]
+        """
         prefix, _, arguments = line.partition(",")
         if prefix == self.timestamp_prefix:
             self.timestamp = self.timestamp_parser(arguments)
-            return
-        if prefix not in self.listeners:
-            self.log.warning(f"omit unknown prefix: {prefix}")
-            return
-        yield from self.listeners[prefix](arguments, self.timestamp)
+            self.record = None
+            return None
+        collector = self.listeners.get(prefix)
+        if collector is None:
+            self.unknown(prefix, line)
+            return None
+        record = self.frame_record()
+        series = collector(arguments, self.timestamp, record)
+        return Samples(record, series) if series else None
+
+    def parse(self, line: str) -> List[str]:
+        """Same as collect, but samples are rendered into
+        line protocol entries"""
+        samples = self.collect(line)
+        return render_samples(samples) if samples is not None else []
+
+    def parse_frame(self, lines: List[str]) -> Optional[Samples]:
+        """Parses a whole frame: timestamp line followed by its records.
+        The timestamp and the record are kept locally (shared state is
+        left intact), thus frames can be parsed concurrently
+
+        :param lines: frame lines, the first one should be a timestamp
+        :type lines: List[str]
+        :return: samples of the frame, if any
+        :rtype: Optional[Samples]
+        """
+        first, *records = lines
+        prefix, _, arguments = first.partition(",")
+        if prefix != self.timestamp_prefix:
+            self.log.warning(f"frame does not start with timestamp: {first}")
+            return None
+        timestamp = self.timestamp_parser(arguments)
+        record = FrameRecord(
+            self.registry, timestamp.ns if timestamp is not None else 0
+        )
+        series: List[int] = []
+        for line in records:
+            prefix, _, arguments = line.partition(",")
+            collector = self.listeners.get(prefix)
+            if collector is None:
+                self.unknown(prefix, line)
+                continue
+            series.extend(collector(arguments, timestamp, record))
+        return Samples(record, series) if series else None
 
     def timestamp_parser(self, line: str) -> Optional[TimestampTuple]:
         # nmon timestamps utilize the following format:
@@ -62,61 +151,183 @@ class NmonParser(WithListeners):
             self.log.error(f"timestamp parsing ({line}): {e}")
 
 
+MONTHS = {
+    month: number
+    for number, month in enumerate(
+        (
+            "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
+            "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
+        ),
+        start=1,
+    )
+}
+
+
+@lru_cache(maxsize=8)
+def parse_nmon_day(date: str) -> datetime.date:
+    # dates rarely change between intervals, thus
+    # they are parsed once and cached
+    day, month, year = date.split("-", 2)
+    if month.upper() not in MONTHS:
+        raise ValueError(f"invalid month: {month}")
+    return datetime.date(int(year), MONTHS[month.upper()], int(day))
+
+
 def parse_nmon_date(line: str) -> datetime.datetime:
+    # fixed HH:MM:SS,DD-MON-YYYY format is parsed by hand,
+    # which is way faster than strptime
     time, date = line.split(",", 2)
-    day, month, year = date.split("-", 3)
-    month = month.capitalize()  # i.e., map JAN to Jan
-    return datetime.datetime.strptime(
-        f"{time} {day}-{month}-{year}", "%H:%M:%S %d-%b-%Y"
+    hours, minutes, seconds = time.split(":", 2)
+    day = parse_nmon_day(date)
+    return datetime.datetime(
+        day.year,
+        day.month,
+        day.day,
+        int(hours),
+        int(minutes),
+        int(seconds),
     )
 
 
+def is_header_line(line: str) -> bool:
+    # header lines have section title in place of the T-code:
+    # NET,Network I/O username,lo-read-KB/s,...
+    # NET,T0001,0.0,0.6,...
+    _, _, rest = line.partition(",")
+    return not (rest[:1] == "T" and rest[1:5].isdigit())
+
+
+class SectionLayout(NamedTuple):
+    """How the columns of a generic section are mapped onto series"""
+
+    # measurement name prefix (e.g., net-perf-metrics)
+    name: str
+    # if set, each column is a separate series tagged by column name,
+    # otherwise columns are fields of a single series
+    column_tag: Optional[str] = None
+    # constant tags of the section's series
+    tags: Dict[str, str] = {}
+    # section of filters applied to the columns (see SeriesFilter)
+    filter: Optional[str] = None
+
+
+# sections parsed by the table-driven collector (nmon_section_collector)
+SECTIONS: Dict[str, SectionLayout] = {
+    "NET": SectionLayout("net"),
+    "NETPACKET": SectionLayout("netpacket"),
+    "VM": SectionLayout("vm"),
+    "PROC": SectionLayout("proc"),
+    "DISKXFER": SectionLayout(
+        "disk", column_tag="disk", tags={"mode": "xfer"}, filter="DISK"
+    ),
+    "DISKBSIZE": SectionLayout(
+        "disk", column_tag="disk", tags={"mode": "bsize"}, filter="DISK"
+    ),
+    "JFSFILE": SectionLayout("jfs", column_tag="filesystem"),
+}
+
+# sections every nmon output is expected to have
+REQUIRED_SECTIONS = frozenset({"CPU", "MEM", "DISK"})
+
+DISK_SECTIONS = ("DISKBUSY", "DISKREAD", "DISKWRITE")
+
+
+def ignore_collector(
+    line: str, ts: Optional[TimestampTuple], record: FrameRecord
+) -> Sequence[int]:
+    return ()
+
+
 class NmonHeaderParser:
     """
     Registers collectors (metric parsers) for the main parser
-    based on nmon's headers
+    based on nmon's headers. CPU, MEM and DISK sections have
+    dedicated collectors, the ones listed in SECTIONS are parsed
+    according to the columns of their header lines. Series of the
+    collectors are added to the registry of the parser
     """
 
     __registered: Set[str]
 
-    def __init__(self, parser: WithListeners, measurement: str, run_id: str):
+    def __init__(
+        self,
+        parser: WithListeners,
+        measurement: str,
+        run_id: str,
+        tags: Optional[Dict[str, str]] = None,
+        filters: Optional[SeriesFilters] = None,
+        disk_fields: bool = False,
+    ):
         self.log = logging.getLogger("nmon-parser")
         self.parser = parser
         self.measurement = measurement
         self.run_id = run_id
+        # extra tags attached to each series, e.g., host
+        self.tags = tags or {}
+        # include/exclude patterns of columns per section (CPU, DISK)
+        self.filters = filters or {}
+        # read/write/busy of a disk as fields of a single point
+        self.disk_fields = disk_fields
         self.__registered = set()
 
+    def accepts(self, section: str, name: str) -> bool:
+        """Tells whether the column of the section should become a series"""
+        accept = self.filters.get(section)
+        return accept is None or accept(name)
+
     @property
-    def registered_all(self):
-        return self.__registered == {"CPU", "MEM", "DISK"}
+    def registered(self) -> Set[str]:
+        return set(self.__registered)
 
-    def parse(self, line: str):
-        if self.registered_all:
-            self.log.debug("header parsing completed")
-            return True
-        if line.startswith("CPU") and "CPU" not in self.__registered:
-            cpu_id, *_ = line.partition(",")
-            self.add_cpu_listener(cpu_id)
-            if cpu_id == "CPU_ALL":
+    @property
+    def registered_all(self) -> bool:
+        return REQUIRED_SECTIONS <= self.__registered
+
+    def parse(self, line: str) -> bool:
+        """Registers collectors if the line is a header of a known
+        section, returns True if it was. Lines are expected to be
+        passed until the first timestamp, headers nmon writes later
+        (e.g., VM) can be passed once they appear
+        """
+        if not is_header_line(line):
+            return False
+        section, _, _ = line.partition(",")
+        if section.startswith("CPU"):
+            self.add_cpu_listener(section)
+            if section == "CPU_ALL":
                 self.__registered.add("CPU")
-            return
-        if line.startswith("MEM") and "MEM" not in self.__registered:
+            return True
+        if section == "MEM" and section not in self.__registered:
             self.add_mem_listener()
-            self.__registered.add("MEM")
-            return
-        if line.startswith("DISK") and "DISK" not in self.__registered:
+            self.__registered.add(section)
+            return True
+        if section in DISK_SECTIONS and "DISK" not in self.__registered:
             _, _, *disk_ids = line.split(",")
             self.add_disk_listeners(disk_ids)
             self.__registered.add("DISK")
+            return True
+        if section in SECTIONS and section not in self.__registered:
+            _, _, *columns = line.split(",")
+            self.add_section_listener(section, columns)
+            self.__registered.add(section)
+            return True
+        return False
 
     def add_cpu_listener(self, cpu_id: str):
         # self.log.debug(f"adds cpu listener {cpu_id}")
+        if not self.accepts("CPU", cpu_id):
+            # filtered out cores are still known to the parser,
+            # otherwise each of their lines is reported as unknown
+            self.parser.add_listener(cpu_id, ignore_collector)
+            return
         self.parser.add_listener(
             cpu_id,
             nmon_cpu_mertic_collector(
+                self.parser.registry,
                 f"cpu-{self.measurement}",
                 self.run_id,
                 cpu_id,
+                self.tags,
             ),
         )
 
@@ -124,15 +335,72 @@ class NmonHeaderParser:
         # self.log.debug("adds mem listener")
         self.parser.add_listener(
             "MEM",
-            nmon_mem_metric_collector(f"mem-{self.measurement}", self.run_id),
+            nmon_mem_metric_collector(
+                self.parser.registry,
+                f"mem-{self.measurement}",
+                self.run_id,
+                self.tags,
+            ),
         )
 
     def add_disk_listeners(self, disk_ids: Iterable[str]):
+        # columns of filtered out disks are kept as None placeholders
+        disk_ids = [
+            disk_id if self.accepts("DISK", disk_id) else None
+            for disk_id in disk_ids
+        ]
+        if self.disk_fields:
+            self.add_disk_fields_listeners(disk_ids)
+            return
         for mode, prefix in zip("rwb", ("DISKREAD", "DISKWRITE", "DISKBUSY")):
             # self.log.debug(f"adds {prefix} listener")
             self.parser.add_listener(
                 prefix,
                 nmon_disk_metric_collector(
-                    f"disk-{self.measurement}", self.run_id, disk_ids, mode
+                    self.parser.registry,
+                    f"disk-{self.measurement}",
+                    self.run_id,
+                    disk_ids,
+                    mode,
+                    self.tags,
                 ),
             )
+
+    def add_disk_fields_listeners(self, disk_ids: List[Optional[str]]):
+        # rows of the three sections are joined into a point per disk
+        rows: FrameRows[str] = FrameRows(("read", "write", "busy"))
+        for mode, prefix in zip("rwb", ("DISKREAD", "DISKWRITE", "DISKBUSY")):
+            self.parser.add_listener(
+                prefix,
+                nmon_disk_fields_collector(
+                    self.parser.registry,
+                    f"disk-{self.measurement}",
+                    self.run_id,
+                    disk_ids,
+                    mode,
+                    rows,
+                    self.tags,
+                ),
+            )
+
+    def add_section_listener(self, section: str, columns: Iterable[str]):
+        layout = SECTIONS[section]
+        columns = [
+            column
+            if layout.filter is None or self.accepts(layout.filter, column)
+            else None
+            for column in columns
+        ]
+        measurement = f"{layout.name}-{self.measurement}"
+        tags = {**self.tags, **layout.tags}
+        self.parser.add_listener(
+            section,
+            nmon_section_collector(
+                self.parser.registry,
+                measurement,
+                self.run_id,
+                columns,
+                layout.column_tag,
+                tags,
+            ),
+        )
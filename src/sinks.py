@@ -0,0 +1,347 @@
+import os
+import re
+import threading
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from . import logger_factory
+from .backpressure import BoundedQueue
+from .encoder import split_entry, split_key, split_tags, unescape
+from .stats import stats
+from .writer import WriteFunction, compressor
+
+log = logger_factory("sinks")
+
+# file name suffixes of compressed line protocol
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class RotatingFileSink:
+    """Appends line protocol payloads to local files, rotated once
+    a file reaches `max_bytes` (compressed size). Each payload is
+    compressed separately; concatenated gzip members (zstd frames)
+    form a valid stream, thus files can be read with zcat/zstdcat
+    and loaded with `influx write` later
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str = "nmon",
+        max_bytes: int = 64 << 20,
+        compression: Optional[str] = "gzip",
+        level: Optional[int] = None,
+    ) -> None:
+        if compression not in SUFFIXES:
+            raise ValueError(f"invalid compression: {compression}")
+        if max_bytes < 1:
+            raise ValueError(f"invalid file size: {max_bytes}")
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.compress = compressor(compression, level) if compression else None
+        self.suffix = f".lp{SUFFIXES[compression]}"
+        self.lock = threading.Lock()
+        self.file: Optional[Any] = None
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        # numbering continues after files of previous runs
+        pattern = re.compile(rf"{re.escape(prefix)}-(\d+)\.lp")
+        self.sequence = max(
+            (
+                int(match.group(1))
+                for match in map(pattern.match, os.listdir(directory))
+                if match
+            ),
+            default=-1,
+        )
+
+    def path(self, sequence: int) -> str:
+        name = f"{self.prefix}-{sequence:06d}{self.suffix}"
+        return os.path.join(self.directory, name)
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        self.sequence += 1
+        self.file = open(self.path(self.sequence), "ab")
+        self.size = 0
+
+    def __call__(self, payload: bytes):
+        chunk = payload + b"\n"
+        if self.compress is not None:
+            chunk = self.compress(chunk)
+        with self.lock:
+            if self.file is None or (
+                self.size and self.size + len(chunk) > self.max_bytes
+            ):
+                self._rotate()
+            self.file.write(chunk)
+            self.file.flush()
+            self.size += len(chunk)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self) -> "RotatingFileSink":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def part_path(directory: str, part: int) -> str:
+    return os.path.join(directory, f"part-{part:04d}.parquet")
+
+
+class _Columns:
+    __slots__ = ("time", "tags", "fields")
+
+    def __init__(self, tags: int, fields: int) -> None:
+        self.time = array("q")
+        self.tags: List[List[str]] = [[] for _ in range(tags)]
+        self.fields = [array("d") for _ in range(fields)]
+
+
+# measurement, tag keys, field keys
+_Layout = Tuple[str, Tuple[str, ...], Tuple[str, ...]]
+
+
+class ParquetSink:
+    """Columnar sink (requires optional `pyarrow`): entries are grouped
+    by measurement into typed columns (time as timestamp[ns], tags as
+    dictionary-encoded strings, fields as float64) and written as
+    Parquet row groups of `row_group_size` rows. Each measurement gets
+    its own directory with a file per column set, e.g.,
+    `cpu-perf-metrics/part-0000.parquet`, which can be loaded with
+    `pandas.read_parquet(directory)`
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        row_group_size: int = 1 << 16,
+        compression: str = "zstd",
+    ) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ValueError("parquet sink requires pyarrow") from e
+        if row_group_size < 1:
+            raise ValueError(f"invalid row group size: {row_group_size}")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.columns: Dict[_Layout, _Columns] = {}
+        self.writers: Dict[_Layout, Any] = {}
+        self.parts: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, payload: bytes):
+        with self.lock:
+            for line in payload.decode().splitlines():
+                try:
+                    self._add(line)
+                except ValueError as e:
+                    stats.incr("sink_parquet_errors")
+                    log.error(f"can't store '{line}': {e}")
+
+    def _add(self, line: str):
+        key, fields, timestamp = split_entry(line)
+        measurement, tag_set = split_key(key)
+        tags = split_tags(tag_set)
+        values = [field.partition("=") for field in fields.split(",")]
+        layout = (
+            unescape(measurement),
+            tuple(tags),
+            tuple(name for name, _, _ in values),
+        )
+        columns = self.columns.get(layout)
+        if columns is None:
+            columns = self.columns[layout] = _Columns(
+                len(layout[1]), len(layout[2])
+            )
+        # converted before appending, so that columns stay aligned
+        row = [float(value.rstrip("i")) for _, _, value in values]
+        ns = int(timestamp)
+        columns.time.append(ns)
+        for column, value in zip(columns.tags, tags.values()):
+            column.append(value)
+        for column, number in zip(columns.fields, row):
+            column.append(number)
+        if len(columns.time) >= self.row_group_size:
+            self._write(layout, columns)
+
+    def _write(self, layout: _Layout, columns: _Columns):
+        pa = self.pa
+        measurement, tag_names, field_names = layout
+        arrays = [pa.array(columns.time, type=pa.timestamp("ns"))]
+        arrays += [
+            pa.array(values, type=pa.string()).dictionary_encode()
+            for values in columns.tags
+        ]
+        arrays += [
+            pa.array(values, type=pa.float64()) for values in columns.fields
+        ]
+        table = pa.Table.from_arrays(
+            arrays, names=["time", *tag_names, *field_names]
+        )
+        writer = self.writers.get(layout)
+        if writer is None:
+            writer = self.writers[layout] = self.pq.ParquetWriter(
+                self._part_path(measurement),
+                table.schema,
+                compression=self.compression,
+            )
+        writer.write_table(table)
+        stats.incr("sink_parquet_rows", table.num_rows)
+        self.columns[layout] = _Columns(len(tag_names), len(field_names))
+
+    def _part_path(self, measurement: str) -> str:
+        directory = os.path.join(
+            self.directory, re.sub(r"[^\w.-]", "_", measurement)
+        )
+        os.makedirs(directory, exist_ok=True)
+        part = self.parts.get(measurement, 0)
+        # parts of previous runs are kept
+        while os.path.exists(path := part_path(directory, part)):
+            part += 1
+        self.parts[measurement] = part + 1
+        return path
+
+    def flush(self):
+        """Writes buffered rows as (possibly smaller) row groups"""
+        with self.lock:
+            for layout, columns in list(self.columns.items()):
+                if len(columns.time):
+                    self._write(layout, columns)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers.clear()
+
+    def __enter__(self) -> "ParquetSink":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class _Acknowledgement:
+    """Callback waiting until every sink has reached it"""
+
+    __slots__ = ("callback", "remaining", "lock")
+
+    def __init__(self, callback: Callable[[], None], sinks: int) -> None:
+        self.callback = callback
+        self.remaining = sinks
+        self.lock = threading.Lock()
+
+    def reached(self) -> bool:
+        """Returns True for the last sink reaching it"""
+        with self.lock:
+            self.remaining -= 1
+            return self.remaining == 0
+
+
+_Item = Union[bytes, _Acknowledgement, None]
+
+
+class FanOut:
+    """Write function handing payloads over to several sinks. Each sink
+    has its own bounded queue and sender thread, thus a slow sink does
+    not delay the others: once its queue is full, its payloads are
+    dropped (counted as `dropped_sink_<name>`) according to the policy.
+    With "block" policy, the slowest sink paces the pipeline instead.
+
+    Payloads are written asynchronously, thus acknowledgements (see
+    BatchingWriter.acknowledge) are forwarded to `acknowledge`, which
+    calls back once every sink has written the preceding payloads.
+    Once any payload is dropped or fails, the fan-out is `lost` and
+    acknowledgements are not called anymore
+    """
+
+    def __init__(
+        self,
+        sinks: Dict[str, WriteFunction],
+        max_pending: int = 16,
+        policy: str = "drop-oldest",
+    ) -> None:
+        if not sinks:
+            raise ValueError("no sinks given")
+        self.lost = False
+        self.queues: Dict[str, BoundedQueue[_Item]] = {}
+        self.threads: List[threading.Thread] = []
+        for name, sink in sinks.items():
+            queue: BoundedQueue[_Item] = BoundedQueue(
+                max_pending, policy=policy, name=f"sink_{name}"
+            )
+            stats.gauge(f"queue_sink_{name}", queue.qsize)
+            self.queues[name] = queue
+            thread = threading.Thread(
+                target=self._send,
+                args=(name, sink, queue),
+                name=f"sink-{name}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def __call__(self, payload: bytes):
+        for queue in self.queues.values():
+            if queue.put(payload) is not None:
+                self.lost = True
+
+    def acknowledge(self, callback: Callable[[], None]):
+        """Calls back (on the thread of the slowest sink) once every
+        sink has written the payloads passed so far"""
+        acknowledgement = _Acknowledgement(callback, len(self.queues))
+        for queue in self.queues.values():
+            queue.put(acknowledgement, droppable=False)
+
+    def _send(
+        self,
+        name: str,
+        sink: WriteFunction,
+        queue: BoundedQueue[_Item],
+    ):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if isinstance(item, _Acknowledgement):
+                try:
+                    if item.reached() and not self.lost:
+                        item.callback()
+                except Exception as e:
+                    log.error(f"acknowledgement failed: {e}")
+                continue
+            try:
+                sink(item)
+            except Exception as e:
+                self.lost = True
+                stats.incr(f"sink_errors_{name}")
+                log.error(f"{name}: failed to write {len(item)}B: {e}")
+
+    def close(self):
+        """Waits until sinks write the queued payloads"""
+        for queue in self.queues.values():
+            queue.put(None, droppable=False)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self) -> "FanOut":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
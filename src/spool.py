@@ -0,0 +1,326 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from . import logger_factory
+from .stats import stats
+from .writer import WriteFunction
+
+log = logger_factory("spool")
+
+# each record is prefixed by its length and crc32 of the payload
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+# segments with corrupted records are kept aside for inspection
+QUARANTINE_SUFFIX = ".corrupt"
+
+# (segment id, offset after the record, payload)
+SpoolRecord = Tuple[int, int, bytes]
+
+
+def segment_name(segment: int) -> str:
+    return f"{segment:012d}{SEGMENT_SUFFIX}"
+
+
+class Spool:
+    """Append-only disk spool (write-ahead log) of encoded batches.
+    Records are appended to size-capped segment files, consumer reads
+    them in order starting from the acknowledged position, which is
+    persisted. Fully acknowledged segments are removed. If total size
+    exceeds `max_bytes`, the oldest segments are dropped (and counted).
+    A corrupted record makes the rest of its segment quarantined
+    (renamed to `.corrupt`), since record boundaries can't be trusted
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 << 20,
+        max_bytes: int = 1 << 30,
+        fsync: bool = False,
+    ) -> None:
+        if segment_bytes <= RECORD_HEADER.size:
+            raise ValueError(f"invalid segment size: {segment_bytes}")
+        if max_bytes < segment_bytes:
+            raise ValueError("spool size cap is less than the segment size")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.lock = threading.Condition()
+        self.dropped_segments = 0
+        self.readers: Dict[int, BinaryIO] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments: List[int] = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.ack_segment, self.ack_offset = self._load_ack()
+        for segment in [s for s in self.segments if s < self.ack_segment]:
+            self._remove(segment)
+        if not self.segments:
+            self.segments.append(self.ack_segment)
+        self._recover(self.segments[-1])
+        self.active = open(self._path(self.segments[-1]), "ab")
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, segment_name(segment))
+
+    @property
+    def _ack_path(self) -> str:
+        return os.path.join(self.directory, "ack.json")
+
+    def _load_ack(self) -> Tuple[int, int]:
+        try:
+            with open(self._ack_path) as f:
+                ack = json.load(f)
+            return int(ack["segment"]), int(ack["offset"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            # e.g., truncated by a crash, records are replayed
+            # from the first segment (at-least-once)
+            log.error(f"can't read {self._ack_path} ({e}), replaying")
+        first = self.segments[0] if self.segments else 0
+        return first, 0
+
+    def _recover(self, segment: int):
+        # a crash might have left the last record incomplete,
+        # valid prefix of the segment is kept
+        path = self._path(segment)
+        if not os.path.exists(path):
+            return
+        valid = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid = f.tell()
+        if valid != os.path.getsize(path):
+            log.warning(f"truncating torn tail of {path} at {valid}")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+
+    def _remove(self, segment: int):
+        reader = self.readers.pop(segment, None)
+        if reader is not None:
+            reader.close()
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+        self.segments.remove(segment)
+
+    def _size(self, segment: int) -> int:
+        if segment == self.segments[-1]:
+            return self.active.tell()
+        return os.path.getsize(self._path(segment))
+
+    @property
+    def size(self) -> int:
+        """Total size of the segments on disk"""
+        with self.lock:
+            return sum(map(self._size, self.segments))
+
+    def _roll(self):
+        self.active.close()
+        segment = self.segments[-1] + 1
+        self.segments.append(segment)
+        self.active = open(self._path(segment), "ab")
+
+    def _enforce_cap(self):
+        while len(self.segments) > 1:
+            total = sum(map(self._size, self.segments))
+            if total <= self.max_bytes:
+                return
+            oldest = self.segments[0]
+            log.error(f"spool is full, dropping segment {oldest}")
+            self._remove(oldest)
+            self.dropped_segments += 1
+            if self.ack_segment <= oldest:
+                self._store_ack(self.segments[0], 0)
+
+    def append(self, payload: bytes):
+        """Appends a record (can be used as a WriteFunction)"""
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+        with self.lock:
+            position = self.active.tell()
+            if position and position + len(record) + len(payload) > (
+                self.segment_bytes
+            ):
+                self._roll()
+                self._enforce_cap()
+            self.active.write(record + payload)
+            self.active.flush()
+            if self.fsync:
+                os.fsync(self.active.fileno())
+            self.lock.notify_all()
+
+    def peek(self) -> Optional[SpoolRecord]:
+        """Returns the first unacknowledged record or None"""
+        with self.lock:
+            while True:
+                segment, offset = self.ack_segment, self.ack_offset
+                if offset < self._size(segment):
+                    try:
+                        return self._read(segment, offset)
+                    except ValueError as e:
+                        self._quarantine(segment, e)
+                        continue
+                if segment == self.segments[-1]:
+                    return None
+                # segment is fully acknowledged
+                self._remove(segment)
+                self._store_ack(self.segments[0], 0)
+
+    def _read(self, segment: int, offset: int) -> SpoolRecord:
+        if segment not in self.readers:
+            self.readers[segment] = open(self._path(segment), "rb")
+        reader = self.readers[segment]
+        reader.seek(offset)
+        header = reader.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            raise ValueError(f"truncated record: segment {segment}@{offset}")
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = reader.read(length)
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"corrupted record: segment {segment}@{offset}")
+        return segment, offset + RECORD_HEADER.size + length, payload
+
+    def _quarantine(self, segment: int, error: Exception):
+        log.error(f"{error}, quarantining the rest of the segment")
+        stats.incr("spool_corrupted_segments")
+        if segment == self.segments[-1]:
+            self._roll()
+        reader = self.readers.pop(segment, None)
+        if reader is not None:
+            reader.close()
+        path = self._path(segment)
+        os.replace(path, f"{path}{QUARANTINE_SUFFIX}")
+        self.segments.remove(segment)
+        self._store_ack(self.segments[0], 0)
+
+    def ack(self, segment: int, offset: int):
+        """Marks records up to the given position as delivered"""
+        with self.lock:
+            if segment < self.segments[0]:
+                # segment was dropped while being written
+                return
+            self._store_ack(segment, offset)
+            self.lock.notify_all()
+
+    def _store_ack(self, segment: int, offset: int):
+        self.ack_segment, self.ack_offset = segment, offset
+        temporary = f"{self._ack_path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+        os.replace(temporary, self._ack_path)
+
+    def pending(self) -> bool:
+        with self.lock:
+            last = self.segments[-1]
+            return (self.ack_segment, self.ack_offset) != (
+                last,
+                self._size(last),
+            )
+
+    def wait(self, timeout: float) -> bool:
+        """Waits until spool state changes (append/ack)"""
+        with self.lock:
+            return self.lock.wait(timeout)
+
+    def close(self):
+        with self.lock:
+            self.active.close()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers.clear()
+
+
+class SpoolDrainer:
+    """Replays spooled batches to the destination in order.
+    A record is acknowledged only after it was written, failed writes
+    are retried with exponential backoff, thus delivery is at-least-once
+    (a crash between a write and its acknowledgement results in a resend)
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        write: WriteFunction,
+        retry_interval: float = 0.5,
+        max_retry_interval: float = 30.0,
+    ) -> None:
+        self.spool = spool
+        self.write = write
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.stopped = threading.Event()
+        self.delivered = 0
+        self.failures = 0
+        self.thread = threading.Thread(
+            target=self._drain,
+            name="spool-drainer",
+            daemon=True,
+        )
+
+    def start(self) -> "SpoolDrainer":
+        self.thread.start()
+        return self
+
+    def _drain(self):
+        backoff = self.retry_interval
+        while not self.stopped.is_set():
+            try:
+                record = self.spool.peek()
+            except OSError as e:
+                # the thread keeps running, otherwise nothing is
+                # replayed until restart
+                log.error(f"can't read spool: {e}")
+                self.stopped.wait(self.max_retry_interval)
+                continue
+            if record is None:
+                self.spool.wait(timeout=0.1)
+                continue
+            segment, offset, payload = record
+            try:
+                self.write(payload)
+            except Exception as e:
+                self.failures += 1
+                log.warning(f"write failed, retry in {backoff:.1f}s: {e}")
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_retry_interval)
+                continue
+            backoff = self.retry_interval
+            self.spool.ack(segment, offset)
+            self.delivered += 1
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stops the drainer, waiting (up to timeout) for the
+        spool to be drained. Undelivered records stay on disk
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.spool.pending() and self.thread.is_alive():
+            if deadline is not None and time.monotonic() >= deadline:
+                log.warning("spool was not drained before timeout")
+                break
+            self.spool.wait(timeout=0.1)
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self) -> "SpoolDrainer":
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
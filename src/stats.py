@@ -0,0 +1,162 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+# samples kept per distribution between reports
+RESERVOIR_SIZE = 1024
+
+
+class Distribution:
+    """Keeps the most recent samples of a value
+    (e.g., latency or batch size) for percentile estimation
+    """
+
+    def __init__(self, size: int = RESERVOIR_SIZE) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        if not self.samples:
+            return {"count": self.count}
+        ordered = sorted(self.samples)
+
+        def percentile(q: float) -> float:
+            return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+        return {
+            "count": self.count,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": ordered[-1],
+        }
+
+
+class Stats:
+    """Thread-safe registry of pipeline health metrics:
+    counters (monotonic), gauges (sampled on report) and
+    distributions (summarized by percentiles)
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.distributions: Dict[str, Distribution] = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: Callable[[], float]):
+        """Registers function sampled on each report (e.g., queue size)"""
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            if name not in self.distributions:
+                self.distributions[name] = Distribution()
+            self.distributions[name].add(value)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Flat mapping of metric names to their current values"""
+        with self.lock:
+            values: Dict[str, float] = dict(self.counters)
+            gauges = list(self.gauges.items())
+            for name, distribution in self.distributions.items():
+                for key, value in distribution.summary().items():
+                    values[f"{name}_{key}"] = value
+        for name, gauge in gauges:
+            try:
+                values[name] = float(gauge())
+            except Exception as e:
+                logging.getLogger("stats").warning(f"gauge {name}: {e}")
+        return values
+
+    def line_protocol(
+        self,
+        measurement: str = "nmon-collector",
+        tags: Optional[Dict[str, str]] = None,
+        ns: Optional[int] = None,
+    ) -> str:
+        # imported here as encoder module depends on the package
+        from .encoder import escape_tag, series_key
+
+        values = self.snapshot()
+        fields = ",".join(
+            f"{escape_tag(name)}={value}i"
+            if isinstance(value, int)
+            else f"{escape_tag(name)}={value}"
+            for name, value in sorted(values.items())
+        )
+        ns = time.time_ns() if ns is None else ns
+        return f"{series_key(measurement, **(tags or {}))} {fields} {ns}"
+
+
+# process-wide registry, stages report into it
+stats = Stats()
+
+
+class StatsReporter:
+    """Periodically writes stats snapshot as its own measurement
+    through the given write function (e.g., BatchingWriter.write).
+    Optionally dumps the final snapshot as JSON on exit
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str], None],
+        interval: float = 10.0,
+        tags: Optional[Dict[str, str]] = None,
+        dump_path: Optional[str] = None,
+        registry: Stats = stats,
+    ) -> None:
+        self.write = write
+        self.interval = interval
+        self.tags = tags
+        self.dump_path = dump_path
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._report_periodically,
+            name="stats-reporter",
+            daemon=True,
+        )
+
+    def report(self):
+        if not self.registry.snapshot():
+            return
+        self.write(self.registry.line_protocol(tags=self.tags))
+
+    def _report_periodically(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                logging.getLogger("stats").error(f"report failed: {e}")
+
+    def start(self) -> "StatsReporter":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+        if self.dump_path:
+            with open(self.dump_path, "w") as f:
+                json.dump(self.registry.snapshot(), f, indent=2)
+
+    def __enter__(self) -> "StatsReporter":
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
@@ -0,0 +1,136 @@
+import datetime
+import random
+from typing import Iterator, List, Optional
+
+from .scraper import MONTHS
+
+# month abbreviations in calendar order
+MONTH_NAMES = list(MONTHS)
+
+
+def nmon_date(dt: datetime.datetime) -> str:
+    # 15:50:44,02-FEB-2023 (reverse of parse_nmon_date)
+    return (
+        f"{dt:%H:%M:%S},"
+        f"{dt.day:02}-{MONTH_NAMES[dt.month - 1]}-{dt.year}"
+    )
+
+
+def nmon_timestamp(code: int, dt: datetime.datetime) -> str:
+    # ZZZZ,T0004,15:50:44,02-FEB-2023
+    return f"ZZZZ,T{code:04},{nmon_date(dt)}"
+
+
+def synthetic_header(
+    cpus: int, disks: int, host: str = "synthetic"
+) -> List[str]:
+    """Header lines in the same layout as `nmon -F` emits them"""
+    disk_names = ",".join(disk_name(i) for i in range(disks))
+    header = [
+        f"CPU{i:03},CPU {i} {host},User%,Sys%,Wait%,Idle%,Steal%"
+        for i in range(1, cpus + 1)
+    ]
+    header += [
+        f"CPU_ALL,CPU Total {host},User%,Sys%,Wait%,Idle%,Steal%,Busy,CPUs",
+        f"MEM,Memory MB {host},memtotal,hightotal,lowtotal,swaptotal,"
+        "memfree,highfree,lowfree,swapfree,memshared,cached,active,"
+        "bigfree,buffers,swapcached,inactive",
+        f"PROC,Processes {host},Runnable,Blocked,pswitch,syscall,read,"
+        "write,fork,exec,sem,msg",
+        f"NET,Network I/O {host},lo-read-KB/s,eth0-read-KB/s,"
+        "lo-write-KB/s,eth0-write-KB/s",
+    ]
+    header += [
+        f"{prefix},{title} {host},{disk_names}"
+        for prefix, title in (
+            ("DISKBUSY", "Disk %Busy"),
+            ("DISKREAD", "Disk Read KB/s"),
+            ("DISKWRITE", "Disk Write KB/s"),
+            ("DISKXFER", "Disk transfers per second"),
+            ("DISKBSIZE", "Disk Block Size"),
+        )
+    ]
+    return header
+
+
+def disk_name(index: int) -> str:
+    # sda..sdz, sdaa.. like the kernel does
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("a") + remainder) + letters
+    return f"sd{letters}"
+
+
+def synthetic_frame(
+    code: int,
+    dt: datetime.datetime,
+    cpus: int,
+    disks: int,
+    rng: random.Random,
+) -> List[str]:
+    """Lines of a single interval (ZZZZ line followed by records)"""
+    t = f"T{code:04}"
+    frame = [nmon_timestamp(code, dt)]
+    for i in range(1, cpus + 1):
+        user, sys, wait = (round(rng.uniform(0, 30), 1) for _ in range(3))
+        idle = round(max(100 - user - sys - wait, 0), 1)
+        frame.append(f"CPU{i:03},{t},{user},{sys},{wait},{idle},0.0")
+    frame.append(f"CPU_ALL,{t},2.4,1.0,0.3,96.4,0.0,,{cpus}")
+    memfree = round(rng.uniform(1000, 8000), 1)
+    frame.append(
+        f"MEM,{t},13841.9,-0.0,-0.0,0.0,{memfree},-0.0,-0.0,0.0,"
+        "188.6,1981.8,780.1,-1.0,172.1,0.0,4513.8"
+    )
+    frame.append(f"PROC,{t},2,0,{rng.uniform(0, 5000):.1f},-1.0,-1.0,-1.0")
+    frame.append(f"NET,{t},0.0,{rng.uniform(0, 100):.1f},0.0,0.8")
+    for prefix, high in (
+        ("DISKBUSY", 100),
+        ("DISKREAD", 5000),
+        ("DISKWRITE", 5000),
+        ("DISKXFER", 500),
+        ("DISKBSIZE", 64),
+    ):
+        values = ",".join(
+            # most of the devices are idle most of the time
+            f"{rng.uniform(0, high):.1f}" if rng.random() < 0.3 else "0.0"
+            for _ in range(disks)
+        )
+        frame.append(f"{prefix},{t},{values}")
+    return frame
+
+
+def synthetic_nmon(
+    cpus: int = 12,
+    disks: int = 8,
+    intervals: int = 60,
+    start: Optional[datetime.datetime] = None,
+    step: int = 1,
+    seed: int = 0,
+    host: str = "synthetic",
+) -> Iterator[str]:
+    """Generates realistic nmon output: header followed by
+    `intervals` frames. Lines are yielded without newlines
+
+    :param cpus: number of cores
+    :type cpus: int, optional
+    :param disks: number of block devices
+    :type disks: int, optional
+    :param intervals: number of frames
+    :type intervals: int, optional
+    :param start: time of the first frame, defaults to now
+    :type start: Optional[datetime.datetime], optional
+    :param step: seconds between frames (nmon -s)
+    :type step: int, optional
+    :param seed: random seed, output is reproducible
+    :type seed: int, optional
+    :return: nmon output lines
+    :rtype: Iterator[str]
+    """
+    rng = random.Random(seed)
+    start = start or datetime.datetime.now().replace(microsecond=0)
+    yield from synthetic_header(cpus, disks, host)
+    for code in range(1, intervals + 1):
+        dt = start + datetime.timedelta(seconds=step * (code - 1))
+        yield from synthetic_frame(code, dt, cpus, disks, rng)
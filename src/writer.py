@@ -0,0 +1,304 @@
+import gzip
+import threading
+import time
+from typing import Callable, Optional, Tuple, Union
+
+from influxdb_client import InfluxDBClient
+from influxdb_client.service.write_service import WriteService
+
+from . import logger_factory
+from .backpressure import BoundedQueue
+from .encoder import LineBuffer
+from .registry import Entry
+from .stats import stats
+
+log = logger_factory("writer")
+
+WriteFunction = Callable[[bytes], None]
+
+# encoded payload, number of lines and the timestamp of the last one
+_Batch = Tuple[bytes, int, Optional[int]]
+# called by the sender once the preceding batches are written
+Acknowledgement = Callable[[], None]
+
+
+Compressor = Callable[[bytes], bytes]
+
+# default levels favour speed, payloads are small and sent often
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def compressor(codec: str, level: Optional[int] = None) -> Compressor:
+    """Creates payload compression function. zstd requires
+    optional `zstandard` package
+
+    :param codec: either "gzip" or "zstd"
+    :type codec: str
+    :param level: compression level, defaults to DEFAULT_LEVELS
+    :type level: Optional[int], optional
+    :raises ValueError: if codec (or level) is not supported
+    :return: function compressing a payload
+    :rtype: Compressor
+    """
+    if codec not in DEFAULT_LEVELS:
+        raise ValueError(f"invalid compression: {codec}. expected gzip/zstd")
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "gzip":
+        if not 0 <= level <= 9:
+            raise ValueError(f"invalid gzip level: {level}")
+        return lambda payload: gzip.compress(payload, level, mtime=0)
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ValueError("zstd compression requires zstandard") from e
+    # compressor objects are not thread-safe
+    local = threading.local()
+
+    def compress(payload: bytes) -> bytes:
+        if not hasattr(local, "compressor"):
+            local.compressor = zstandard.ZstdCompressor(level=level)
+        return local.compressor.compress(payload)
+
+    return compress
+
+
+def decompress(codec: str, payload: bytes) -> bytes:
+    """Reverse of compressor (e.g., for receiving ends in tests)"""
+    if codec == "gzip":
+        return gzip.decompress(payload)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"invalid compression: {codec}")
+
+
+def influx_http_write_function(
+    client: InfluxDBClient,
+    bucket: str,
+    compression: Optional[str] = None,
+    level: Optional[int] = None,
+) -> WriteFunction:
+    """Posts payloads to the write endpoint directly, optionally
+    compressed (with Content-Encoding header set accordingly).
+    Compression is done by the calling thread, which is the sender
+    thread of BatchingWriter (or SpoolDrainer), not the parsing one.
+    Raw and sent bytes are counted in stats
+
+    :param client: influx client
+    :type client: InfluxDBClient
+    :param bucket: destination bucket name
+    :type bucket: str
+    :param compression: "gzip" or "zstd" (the receiving end should
+        accept it, InfluxDB itself supports gzip), defaults to None
+    :type compression: Optional[str], optional
+    :param level: compression level
+    :type level: Optional[int], optional
+    :return: function performing a single http request per call
+    :rtype: WriteFunction
+    """
+    service = WriteService(client.api_client)
+    compress = compressor(compression, level) if compression else None
+
+    def write(payload: bytes):
+        body = payload if compress is None else compress(payload)
+        service.post_write(
+            org=client.org,
+            bucket=bucket,
+            body=body,
+            precision="ns",
+            content_encoding=compression or "identity",
+            content_type="text/plain; charset=utf-8",
+        )
+        stats.incr("bytes_raw", len(payload))
+        stats.incr("bytes_sent", len(body))
+
+    return write
+
+
+class BatchingWriter:
+    """Groups line protocol entries into batches, so that each
+    nmon interval (ZZZZ frame) results in a single write request.
+    Samples of frame records are encoded straight into the batch
+    payload (see LineBuffer), entries given as strings are copied.
+    A batch is flushed when either:
+
+    - the timestamp of incoming line differs from the one of
+      the batch (i.e., next interval has started)
+    - batch has reached `batch_size` lines
+    - the oldest line in the batch is older than `flush_interval` seconds
+
+    Interval splitting can be disabled (`split_intervals`) when lines
+    of several sources with unrelated timestamps are interleaved.
+
+    At most `max_pending` flushed batches wait for the sender. When
+    writes can't keep up, the producer is either blocked or whole
+    batches (i.e., intervals) are dropped, depending on `policy`
+    (see backpressure.POLICIES)
+    """
+
+    def __init__(
+        self,
+        write: WriteFunction,
+        batch_size: int = 5000,
+        flush_interval: float = 1.0,
+        max_pending: int = 16,
+        split_intervals: bool = True,
+        policy: str = "block",
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError(f"invalid batch size: {batch_size}")
+        if flush_interval <= 0:
+            raise ValueError(f"invalid flush interval: {flush_interval}")
+        self.write_function = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.split_intervals = split_intervals
+
+        self.batch = LineBuffer()
+        self.batch_timestamp: Optional[int] = None
+        self.batch_started = 0.0
+        # guards the batch, flushed batches are handed over
+        # to a single sender thread so that they are written in order
+        # (the queue is bounded, thus slow writes either block
+        # the producer or make batches dropped)
+        self.lock = threading.Condition()
+        self.payloads: BoundedQueue[
+            Union[_Batch, Acknowledgement, None]
+        ] = BoundedQueue(max_pending, policy=policy, name="batches")
+        # set once a batch is dropped or fails to be written
+        self.lost = False
+        stats.gauge("queue_write", self.payloads.qsize)
+        self.closed = False
+
+        self.sender = threading.Thread(
+            target=self._send,
+            name="batch-sender",
+            daemon=True,
+        )
+        self.sender.start()
+
+        self.timer = threading.Thread(
+            target=self._flush_on_timeout,
+            name="batch-timer",
+            daemon=True,
+        )
+        self.timer.start()
+
+    def write(self, entry: Entry):
+        if isinstance(entry, str):
+            _, _, stamp = entry.rpartition(" ")
+            timestamp = int(stamp) if stamp.isdigit() else None
+        else:
+            timestamp = entry.record.ns
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("write to closed writer")
+            if (
+                self.split_intervals
+                and self.batch
+                and timestamp != self.batch_timestamp
+            ):
+                self._flush_locked()
+            if not self.batch:
+                self.batch_started = time.monotonic()
+                self.lock.notify()
+            if isinstance(entry, str):
+                self.batch.append(entry)
+            else:
+                self.batch.add(entry)
+            # timestamp of the last entry (the same for the whole
+            # batch, unless intervals are not split)
+            self.batch_timestamp = timestamp
+            if len(self.batch) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def acknowledge(self, callback: Acknowledgement):
+        """Calls back (on the sender thread) once all the lines
+        written so far are sent. If any batch was lost (dropped or
+        failed), acknowledgements are not called anymore, so that
+        progress (e.g., backfill checkpoints) never skips lost lines.
+        Write functions which deliver asynchronously (e.g., FanOut)
+        may define `acknowledge` themselves, it is then handed the
+        callback once the preceding batches are passed to them
+        """
+        with self.lock:
+            self._flush_locked()
+            self.payloads.put(callback, droppable=False)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self._flush_locked()
+            self.closed = True
+            self.lock.notify()
+        self.timer.join()
+        self.payloads.put(None, droppable=False)
+        self.sender.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _flush_locked(self):
+        lines = len(self.batch)
+        if not lines:
+            return
+        timestamp, self.batch_timestamp = self.batch_timestamp, None
+        dropped = self.payloads.put((self.batch.take(), lines, timestamp))
+        if dropped is not None:
+            self.lost = True
+            stats.incr("dropped_lines_write", dropped[1])  # type: ignore
+
+    def _send(self):
+        while True:
+            batch = self.payloads.get()
+            if batch is None:
+                return
+            if callable(batch):
+                forward = getattr(self.write_function, "acknowledge", None)
+                try:
+                    if self.lost:
+                        continue
+                    if forward is not None:
+                        forward(batch)
+                    else:
+                        batch()
+                except Exception as e:
+                    log.error(f"acknowledgement failed: {e}")
+                continue
+            payload, lines, timestamp = batch
+            stats.observe("batch_lines", lines)
+            started = time.monotonic()
+            try:
+                self.write_function(payload)
+            except Exception as e:
+                self.lost = True
+                stats.incr("write_errors")
+                log.error(f"failed to write batch ({len(payload)}B): {e}")
+                continue
+            stats.observe("write_latency", time.monotonic() - started)
+            stats.incr("lines_written", lines)
+            if timestamp is not None:
+                # how far behind the nmon clock the written data is
+                stats.observe("write_lag", time.time() - timestamp / 1e9)
+
+    def _flush_on_timeout(self):
+        with self.lock:
+            while not self.closed:
+                if not self.batch:
+                    self.lock.wait()
+                    continue
+                deadline = self.batch_started + self.flush_interval
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.lock.wait(remaining)
+                    continue
+                self._flush_locked()
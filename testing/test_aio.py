@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+
+import pytest
+
+from main import check_asyncio_settings, prefix_filter
+from src.aio import AsyncMetrics, run_async_pipeline
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+
+
+def test_async_pipeline_batches_intervals():
+    payloads = []
+
+    async def write(payload: bytes):
+        await asyncio.sleep(0.01)
+        payloads.append(payload)
+
+    metrics = asyncio.run(
+        run_async_pipeline(
+            ["cat", SAMPLE],
+            run_id="0",
+            write=write,
+            line_filter=prefix_filter,
+            read_queue_size=8,
+            write_queue_size=1,
+        )
+    )
+    assert isinstance(metrics, AsyncMetrics)
+
+    # one request per interval
+    assert len(payloads) == 5
+    lines = [line for p in payloads for line in p.decode().split("\n")]
+    # 12 cores + average, memory and 5 disk sections for 7 disks,
+    # proc, vm, net, netpacket and 3 filesystems
+    assert len(lines) == 5 * (13 + 1 + 5 * 7 + 4 + 3)
+    assert metrics.lines_written == len(lines)
+    assert metrics.write_latency.count == 5
+    assert metrics.write_latency.mean >= 0.01
+    assert metrics.read_lag.count == metrics.lines_read
+
+
+def test_async_write_errors_do_not_stop_pipeline():
+    calls = 0
+
+    async def write(_: bytes):
+        nonlocal calls
+        calls += 1
+        raise ConnectionError("influx is down")
+
+    asyncio.run(
+        run_async_pipeline(
+            ["cat", SAMPLE],
+            run_id="0",
+            write=write,
+            line_filter=prefix_filter,
+        )
+    )
+    assert calls == 5
+
+
+def test_asyncio_rejects_unsupported_settings(monkeypatch):
+    args = argparse.Namespace(sources=None, follow=None, interval=1, count=120)
+    check_asyncio_settings(args)
+    monkeypatch.setenv("NMON_SINKS", "influx,parquet")
+    with pytest.raises(ValueError, match="NMON_SINKS"):
+        check_asyncio_settings(args)
+    monkeypatch.delenv("NMON_SINKS")
+    monkeypatch.setenv("NMON_SPOOL_DIR", "spool")
+    with pytest.raises(ValueError, match="NMON_SPOOL_DIR"):
+        check_asyncio_settings(args)
+    monkeypatch.delenv("NMON_SPOOL_DIR")
+    # values asyncio mode behaves as are accepted
+    monkeypatch.setenv("NMON_PARSE_WORKERS", "0")
+    monkeypatch.setenv("INFLUX_WRITE_POLICY", "block")
+    check_asyncio_settings(args)
+    for name, value in (
+        ("NMON_PARSE_WORKERS", "4"),
+        ("NMON_READ_POLICY", "drop-oldest"),
+        ("INFLUX_WRITE_POLICY", "drop-newest"),
+        ("INFLUX_FLUSH_INTERVAL", "5"),
+        ("NMON_ROLLUP_ONLY", "1"),
+    ):
+        with monkeypatch.context() as env:
+            env.setenv(name, value)
+            with pytest.raises(ValueError, match=name):
+                check_asyncio_settings(args)
@@ -0,0 +1,92 @@
+import itertools
+import mmap
+import shutil
+
+from src.backfill import (
+    frame_offsets,
+    frame_ranges,
+    ingest_file,
+    ingest_files,
+)
+from src.checkpoint import CheckpointStore
+from src.encoder import render
+from src.pipeline import line_dispatcher
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+
+
+def parse_sequentially(path: str, run_id: str):
+    dispatch = line_dispatcher(run_id)
+    with open(path) as f:
+        return [
+            entry for line in f for entry in render(dispatch(line.rstrip()))
+        ]
+
+
+def test_frame_offsets():
+    with open(SAMPLE, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            offsets = frame_offsets(buffer)
+            assert len(offsets) == 5
+            assert all(buffer[o:o + 5] == b"ZZZZ," for o in offsets)
+
+            spans = frame_ranges(offsets, len(buffer), 2)
+            assert len(spans) == 3
+            assert spans[0][0] == offsets[0]
+            assert spans[-1][1] == len(buffer)
+
+
+def test_ingest_file_matches_sequential_parsing():
+    """
+    parallel ingestion should emit exactly the same lines
+    in the same (timestamp) order as the sequential parser
+    """
+    expected = parse_sequentially(SAMPLE, "0")
+    got = list(ingest_file(SAMPLE, "0", processes=2, frames_per_range=1))
+    assert got == expected
+    # a single range ahead of the consumer keeps the order as well
+    got = list(
+        ingest_file(
+            SAMPLE, "0", processes=2, frames_per_range=1, max_in_flight=1
+        )
+    )
+    assert got == expected
+
+
+def test_checkpointed_ingestion_resumes(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.json"))
+    expected = parse_sequentially(SAMPLE, "0")
+    lines = ingest_file(
+        SAMPLE, "0", processes=1, frames_per_range=1, checkpoints=store
+    )
+    # interrupted during the third frame (56 lines per frame),
+    # the first two are committed
+    consumed = list(itertools.islice(lines, 2 * 56 + 1))
+    lines.close()
+    assert consumed == expected[: len(consumed)]
+    assert CheckpointStore(store.path).get(SAMPLE).code == "T0002"
+
+    # re-run starts right after the committed frames
+    resumed = CheckpointStore(store.path)
+    got = list(ingest_file(SAMPLE, "0", processes=1, checkpoints=resumed))
+    assert got == expected[2 * 56:]
+    assert list(ingest_file(SAMPLE, "0", checkpoints=resumed)) == []
+
+
+def test_checkpointed_directory(tmp_path):
+    directory = tmp_path / "runs"
+    directory.mkdir()
+    for name in ("a.nmon", "b.nmon"):
+        shutil.copy(SAMPLE, directory / name)
+    store = CheckpointStore(str(tmp_path / "checkpoints.json"))
+    assert len(list(ingest_files([str(directory)], checkpoints=store))) == (
+        2 * 5 * 56
+    )
+    assert list(ingest_files([str(directory)], checkpoints=store)) == []
+
+    # checkpoint which does not match the file is ignored
+    checkpoint = store.get(str(directory / "b.nmon"))
+    store.commit(str(directory / "b.nmon"), checkpoint.offset - 1, "T0004")
+    assert len(list(ingest_files([str(directory)], checkpoints=store))) == (
+        5 * 56
+    )
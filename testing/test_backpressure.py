@@ -0,0 +1,113 @@
+import datetime
+import time
+import tracemalloc
+
+import pytest
+import reactivex as rx
+
+from src.backpressure import BoundedQueue, FrameQueue
+from src.client import bounded_buffer
+from src.pipeline import nmon_parsing_pipeline
+from src.synthetic import synthetic_nmon
+from src.writer import BatchingWriter
+
+START = datetime.datetime(2023, 2, 2, 15, 50, 44)
+
+
+def frames(count: int):
+    yield "CPU_ALL,CPU Total host,User%,Sys%"
+    yield "MEM,Memory MB host,memtotal"
+    for i in range(1, count + 1):
+        yield f"ZZZZ,T{i:04d},15:50:44,02-FEB-2023"
+        yield from (f"CPU_ALL,T{i:04d},{i}.0,0.0", f"MEM,T{i:04d},{i}.0")
+        yield f"VM,T{i:04d},{i}"
+
+
+def drain(queue: FrameQueue):
+    queue.close()
+    lines = []
+    while (line := queue.get()) is not None:
+        lines.append(line)
+    return [line.split(",")[1] for line in lines if line.startswith("ZZZZ")]
+
+
+@pytest.mark.parametrize(
+    "policy,kept", [("drop-oldest", [1, 10]), ("drop-newest", [1, 2])]
+)
+def test_frame_queue_drops_whole_frames(policy, kept):
+    queue = FrameQueue(maxsize=10, policy=policy)
+    for line in frames(10):
+        queue.put(line)
+    # header and the first frame are never dropped
+    assert drain(queue) == [f"T{i:04d}" for i in kept]
+    assert queue.dropped_frames == 8
+    assert queue.dropped_lines == 8 * 4
+
+
+def test_frame_queue_keeps_frame_being_read():
+    queue = FrameQueue(maxsize=14, policy="drop-oldest")
+    lines = list(frames(5))
+    for line in lines[:14]:
+        queue.put(line)
+    # consumer has started the second frame
+    taken = [queue.get() for _ in range(7)]
+    assert taken[-1].startswith("ZZZZ,T0002")
+    for line in lines[14:]:
+        queue.put(line)
+    # the third one is the oldest frame which can be dropped
+    assert drain(queue) == ["T0004", "T0005"]
+    assert queue.dropped_frames == 1
+
+
+def test_bounded_queue_policies():
+    cases = (("drop-oldest", [0, 3, 4]), ("drop-newest", [0, 1, 2]))
+    for policy, kept in cases:
+        queue: BoundedQueue[int] = BoundedQueue(3, policy=policy)
+        discarded = [queue.put(i, droppable=i > 0) for i in range(5)]
+        assert sorted(set(range(5)) - set(kept)) == [
+            i for i in discarded if i is not None
+        ]
+        assert [queue.get() for _ in range(3)] == kept
+        assert queue.dropped == 2
+    with pytest.raises(ValueError):
+        BoundedQueue(3, policy="drop-random")
+
+
+def soak(intervals: int, policy: str):
+    """Fast synthetic source against a slow sink,
+    returns peak traced memory and number of written batches"""
+    written = 0
+
+    def slow_write(payload: bytes):
+        nonlocal written
+        time.sleep(0.001)
+        written += 1
+
+    source = synthetic_nmon(cpus=4, disks=8, intervals=intervals, start=START)
+    tracemalloc.start()
+    try:
+        with BatchingWriter(
+            slow_write, max_pending=4, policy=policy
+        ) as writer:
+            lines = bounded_buffer(source, maxsize=500, policy=policy)
+            nmon_parsing_pipeline(rx.from_iterable(lines), "0").subscribe(
+                writer.write
+            )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, written
+
+
+@pytest.mark.parametrize("policy", ["block", "drop-oldest", "drop-newest"])
+def test_soak_memory_is_flat(policy):
+    soak(20, policy)
+    short_peak, short_written = soak(100, policy)
+    long_peak, long_written = soak(1000, policy)
+    # buffered data is bounded, thus peak memory does not grow with
+    # the length of the run (the margin covers allocator noise)
+    assert long_peak < 2 * short_peak
+    if policy == "block":
+        assert (short_written, long_written) == (100, 1000)
+    else:
+        assert 0 < long_written < 1000
@@ -0,0 +1,89 @@
+import datetime
+
+import reactivex as rx
+
+from src.cardinality import (
+    Deadband,
+    SeriesFilter,
+    deadband,
+    filters_from_patterns,
+)
+from src.encoder import render
+from src.pipeline import line_dispatcher
+from src.synthetic import synthetic_nmon
+
+
+def test_series_filter():
+    exclude_loops = SeriesFilter(exclude=["loop*"])
+    assert exclude_loops("sda")
+    assert not exclude_loops("loop0")
+
+    only_whole_disks = SeriesFilter(include=["sd?", "nvme?n1"])
+    assert only_whole_disks("sda")
+    assert only_whole_disks("nvme0n1")
+    assert not only_whole_disks("nvme0n1p1")
+
+    filters = filters_from_patterns(
+        {"CPU": ("CPU_ALL", None), "DISK": (None, "loop*, sdb"), "X": ("", "")}
+    )
+    assert set(filters) == {"CPU", "DISK"}
+    assert filters["DISK"].exclude == ("loop*", "sdb")
+
+
+def test_filters_applied_at_registration():
+    start = datetime.datetime(2023, 2, 2, 15, 50, 44)
+    dispatch = line_dispatcher(
+        "0",
+        filters={
+            "CPU": SeriesFilter(include=["CPU_ALL"]),
+            "DISK": SeriesFilter(exclude=["sdb", "sdc"]),
+        },
+    )
+    entries = [
+        entry
+        for line in synthetic_nmon(cpus=4, disks=4, intervals=2, start=start)
+        if not line.startswith(("PROC", "NET", "DISKXFER", "DISKBSIZE"))
+        for entry in render(dispatch(line))
+    ]
+    cpus = {e.split(" ")[0] for e in entries if e.startswith("cpu-")}
+    assert cpus == {"cpu-perf-metrics,run=0,cpus=CPU_ALL"}
+    disks = {
+        e.split("disk=")[1].split(",")[0]
+        for e in entries
+        if e.startswith("disk-")
+    }
+    assert disks == {"sda", "sdd"}
+    # 2 disks, 3 modes, 2 intervals
+    assert sum(e.startswith("disk-") for e in entries) == 12
+
+
+def test_deadband():
+    band = Deadband(threshold=0.5, heartbeat=3)
+    key = "disk,run=0,disk=sda,mode=busy"
+    accepted = [
+        band.accept(f"{key} value={value} {ns}")
+        for ns, value in enumerate([0.0, 0.0, 0.4, 0.0, 0.0, 2.0, 2.1])
+    ]
+    # heartbeat forces every 3rd sample, changes above
+    # the threshold are written immediately
+    assert accepted == [True, False, False, True, False, True, False]
+    # any changed field makes the whole entry written
+    assert band.accept("cpu user=1.0,sys=0.0 0")
+    assert band.accept("cpu user=1.0,sys=9.0 1")
+    assert not band.accept("cpu user=1.0,sys=9.0 2")
+
+
+def test_deadband_operator():
+    lines = [
+        f"disk,run=0,disk=sd{d},mode=busy value={value} {s}"
+        for s in range(100)
+        for d, value in (("a", 0.0), ("b", s))
+    ]
+    emitted = []
+    rx.from_iterable(lines).pipe(deadband(heartbeat=10)).subscribe(
+        emitted.append
+    )
+    idle = [e for e in emitted if "disk=sda" in e]
+    busy = [e for e in emitted if "disk=sdb" in e]
+    assert len(busy) == 100
+    assert len(idle) == 10
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+import pytest
+
+import main
+from src import follow
+from src.encoder import render
+from src.follow import FileFollower
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+
+
+def sample_lines():
+    with open(SAMPLE) as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def watcher(request, monkeypatch):
+    if request.param == "polling":
+
+        def unavailable(directory):
+            raise OSError("unavailable")
+
+        monkeypatch.setattr(follow, "_Inotify", unavailable)
+    return request.param
+
+
+def test_follow_growing_file(tmp_path, watcher):
+    lines = sample_lines()
+    frames = [i for i, line in enumerate(lines) if line.startswith("ZZZZ")]
+    path = tmp_path / "host_230131_2148.nmon"
+    path.write_text("\n".join(lines[: frames[1]]) + "\n" + lines[frames[1]])
+
+    follower = FileFollower(str(path), poll_interval=0.05, settle=0.1)
+    emitted = []
+
+    def read():
+        for line in follower.lines():
+            emitted.append(line)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    # the first frame is released once the file settles,
+    # the incomplete ZZZZ line is held back
+    wait_for(lambda: len(emitted) == frames[1])
+    time.sleep(0.2)
+    assert emitted == lines[: frames[1]]
+
+    with open(path, "a") as f:
+        f.write("\n" + "\n".join(lines[frames[1] + 1:]) + "\n")
+    wait_for(lambda: len(emitted) == len(lines))
+    follower.stop()
+    reader.join(timeout=5)
+    assert emitted == lines
+
+
+def test_follow_rotation(tmp_path, watcher):
+    lines = sample_lines()
+    first = tmp_path / "host_230131_0000.nmon"
+    first.write_text("\n".join(lines) + "\n")
+    follower = FileFollower(
+        str(tmp_path / "*.nmon"),
+        poll_interval=0.05,
+        settle=0.05,
+        idle_timeout=1,
+        rescan_interval=0.1,
+    )
+    files = []
+
+    def read():
+        for file_lines in follower.files():
+            files.append(list(file_lines))
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    time.sleep(0.3)
+    # nmon is restarted and writes a new file
+    second = tmp_path / "host_230201_0000.nmon"
+    second.write_text("\n".join(lines[:10]))
+    os.utime(first, (0, 0))
+    with open(second, "a") as f:
+        f.write("\n" + "\n".join(lines[10:]) + "\n")
+    reader.join(timeout=10)
+    assert files == [lines, lines]
+    assert follower.current == str(second)
+
+
+def test_follow_stream(tmp_path, monkeypatch):
+    path = tmp_path / "host.nmon"
+    path.write_text("\n".join(sample_lines()) + "\n")
+    monkeypatch.setenv("NMON_FOLLOW_IDLE_TIMEOUT", "0.5")
+    emitted = []
+    done = threading.Event()
+    reader = threading.Thread(
+        target=lambda: main.follow_stream(str(path), "0").subscribe(
+            lambda entry: emitted.extend(render([entry])),
+            on_completed=done.set,
+        ),
+        daemon=True,
+    )
+    reader.start()
+    assert done.wait(timeout=10)
+    assert len(emitted) == 5 * 56
+
+
+def test_follow_files_consumed_in_order(tmp_path):
+    path = tmp_path / "host.nmon"
+    path.write_text("\n".join(sample_lines()) + "\n")
+    follower = FileFollower(str(path), poll_interval=0.05, idle_timeout=0.2)
+    files = follower.files()
+    next(files)
+    # the same file is not yielded again while it is being followed
+    with pytest.raises(RuntimeError):
+        next(files)
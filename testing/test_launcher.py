@@ -0,0 +1,73 @@
+import os
+import stat
+import time
+
+import pytest
+
+from src.launcher import NmonLauncher
+
+SAMPLE = os.path.abspath("testing/data/sample_nmon_output.csv")
+
+
+def fake_nmon(tmp_path, writer: str) -> str:
+    """Script mimicking `nmon -F FIFO -p`: writer is started in
+    background, its PID is printed and the script exits"""
+    path = tmp_path / "nmon"
+    path.write_text(
+        "#!/bin/sh\n"
+        'while [ $# -gt 0 ]; do [ "$1" = -F ] && fifo=$2; shift; done\n'
+        f'{writer} > "$fifo" &\n'
+        "echo $!\n"
+    )
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_launcher_reads_fifo(tmp_path):
+    launcher = NmonLauncher(
+        interval=2,
+        count=5,
+        nmon=fake_nmon(tmp_path, f"cat {SAMPLE}"),
+        chunk_size=100,
+    )
+    lines = list(launcher.lines())
+
+    with open(SAMPLE) as f:
+        expected = [
+            line.rstrip("\n")
+            for line in f
+            if not line.startswith(("AAA", "BBBP"))
+        ]
+    assert lines == expected
+    assert launcher.directory is None
+
+
+def test_launcher_stops_nmon(tmp_path):
+    writer = (
+        "sh -c 'trap \"exit 0\" USR2; "
+        f"while :; do cat {SAMPLE}; sleep 0.01; done'"
+    )
+    with NmonLauncher(nmon=fake_nmon(tmp_path, writer)) as launcher:
+        assert "-s" in launcher.command()
+        fifo = launcher.fifo
+        pid = launcher.pid
+        lines = launcher.lines()
+        for _ in range(1000):
+            next(lines)
+        lines.close()
+
+    assert not os.path.exists(fifo)
+    # writer terminates gracefully after the signal
+    for _ in range(100):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("nmon was not stopped")
+
+
+def test_launcher_start_failure(tmp_path):
+    with pytest.raises(RuntimeError):
+        NmonLauncher(nmon=str(tmp_path / "missing")).start()
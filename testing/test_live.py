@@ -0,0 +1,96 @@
+import json
+import urllib.request
+
+import pytest
+
+from src.live import LiveServer, LiveStore, RingBuffer, mean_buckets
+from src.pipeline import line_dispatcher
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+SECOND = 1_000_000_000
+
+
+def test_ring_buffer_keeps_recent_samples():
+    buffer = RingBuffer(4)
+    for i in range(10):
+        buffer.append(i * SECOND, float(i))
+    assert len(buffer) == 4
+    assert buffer.window(0, 100 * SECOND) == [
+        (i * SECOND, float(i)) for i in range(6, 10)
+    ]
+    assert buffer.window(7 * SECOND, 8 * SECOND) == [
+        (7 * SECOND, 7.0),
+        (8 * SECOND, 8.0),
+    ]
+
+
+def test_mean_buckets():
+    samples = [(i * SECOND, float(i)) for i in range(6)]
+    assert mean_buckets(samples, 2000) == [
+        [0.5, 0],
+        [2.5, 2000],
+        [4.5, 4000],
+    ]
+    assert mean_buckets(samples[:2], 0) == [[0.0, 0], [1.0, 1000]]
+
+
+@pytest.fixture
+def store() -> LiveStore:
+    store = LiveStore(capacity=3)
+    dispatch = line_dispatcher("0")
+    with open(SAMPLE) as f:
+        for line in f:
+            for entry in dispatch(line.rstrip("\n")):
+                store.add(entry)
+    return store
+
+
+def test_live_store(store: LiveStore):
+    targets = store.search("CPU_ALL")
+    assert "cpu-perf-metrics,run=0,cpus=CPU_ALL user" in targets
+    assert len(targets) == 5
+    # 5 intervals, the last 3 are kept
+    points = store.query(targets[0], 0, 2**42)
+    assert len(points) == 3
+    assert [ms for _, ms in points] == sorted(ms for _, ms in points)
+    # all of them averaged in a single bucket
+    mean = store.query(targets[0], 0, 2**42, interval_ms=2**42)
+    assert mean[0][0] == pytest.approx(sum(v for v, _ in points) / 3)
+    assert store.annotations(0, 2**42) == [(points[0][1] - 2000, "0")]
+
+
+def test_simple_json_server(store: LiveStore):
+    def post(path: str, body: dict):
+        request = urllib.request.Request(
+            f"{server.url}{path}",
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    with LiveServer(store, host="127.0.0.1", port=0) as server:
+        with urllib.request.urlopen(server.url) as response:
+            assert response.status == 200
+        target = "mem-perf-metrics,run=0 memfree"
+        targets = post("/search", {"target": "mem-"})
+        assert targets[0] == "mem-perf-metrics,run=0 active"
+        time_range = {
+            "from": "2023-01-01T00:00:00.000Z",
+            "to": "2024-01-01T00:00:00.000Z",
+        }
+        (result,) = post(
+            "/query",
+            {
+                "range": time_range,
+                "intervalMs": 1000,
+                "targets": [{"target": target, "refId": "A"}],
+            },
+        )
+        assert result["target"] == target
+        assert len(result["datapoints"]) == 3
+        (annotation,) = post(
+            "/annotations",
+            {"range": time_range, "annotation": {"name": "runs"}},
+        )
+        assert annotation["text"] == "0"
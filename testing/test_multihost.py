@@ -0,0 +1,98 @@
+import re
+import threading
+import time
+
+import pytest
+
+from main import prefix_filter
+from src.encoder import render
+from src.multihost import MultiHostCollector, NmonSource
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+
+
+def test_source_spec():
+    source = NmonSource.from_spec("db1=ssh db1 sh nmon-to-stdout.sh")
+    assert source.host == "db1"
+    assert source.command == ["ssh", "db1", "sh", "nmon-to-stdout.sh"]
+
+    source = NmonSource.from_spec("db2=fifo:/tmp/nmon-db2")
+    assert source.host == "db2" and source.path == "/tmp/nmon-db2"
+
+    with pytest.raises(ValueError):
+        NmonSource.from_spec("no-host")
+
+
+def test_multihost_collector_tags_and_fairness():
+    hosts = ("db1", "db2", "db3")
+    emitted = []
+    collector = MultiHostCollector(
+        [NmonSource(host, path=SAMPLE) for host in hosts[:2]]
+        + [NmonSource(hosts[2], command=["cat", SAMPLE])],
+        run_id="0",
+        write=lambda entry: emitted.extend(render([entry])),
+        line_filter=prefix_filter,
+        quantum=8,
+    )
+    collector.run()
+
+    def host_of(line: str) -> str:
+        return re.search(r",host=([^, ]+)", line).group(1)
+
+    per_host = {
+        host: [line for line in emitted if host_of(line) == host]
+        for host in hosts
+    }
+    # each source has its own parser state
+    assert all(len(lines) == 5 * 56 for lines in per_host.values())
+    assert sum(map(len, per_host.values())) == len(emitted)
+
+    # sources are interleaved instead of being drained one by one
+    first_host_done = emitted.index(per_host["db1"][-1])
+    assert "db2" in {host_of(line) for line in emitted[:first_host_done]}
+
+
+def test_multihost_rejects_duplicate_hosts():
+    with pytest.raises(ValueError):
+        MultiHostCollector(
+            [NmonSource("a", path=SAMPLE), NmonSource("a", path=SAMPLE)],
+            run_id="0",
+            write=print,
+        )
+
+
+def test_multihost_follows_growing_file(tmp_path):
+    with open(SAMPLE) as f:
+        lines = [line.rstrip("\n") for line in f]
+    second = [i for i, line in enumerate(lines) if line.startswith("ZZZZ")][1]
+    path = tmp_path / "db1_230131_2148.nmon"
+    path.write_text("\n".join(lines[:second]) + "\n")
+
+    source = NmonSource.from_spec(
+        f"db1=follow:{tmp_path}/db1_*.nmon",
+        poll_interval=0.05,
+        settle=0.05,
+        idle_timeout=0.5,
+    )
+    assert source.follow and source.path.endswith("db1_*.nmon")
+    emitted = []
+    collector = MultiHostCollector(
+        [source],
+        run_id="0",
+        write=lambda entry: emitted.extend(render([entry])),
+        line_filter=prefix_filter,
+    )
+    runner = threading.Thread(target=collector.run, daemon=True)
+    runner.start()
+    # the first frame is parsed while nmon keeps writing
+    deadline = time.monotonic() + 5
+    while len(emitted) < 56 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(emitted) == 56
+    with open(path, "a") as f:
+        f.write("\n".join(lines[second:]) + "\n")
+    # stops once the file has not grown for the idle timeout
+    runner.join(timeout=10)
+    assert not runner.is_alive()
+    assert len(emitted) == 5 * 56
+    assert all(",host=db1" in line for line in emitted)
@@ -1,12 +1,14 @@
 import datetime
-from typing import Iterable, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import pytest
 import reactivex as rx
 import reactivex.operators as ops
 
-from src import TimestampTuple
+from src import Collector, TimestampTuple
+from src.encoder import render, render_samples
 from src.parsers import nmon_disk_metric_collector, nmon_mem_metric_collector
+from src.registry import FrameRecord, Samples, SeriesRegistry
 from src.scraper import NmonHeaderParser, WithListeners
 
 
@@ -22,6 +24,18 @@ def sample_nmon_output() -> Iterable[str]:
 class MockParser(WithListeners):
     def __init__(self) -> None:
         self.listeners = {}
+        self.registry = SeriesRegistry()
+
+
+def collect(
+    collector: Collector,
+    registry: SeriesRegistry,
+    line: str,
+    ts: Optional[TimestampTuple],
+) -> List[str]:
+    # fills a fresh record, returns its samples as line protocol
+    record = FrameRecord(registry, ts.ns if ts is not None else 0)
+    return render_samples(Samples(record, collector(line, ts, record)))
 
 
 def test_header_parser(sample_nmon_output: Iterable[str]):
@@ -36,6 +50,9 @@ def test_header_parser(sample_nmon_output: Iterable[str]):
         [f"CPU{x:#03}" for x in range(1, 13)]
         + ["CPU_ALL", "MEM"]
         + [f"DISK{x}" for x in ("READ", "WRITE", "BUSY")]
+        # sections parsed by the table-driven collector
+        + ["PROC", "NET", "NETPACKET", "DISKXFER", "DISKBSIZE", "JFSFILE"]
+        + ["VM"]
     )
 
     header_parser = NmonHeaderParser(
@@ -50,6 +67,9 @@ def test_header_parser(sample_nmon_output: Iterable[str]):
     ).subscribe()
 
     assert set(parser.listeners.keys()) == expected_listeners
+    # series of the collectors are registered once
+    assert "cpu-host,run=0,cpus=CPU_ALL" in parser.registry.ids
+    assert len(parser.registry) == len(set(parser.registry.keys))
 
 
 @pytest.fixture
@@ -58,27 +78,22 @@ def sample_memory_metrics():
         return f.read()
 
 
-def exhausted(i: Iterable[str]):
-    # check if given generator is empty
-    stub = object()
-    return next(iter(i), stub) is stub
-
-
 def test_mem_metric_parser(sample_memory_metrics: str):
     measurement, run_id = "test", "0"
-    parser = nmon_mem_metric_collector(measurement, run_id)
+    registry = SeriesRegistry()
+    parser = nmon_mem_metric_collector(registry, measurement, run_id)
 
     timestep = sample_memory_metrics.split(",")[0]
     date_info = datetime.datetime.today()
     time_info = TimestampTuple(timestep, date_info)
 
-    # parser should not yield if there was an error
-    assert exhausted(parser(sample_memory_metrics, None))
-    assert exhausted(parser("invalid", time_info))
-    assert not exhausted(parser(sample_memory_metrics, time_info))
+    # parser should not fill the record if there was an error
+    assert not collect(parser, registry, sample_memory_metrics, None)
+    assert not collect(parser, registry, "invalid", time_info)
 
-    # convert generator to list for easier inspection
-    lines_emitted = list(parser(sample_memory_metrics, time_info))
+    lines_emitted = collect(
+        parser, registry, sample_memory_metrics, time_info
+    )
 
     assert len(lines_emitted) == 1
     line = lines_emitted[0]
@@ -122,21 +137,124 @@ def test_disk_metric_parser(sample_disk_usage: Tuple[str, str]):
     time_info = TimestampTuple(timestep, date_info)
     disk_modes = {"r": "read", "w": "write", "b": "busy"}
 
+    registry = SeriesRegistry()
     for mode, parser in map(
         lambda m: (
             disk_modes[m],
-            nmon_disk_metric_collector("test", "000", disk_names, mode=m),
+            nmon_disk_metric_collector(
+                registry, "test", "000", disk_names, mode=m
+            ),
         ),
         disk_modes.keys(),
     ):
-        assert exhausted(parser(usage, None))
-        assert exhausted(parser("invalid-string", time_info))
-        assert not exhausted(parser(usage, time_info))
+        assert not collect(parser, registry, usage, None)
+        assert not collect(parser, registry, "invalid-string", time_info)
 
-        for disk, emit in zip(disk_names, parser(usage, time_info)):
+        emitted = collect(parser, registry, usage, time_info)
+        assert len(emitted) == len(disk_names)
+        for disk, emit in zip(disk_names, emitted):
             assert len(emit.split(" ")) == 3
             measurement, fields, ts = emit.split(" ")
             assert f"mode={mode}" in measurement
             assert f"disk={disk}" in measurement
             assert ts.isdigit()
             assert "value=" in fields
+
+
+def test_nmon_date_parser():
+    from src.scraper import parse_nmon_date
+
+    for encoded, expected in (
+        ("15:50:44,02-FEB-2023", "15:50:44 02-Feb-2023"),
+        ("00:00:00,31-DEC-1999", "00:00:00 31-Dec-1999"),
+        ("23:59:59,29-feb-2024", "23:59:59 29-Feb-2024"),
+    ):
+        assert parse_nmon_date(encoded) == datetime.datetime.strptime(
+            expected, "%H:%M:%S %d-%b-%Y"
+        )
+
+    for invalid in ("15:50,02-FEB-2023", "15:50:44,02-XYZ-2023", "T0001"):
+        with pytest.raises(ValueError):
+            parse_nmon_date(invalid)
+
+
+def test_timestamp_nanoseconds():
+    dt = datetime.datetime(
+        2023, 1, 31, 21, 48, 19, tzinfo=datetime.timezone.utc
+    )
+    ts = TimestampTuple("T0001", dt)
+    # exact integer value, no float rounding
+    assert ts.ns == 1675201699 * 10**9
+    assert TimestampTuple("T0001", dt, ns=1).ns == 1
+
+
+def test_section_collectors():
+    from src.parsers import nmon_section_collector
+
+    ts = TimestampTuple("T0001", datetime.datetime(2023, 1, 31), ns=1)
+    registry = SeriesRegistry()
+    net = nmon_section_collector(
+        registry, "net", "0", ["lo-read-KB/s", "eth0-read-KB/s", "eth0 write"]
+    )
+    assert collect(net, registry, "T0001,0.0,0.6,", ts) == [
+        "net,run=0 lo-read-KB/s=0.0,eth0-read-KB/s=0.6,eth0\\ write=0.0 1"
+    ]
+    assert collect(net, registry, "T0002,0.0,0.6,0.8", ts) == []
+    # rows shorter than the header fill the leading fields
+    assert collect(net, registry, "T0001,1.0", ts) == [
+        "net,run=0 lo-read-KB/s=1.0 1"
+    ]
+
+    xfer = nmon_section_collector(
+        registry, "disk", "0", ["sda", None, "sdc"], "disk", {"mode": "xfer"}
+    )
+    assert collect(xfer, registry, "T0001,1.0,2.0,3.0", ts) == [
+        "disk,run=0,mode=xfer,disk=sda value=1.0 1",
+        "disk,run=0,mode=xfer,disk=sdc value=3.0 1",
+    ]
+    # a series per column, filtered out ones are not registered
+    assert len(registry) == 3
+
+
+def test_late_section_header():
+    """
+    nmon writes VM header after the first timestamp,
+    the section should be registered once it appears
+    """
+    from src.pipeline import line_dispatcher
+
+    dispatch = line_dispatcher("0")
+    with open("testing/data/sample_nmon_output.csv") as f:
+        emitted = [
+            entry for line in f for entry in render(dispatch(line.rstrip()))
+        ]
+    vm = [entry for entry in emitted if entry.startswith("vm-perf-metrics")]
+    assert len(vm) == 5
+    assert vm[0].split(" ")[1].startswith("nr_dirty=717.0,nr_writeback=0.0,")
+
+
+def test_disk_fields_collector():
+    from src.encoder import FrameRows
+    from src.parsers import nmon_disk_fields_collector
+
+    ts = TimestampTuple("T0001", datetime.datetime(2023, 1, 31), ns=1)
+    registry = SeriesRegistry()
+    rows = FrameRows(("read", "write", "busy"))
+    read, write, busy = (
+        nmon_disk_fields_collector(
+            registry, "disk", "0", ["sda", None, "sdc"], m, rows
+        )
+        for m in "rwb"
+    )
+    # the three modes share series
+    assert len(registry) == 2
+    # nmon writes DISKBUSY first, the point is filled with the last row
+    record = FrameRecord(registry, ts.ns)
+    assert busy("T0001,4.7,0.0,1.0", ts, record) == ()
+    assert read("T0001,10.0,0.0,", ts, record) == ()
+    series = write("T0001,20.0,0.0,3.0", ts, record)
+    assert render_samples(Samples(record, series)) == [
+        "disk,run=0,disk=sda read=10.0,write=20.0,busy=4.7 1",
+        "disk,run=0,disk=sdc read=0.0,write=3.0,busy=1.0 1",
+    ]
+    assert not rows.pending
@@ -1,3 +1,4 @@
+import pytest
 import reactivex as rx
 import reactivex.operators as ops
 
@@ -37,3 +38,99 @@ def test_flat_map_syntax():
     ).subscribe(lambda x: got.append(x))
 
     assert got == expected
+
+
+def test_parsing_pipeline_is_deterministic():
+    """
+    pipeline output should match the sequential parser
+    line by line, regardless of the run
+    """
+    from src.encoder import render
+    from src.pipeline import nmon_parsing_pipeline
+    from src.scraper import NmonHeaderParser, NmonParser
+
+    with open("testing/data/sample_nmon_output.csv") as f:
+        lines = [line.rstrip("\n") for line in f]
+    # sections without collectors are filtered out beforehand (see main.py)
+    lines = [
+        line
+        for line in lines
+        if not line.startswith(
+            ("DISKBSIZE", "JFSFILE", "DISKXFER", "NET", "VM", "PROC")
+        )
+    ]
+
+    parser = NmonParser(timestamp_prefix="ZZZZ")
+    header_parser = NmonHeaderParser(parser, "perf-metrics", "0")
+    expected = []
+    for line in lines:
+        if not header_parser.registered_all:
+            header_parser.parse(line)
+            continue
+        expected.extend(parser.parse(line))
+
+    for _ in range(3):
+        got = []
+        nmon_parsing_pipeline(rx.from_iterable(lines), "0").subscribe(
+            got.append
+        )
+        assert render(got) == expected
+
+
+def test_bounded_buffer_backpressure():
+    import time
+
+    from src.client import bounded_buffer
+
+    produced = 0
+
+    def source():
+        nonlocal produced
+        for i in range(100):
+            produced += 1
+            yield str(i)
+
+    consumed = []
+    for line in bounded_buffer(source(), maxsize=4):
+        time.sleep(0.001)
+        consumed.append(line)
+        # reader may only run ahead by the queue size
+        # (plus one item it is blocked on)
+        assert produced - len(consumed) <= 5
+
+    assert consumed == [str(i) for i in range(100)]
+
+
+def test_reorder_buffer():
+    from src.frames import ReorderBuffer
+
+    buffer = ReorderBuffer()
+    assert buffer.push(1, "b") == []
+    assert buffer.push(2, "c") == []
+    assert buffer.push(0, "a") == ["a", "b", "c"]
+    assert buffer.push(3, "d") == ["d"]
+    assert len(buffer) == 0
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_pipeline_preserves_order(executor: str):
+    from src.encoder import render
+    from src.pipeline import nmon_parsing_pipeline
+
+    # all the sections, including VM (its header is within the first frame)
+    with open("testing/data/sample_nmon_output.csv") as f:
+        lines = [line.rstrip("\n") for line in f]
+
+    expected = []
+    nmon_parsing_pipeline(rx.from_iterable(lines), "0").subscribe(
+        expected.append
+    )
+    got, completed = [], []
+    nmon_parsing_pipeline(
+        rx.from_iterable(lines), "0", workers=3, executor=executor
+    ).subscribe(got.append, on_completed=lambda: completed.append(True))
+
+    assert completed
+    assert len(expected) > 0
+    # process workers send line protocol entries back
+    assert render(got) == render(expected)
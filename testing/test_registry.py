@@ -0,0 +1,119 @@
+import datetime
+import sys
+
+from src import TimestampTuple
+from src.cardinality import Deadband
+from src.encoder import render_samples, split_entry
+from src.pipeline import line_dispatcher
+from src.registry import FrameRecord, Samples, SeriesRegistry
+from src.scraper import NmonHeaderParser, NmonParser
+from src.synthetic import synthetic_nmon
+
+
+def test_register():
+    registry = SeriesRegistry()
+    key = "".join(["cpu,run=0,", "cpus=CPU_ALL"])
+    cpu = registry.register(key, ("user", "sys"))
+    disk = registry.register("disk,run=0,disk=sda", ("value",))
+    assert (cpu, disk) == (0, 1)
+    # known series keep their ids (and columns)
+    assert registry.register(key, ("user", "sys")) == cpu
+    assert registry.keys[cpu] is sys.intern(key)
+    assert registry.id("disk,run=0,disk=sda") == disk
+    assert registry.id("disk,run=0,disk=sdb") is None
+    assert list(registry.offsets) == [0, 2]
+    assert registry.columns == 3
+
+    record = FrameRecord(registry, ns=1)
+    assert len(record.values) == 3 and len(record.present) == 2
+    # series of a changed header get new columns
+    net = registry.register("net,run=0", ("lo", "eth0"))
+    assert registry.register("net,run=0", ("lo", "eth0", "eth1")) != net
+    record.grow()
+    assert len(record.values) == 8 and len(record.present) == 4
+
+
+def test_parser_fills_frame_records():
+    start = datetime.datetime(2023, 2, 2, 15, 50, 44)
+    parser = NmonParser(timestamp_prefix="ZZZZ")
+    header_parser = NmonHeaderParser(parser, "m", "0")
+    collected = [
+        samples
+        for line in synthetic_nmon(cpus=2, disks=2, intervals=2, start=start)
+        if not header_parser.parse(line)
+        for samples in [parser.collect(line)]
+        if samples is not None
+    ]
+    registry = parser.registry
+    # a record per frame, filled in place
+    records = {id(samples.record) for samples in collected}
+    assert len(records) == 2
+    entries = [e for samples in collected for e in render_samples(samples)]
+    for entry in entries:
+        key, fields, _ = split_entry(entry)
+        series = registry.id(key)
+        assert series is not None, key
+        # rows may be shorter than their section header
+        assert len(fields.split(",")) <= len(registry.fields[series])
+    # registered once, however many frames there are
+    assert len(registry) == len({split_entry(e)[0] for e in entries})
+
+
+def test_pipelines_have_own_registries():
+    lines = list(synthetic_nmon(cpus=2, disks=2, intervals=1))
+    records = []
+    for tags in ({"host": "db1"}, {"host": "db2"}):
+        dispatch = line_dispatcher("0", tags=tags)
+        records.extend(
+            samples.record for line in lines for samples in dispatch(line)
+        )
+    registries = {id(record.registry) for record in records}
+    assert len(registries) == 2
+    # a registry shared by dispatchers keeps the ids of series
+    shared = SeriesRegistry()
+    for _ in range(2):
+        dispatch = line_dispatcher("0", registry=shared)
+        for line in lines:
+            list(dispatch(line))
+    assert len(shared) == len(set(shared.keys))
+
+
+def test_deadband_samples():
+    registry = SeriesRegistry()
+    disk = registry.register("disk,run=0,disk=sda,mode=busy", ("value",))
+    band = Deadband(threshold=0.5, heartbeat=3)
+
+    def accept(values):
+        record = FrameRecord(registry)
+        series = []
+        for index, value in values.items():
+            offset = registry.offsets[index]
+            for column, field in enumerate(value, offset):
+                record.values[column] = field
+            record.present[index] = len(value)
+            series.append(index)
+        return list(band.accept_samples(Samples(record, series)))
+
+    accepted = [
+        accept({disk: [value]}) == [disk]
+        for value in [0.0, 0.0, 0.4, 0.0, 0.0, 2.0, 2.1]
+    ]
+    assert accepted == [True, False, False, True, False, True, False]
+    # series registered after the first sample
+    cpu = registry.register("cpu,run=0", ("user", "sys"))
+    assert accept({cpu: [1.0, 0.0], disk: [9.0]}) == [cpu, disk]
+    assert accept({cpu: [1.0, 0.2], disk: [9.0]}) == []
+    # a shorter row is always written
+    assert accept({cpu: [1.0]}) == [cpu]
+    assert accept({cpu: [1.0, 9.0]}) == [cpu]
+    # values are kept per registry, not per key
+    assert not band.series and list(band.records) == [registry]
+
+
+def test_timestamp_slots():
+    dt = datetime.datetime(2023, 1, 31, tzinfo=datetime.timezone.utc)
+    ts = TimestampTuple("T0001", dt)
+    assert not hasattr(ts, "__dict__")
+    assert ts.ns == 1675123200 * 10**9
+    assert ts == TimestampTuple("T0001", dt, ns=ts.ns)
+    assert ts != TimestampTuple("T0002", dt)
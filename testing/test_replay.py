@@ -0,0 +1,68 @@
+import datetime
+
+import pytest
+
+from main import prefix_filter
+from src.replay import Recording, run_load
+from src.scraper import parse_nmon_date
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+START = datetime.datetime(2024, 2, 29, 23, 59, 58)
+
+
+@pytest.fixture
+def recording() -> Recording:
+    with open(SAMPLE) as f:
+        return Recording.from_lines(f)
+
+
+def test_replay_shifts_timestamps(recording: Recording):
+    frames = list(recording.replay(START, loops=2))
+    assert len(frames) == 2 * 5
+    offsets = [offset for offset, _ in frames]
+    # the second loop follows the first one (1s interval)
+    assert offsets == [float(i) for i in range(10)]
+    times = [parse_nmon_date(lines[0].split(",", 2)[2]) for _, lines in frames]
+    assert times[0] == START
+    assert times[-1] == START + datetime.timedelta(seconds=9)
+    # records are kept as they were
+    assert frames[5][1][1:] == recording.frames[0][1:]
+
+
+def test_run_load(recording: Recording):
+    payloads = []
+    now = [0.0]
+
+    def sleep(seconds: float):
+        now[0] += seconds
+
+    report = run_load(
+        recording,
+        payloads.append,
+        "load",
+        hosts=3,
+        speedup=10,
+        start=START,
+        line_filter=prefix_filter,
+        clock=lambda: now[0],
+        sleep=sleep,
+    )
+    lines = [line for p in payloads for line in p.decode().split("\n")]
+    assert report.points_written == len(lines) == 3 * 5 * 56
+    assert report.frames == 3 * 5
+    assert report.points_dropped == report.points_failed == 0
+    # 5 frames at 10x speed
+    assert report.elapsed == pytest.approx(0.4)
+    assert {line.split(" ")[0].split(",")[1] for line in lines} == {
+        f"run=load-host{i:03}" for i in range(3)
+    }
+    assert report.as_dict()["write_latency"]["count"] == len(payloads)
+
+
+def test_run_load_counts_failures(recording: Recording):
+    def write(_: bytes):
+        raise ConnectionError("influx is down")
+
+    report = run_load(recording, write, "load", speedup=0)
+    assert report.points_written == 0
+    assert report.points_failed > 0
@@ -0,0 +1,84 @@
+import datetime
+
+import pytest
+import reactivex as rx
+
+from src.pipeline import nmon_parsing_pipeline
+from src.rollup import Rollup, parse_window, rollup
+from src.synthetic import synthetic_nmon
+from src.writer import BatchingWriter
+
+SECOND = 10**9
+
+
+def test_parse_window():
+    assert parse_window("10s") == 10 * SECOND
+    assert parse_window("1m") == 60 * SECOND
+    for invalid in ("0s", "10", "1d", "m"):
+        with pytest.raises(ValueError):
+            parse_window(invalid)
+
+
+def test_rollup_windows():
+    aggregates = Rollup(["10s"])
+    emitted = []
+    for second, value in enumerate([1.0, 3.0, 2.0] * 4):
+        emitted += aggregates.add(
+            f"cpu,run=0,cpus=CPU001 user={value},sys=0.0 {second * SECOND}"
+        )
+    # 12 samples: first window (0-9s) is complete, second is not
+    assert len(emitted) == 1
+    key, fields, timestamp = emitted[0].split(" ")
+    assert key == "cpu-10s,run=0,cpus=CPU001"
+    assert timestamp == "0"
+    fields = dict(f.split("=") for f in fields.split(","))
+    assert float(fields["user_mean"]) == pytest.approx(19 / 10)
+    assert fields["user_min"] == "1.0"
+    assert fields["user_max"] == "3.0"
+    assert fields["user_last"] == "1.0"
+    assert fields["sys_max"] == "0.0"
+
+    (rest,) = aggregates.flush()
+    assert rest.endswith(f" {10 * SECOND}")
+    assert "user_mean=2.5," in rest
+
+
+def test_rollup_operator():
+    lines = [
+        f"disk,run=0,disk=sd{d},mode=busy value={s} {s * SECOND}"
+        for s in range(120)
+        for d in "ab"
+    ]
+    raw, only = [], []
+    rx.from_iterable(lines).pipe(rollup(["1m"])).subscribe(raw.append)
+    rx.from_iterable(lines).pipe(rollup(["1m"], keep_raw=False)).subscribe(
+        only.append
+    )
+    assert len(only) == 2 * 2
+    assert all(line.startswith("disk-1m,") for line in only)
+    assert [line for line in raw if line.startswith("disk-1m,")] == only
+    assert len(raw) == len(lines) + len(only)
+
+
+def test_rollup_entries_are_batched():
+    """
+    windows completed within a frame are written as a block
+    (a request per window), not interleaved with raw entries
+    """
+    start = datetime.datetime(2023, 1, 31, tzinfo=datetime.timezone.utc)
+    lines = list(synthetic_nmon(cpus=4, disks=4, intervals=25, start=start))
+    payloads = []
+    with BatchingWriter(payloads.append, flush_interval=60) as writer:
+        nmon_parsing_pipeline(
+            rx.from_iterable(lines), "0", rollup_windows=["10s", "1m"]
+        ).subscribe(writer.write)
+
+    rollups = [p for p in payloads if b"-10s," in p or b"-1m," in p]
+    # 25 intervals, 10s windows completed at 10s and 20s,
+    # the last 10s and 1m windows are flushed at the end
+    assert len(payloads) == 25 + 4
+    assert len(rollups) == 4
+    for payload in rollups:
+        # each block holds a single window (start) only
+        timestamps = {line.rsplit(b" ", 1)[1] for line in payload.split(b"\n")}
+        assert len(timestamps) == 1
@@ -0,0 +1,64 @@
+from main import prefix_filter
+from src.multihost import MultiHostCollector, NmonSource
+from src.encoder import render
+from src.pipeline import line_dispatcher
+from src.schema import SchemaCache, cached_schema
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+
+
+def sample_lines():
+    with open(SAMPLE) as f:
+        return [line.rstrip("\n") for line in f if prefix_filter(line)]
+
+
+def parse(lines):
+    dispatch = line_dispatcher("0")
+    return [entry for line in lines for entry in render(dispatch(line))]
+
+
+def test_restart_resumes_from_next_frame(tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    lines = sample_lines()
+    expected = parse(lines)
+    # the first run persists the header (including VM,
+    # which nmon writes within the first frame)
+    assert list(cached_schema(lines, cache, "db1", "run")) == lines
+    headers = cache.load("db1", "run")
+    assert any(line.startswith("VM,Paging") for line in headers)
+
+    # the collector is restarted in the middle of the third frame
+    frames = [i for i, line in enumerate(lines) if line.startswith("ZZZZ")]
+    tail = lines[frames[2] + 3:]
+    resumed = parse(cached_schema(tail, cache, "db1", "run"))
+    assert resumed == expected[-len(resumed):]
+    assert resumed and resumed == parse(headers + lines[frames[3]:])
+
+    # without the cache the rest of the run is lost
+    assert parse(tail) == []
+    assert cache.load("db1", "other-run") == []
+
+
+def test_multihost_schema_cache(tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    lines = sample_lines()
+    truncated = tmp_path / "truncated.nmon"
+    frames = [i for i, line in enumerate(lines) if line.startswith("ZZZZ")]
+    truncated.write_text("\n".join(lines[frames[1] - 2:]) + "\n")
+
+    def collect(path):
+        emitted = []
+        MultiHostCollector(
+            [NmonSource("db1", path=str(path))],
+            run_id="0",
+            write=lambda entry: emitted.extend(render([entry])),
+            line_filter=prefix_filter,
+            schema_cache=cache,
+        ).run()
+        return emitted
+
+    full = collect(SAMPLE)
+    # starts with the tail of the first frame
+    resumed = collect(truncated)
+    assert len(resumed) == 4 * 56
+    assert resumed == full[-len(resumed):]
@@ -0,0 +1,137 @@
+import gzip
+import threading
+import time
+
+import pytest
+
+from src.encoder import render
+from src.pipeline import line_dispatcher
+from src.sinks import FanOut, ParquetSink, RotatingFileSink
+from src.writer import BatchingWriter
+
+SAMPLE = "testing/data/sample_nmon_output.csv"
+
+
+@pytest.fixture
+def sample_payloads():
+    dispatch = line_dispatcher("0", tags={"host": "db 1"})
+    with open(SAMPLE) as f:
+        entries = [
+            e for line in f for e in render(dispatch(line.rstrip("\n")))
+        ]
+    # a payload per interval, as the batching writer does
+    payloads = {}
+    for entry in entries:
+        payloads.setdefault(entry.rpartition(" ")[2], []).append(entry)
+    return ["\n".join(lines).encode() for lines in payloads.values()]
+
+
+def test_rotating_file_sink(tmp_path, sample_payloads):
+    with RotatingFileSink(str(tmp_path), max_bytes=2048) as sink:
+        for payload in sample_payloads:
+            sink(payload)
+    files = sorted(tmp_path.iterdir())
+    assert len(files) > 1
+    assert all(f.name.endswith(".lp.gz") for f in files)
+    restored = b"".join(gzip.decompress(f.read_bytes()) for f in files)
+    assert restored == b"".join(p + b"\n" for p in sample_payloads)
+
+    # numbering continues after the existing files
+    with RotatingFileSink(str(tmp_path), compression=None) as sink:
+        sink(sample_payloads[0])
+    assert (tmp_path / f"nmon-{len(files):06d}.lp").exists()
+
+
+def test_parquet_sink(tmp_path, sample_payloads):
+    pq = pytest.importorskip("pyarrow.parquet")
+    with ParquetSink(str(tmp_path), row_group_size=100) as sink:
+        for payload in sample_payloads:
+            sink(payload)
+
+    lines = b"\n".join(sample_payloads).decode().splitlines()
+    table = pq.read_table(tmp_path / "disk-perf-metrics")
+    assert table.num_rows == sum(line.startswith("disk-") for line in lines)
+    assert set(table.column_names) == {
+        "time",
+        "run",
+        "host",
+        "disk",
+        "mode",
+        "value",
+    }
+    assert str(table.schema.field("time").type) == "timestamp[ns]"
+    assert str(table.schema.field("value").type) == "double"
+    # tags are unescaped
+    assert set(table.column("host").to_pylist()) == {"db 1"}
+
+    cpu = pq.read_table(tmp_path / "cpu-perf-metrics")
+    assert cpu.num_rows == sum(line.startswith("cpu-") for line in lines)
+
+
+def test_fan_out_isolates_slow_sink(sample_payloads):
+    fast = []
+    slow = []
+    release = threading.Event()
+
+    def slow_sink(payload: bytes):
+        release.wait()
+        slow.append(payload)
+
+    payloads = sample_payloads * 4
+    fan_out = FanOut({"fast": fast.append, "slow": slow_sink}, max_pending=4)
+    try:
+        started = time.monotonic()
+        for payload in payloads:
+            fan_out(payload)
+            time.sleep(0.002)
+        # the stuck sink neither blocks the producer nor the other sink
+        assert time.monotonic() - started < 1
+        deadline = time.monotonic() + 5
+        while len(fast) < len(payloads) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        release.set()
+        fan_out.close()
+    assert fast == payloads
+    # the slow one gets the one it got stuck on and the newest ones
+    assert len(slow) == 5
+    assert slow[-4:] == payloads[-4:]
+
+
+def test_fan_out_acknowledgements(sample_payloads):
+    """
+    writer acknowledgements (e.g., backfill checkpoints) should only
+    be called once every sink has written the batches, and never
+    after a sink has lost one
+    """
+    written = []
+    acknowledged = []
+    release = threading.Event()
+
+    def slow_sink(payload: bytes):
+        release.wait()
+        written.append(payload)
+
+    def failing_sink(payload: bytes):
+        raise OSError("disk is full")
+
+    fan_out = FanOut({"fast": [].append, "slow": slow_sink})
+    with BatchingWriter(fan_out) as writer:
+        for line in sample_payloads[0].decode().splitlines():
+            writer.write(line)
+        writer.acknowledge(lambda: acknowledged.append(len(written)))
+        time.sleep(0.1)
+        # the slow sink has not written the batch yet
+        assert acknowledged == []
+        release.set()
+    fan_out.close()
+    assert acknowledged == [1]
+
+    fan_out = FanOut({"fast": [].append, "failing": failing_sink})
+    with BatchingWriter(fan_out) as writer:
+        for line in sample_payloads[0].decode().splitlines():
+            writer.write(line)
+        writer.acknowledge(lambda: acknowledged.append(-1))
+    fan_out.close()
+    assert fan_out.lost
+    assert acknowledged == [1]
@@ -0,0 +1,94 @@
+import os
+
+from influxdb_client import InfluxDBClient
+
+from src.spool import Spool, SpoolDrainer
+from src.writer import BatchingWriter, influx_http_write_function
+
+
+def test_spool_ack_and_restart(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=1 << 20)
+    payloads = [f"m value={i} {i}".encode() for i in range(10)]
+    for payload in payloads:
+        spool.append(payload)
+    # small segments: records are spread over several files
+    assert len(spool.segments) > 1
+
+    for expected in payloads[:4]:
+        segment, offset, payload = spool.peek()
+        assert payload == expected
+        spool.ack(segment, offset)
+    spool.close()
+
+    # unacknowledged records survive restart, a torn tail is dropped
+    last = os.path.join(str(tmp_path), "%012d.seg" % 100)
+    with open(last, "wb") as f:
+        f.write(b"\x10\x00")
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=1 << 20)
+    replayed = []
+    while (record := spool.peek()) is not None:
+        segment, offset, payload = record
+        replayed.append(payload)
+        spool.ack(segment, offset)
+    assert replayed == payloads[4:]
+    assert not spool.pending()
+    # acknowledged segments are removed
+    assert len(spool.segments) == 1
+
+
+def test_spool_corruption(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=1 << 20)
+    payloads = [f"m value={i} {i}".encode() for i in range(10)]
+    for payload in payloads:
+        spool.append(payload)
+    first = spool.segments[0]
+    spool.close()
+    # a flipped bit in the middle of the first segment
+    path = os.path.join(str(tmp_path), "%012d.seg" % first)
+    with open(path, "r+b") as f:
+        f.seek(-2, os.SEEK_END)
+        f.write(b"?")
+    # and a truncated acknowledgement file
+    with open(os.path.join(str(tmp_path), "ack.json"), "w") as f:
+        f.write('{"segment": ')
+
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=1 << 20)
+    replayed = []
+    with SpoolDrainer(spool, replayed.append):
+        pass
+    # the corrupted record is set aside, the rest is delivered
+    assert replayed == payloads[:2] + payloads[3:]
+    assert os.path.exists(f"{path}.corrupt")
+    assert not spool.pending()
+
+
+def test_spool_size_cap(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=100, max_bytes=300)
+    for i in range(100):
+        spool.append(b"x" * 40)
+    assert spool.size <= 300 + 100
+    assert spool.dropped_segments > 0
+
+
+def test_spool_delivers_after_failures(tmp_path, influx_stub):
+    """
+    influx rejects first writes, but every batch should be
+    delivered (in order) once it recovers
+    """
+    influx_stub.fail_requests = 3
+    spool = Spool(str(tmp_path))
+    lines = [f"m,t=a value={i} {i}" for i in range(20)]
+
+    with InfluxDBClient(url=influx_stub.url, token="-", org="-") as client:
+        write = influx_http_write_function(client, bucket="test")
+        drainer = SpoolDrainer(spool, write, retry_interval=0.01)
+        with drainer:
+            # every line has its own timestamp, thus its own batch
+            with BatchingWriter(spool.append) as writer:
+                for line in lines:
+                    writer.write(line)
+
+    assert influx_stub.failed == 3
+    assert drainer.failures == 3
+    assert influx_stub.lines == lines
+    assert not spool.pending()
@@ -0,0 +1,68 @@
+import datetime
+import json
+
+from src import TimestampTuple
+from src.parsers import nmon_mem_metric_collector
+from src.registry import FrameRecord, SeriesRegistry
+from src.stats import Distribution, Stats, StatsReporter, stats
+from src.writer import BatchingWriter
+
+
+def test_distribution_summary():
+    distribution = Distribution(size=100)
+    for value in range(1000):
+        distribution.add(value)
+    summary = distribution.summary()
+    # only the most recent samples are kept
+    assert summary["count"] == 1000
+    assert summary["max"] == 999
+    assert 900 <= summary["p50"] <= summary["p95"] <= summary["p99"]
+
+
+def test_stats_line_protocol():
+    registry = Stats()
+    registry.incr("lines_read", 3)
+    registry.gauge("queue_read", lambda: 7)
+    registry.observe("write_latency", 0.5)
+
+    line = registry.line_protocol(tags={"run": "0"}, ns=42)
+    key, fields, ns = line.split(" ")
+    assert key == "nmon-collector,run=0"
+    assert ns == "42"
+    fields = dict(field.split("=") for field in fields.split(","))
+    assert fields["lines_read"] == "3i"
+    assert fields["queue_read"] == "7.0"
+    assert fields["write_latency_p99"] == "0.5"
+
+
+def test_reporter_writes_and_dumps(tmp_path):
+    registry = Stats()
+    registry.incr("lines_read")
+    written = []
+    dump = tmp_path / "stats.json"
+    with StatsReporter(
+        written.append, interval=60, registry=registry, dump_path=str(dump)
+    ):
+        pass
+    assert len(written) == 1
+    assert written[0].startswith("nmon-collector ")
+    assert json.loads(dump.read_text()) == {"lines_read": 1}
+
+
+def test_stages_report_into_registry():
+    errors = stats.counters.get("parse_errors", 0)
+    written = stats.counters.get("lines_written", 0)
+
+    registry = SeriesRegistry()
+    parser = nmon_mem_metric_collector(registry, "test", "0")
+    record = FrameRecord(registry)
+    assert parser("T0001,x", None, record) == ()
+    ts = TimestampTuple("T0001", datetime.datetime.now())
+    assert parser("T0001,not-a-number", ts, record) == ()
+    assert stats.counters["parse_errors"] == errors + 1
+
+    with BatchingWriter(lambda _: None) as writer:
+        writer.write("m value=1 1")
+        writer.write("m value=2 2")
+    assert stats.counters["lines_written"] == written + 2
+    assert "write_latency_p50" in stats.snapshot()
@@ -0,0 +1,38 @@
+import datetime
+
+import reactivex as rx
+
+from main import prefix_filter
+from src.encoder import render
+from src.pipeline import nmon_parsing_pipeline
+from src.scraper import parse_nmon_date
+from src.synthetic import disk_name, synthetic_nmon
+
+
+def test_synthetic_output_is_parsed():
+    start = datetime.datetime(2023, 1, 31, 23, 59, 58)
+    lines = list(synthetic_nmon(cpus=4, disks=30, intervals=3, start=start))
+    assert lines == list(
+        synthetic_nmon(cpus=4, disks=30, intervals=3, start=start)
+    )
+
+    stamps = [line for line in lines if line.startswith("ZZZZ")]
+    assert [parse_nmon_date(s.split(",", 2)[2]) for s in stamps] == [
+        start + datetime.timedelta(seconds=i) for i in range(3)
+    ]
+
+    emitted = []
+    nmon_parsing_pipeline(
+        rx.from_iterable(filter(prefix_filter, lines)), "0"
+    ).subscribe(emitted.append)
+    # cores + average, memory, processes, network and 5 disk sections
+    assert len(render(emitted)) == 3 * (4 + 1 + 1 + 1 + 1 + 5 * 30)
+
+
+def test_disk_names():
+    assert [disk_name(i) for i in (0, 25, 26, 27)] == [
+        "sda",
+        "sdz",
+        "sdaa",
+        "sdab",
+    ]
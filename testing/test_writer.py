@@ -0,0 +1,121 @@
+import time
+from typing import List
+
+import pytest
+from influxdb_client import InfluxDBClient
+
+from src.scraper import NmonHeaderParser, NmonParser
+from src.writer import BatchingWriter, influx_http_write_function
+
+
+@pytest.fixture
+def sample_line_protocol() -> List[str]:
+    parser = NmonParser(timestamp_prefix="ZZZZ")
+    header_parser = NmonHeaderParser(parser, "test", "0")
+    lines = []
+    with open("testing/data/sample_nmon_output.csv", "r") as f:
+        for line in map(str.rstrip, f):
+            if not header_parser.registered_all:
+                header_parser.parse(line)
+                continue
+            lines.extend(parser.parse(line))
+    return lines
+
+
+def test_writer_batches_by_interval(influx_stub, sample_line_protocol):
+    """
+    each nmon interval (5 in the sample file) should
+    be sent to influx as a single request
+    """
+    with InfluxDBClient(url=influx_stub.url, token="-", org="-") as client:
+        write = influx_http_write_function(client, bucket="test")
+        with BatchingWriter(write, flush_interval=60) as writer:
+            for line in sample_line_protocol:
+                writer.write(line)
+
+    assert len(influx_stub.requests) == 5
+    assert influx_stub.lines == sample_line_protocol
+
+
+def test_writer_flushes_on_size(sample_line_protocol):
+    payloads = []
+    with BatchingWriter(payloads.append, batch_size=4, flush_interval=60) as w:
+        for line in sample_line_protocol[:8]:
+            w.write(line)
+        # both full batches are handed over before close
+        w.flush()
+
+    assert len(payloads) == 2
+    assert all(len(p.splitlines()) == 4 for p in payloads)
+
+
+def test_writer_flushes_on_timeout(sample_line_protocol):
+    payloads = []
+    with BatchingWriter(payloads.append, flush_interval=0.05) as writer:
+        writer.write(sample_line_protocol[0])
+        deadline = time.monotonic() + 2
+        while not payloads and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(payloads) == 1
+
+
+def test_writer_acknowledgements(sample_line_protocol):
+    events = []
+
+    def write(payload: bytes):
+        if b"fail" in payload:
+            raise ConnectionError("unavailable")
+        events.append(len(payload.splitlines()))
+
+    with BatchingWriter(write, batch_size=4, flush_interval=60) as writer:
+        for line in sample_line_protocol[:6]:
+            writer.write(line)
+        # called after the pending lines are sent
+        writer.acknowledge(lambda: events.append("ack"))
+        writer.write("fail 0")
+        # lost lines are never acknowledged
+        writer.acknowledge(lambda: events.append("lost"))
+        writer.write(sample_line_protocol[6])
+        writer.acknowledge(lambda: events.append("later"))
+
+    assert events == [4, 2, "ack", 1]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_compressed_writes(influx_stub, sample_line_protocol, compression):
+    from src.stats import stats
+
+    before = stats.snapshot()
+    with InfluxDBClient(url=influx_stub.url, token="-", org="-") as client:
+        write = influx_http_write_function(
+            client, "test", compression=compression, level=9
+        )
+        with BatchingWriter(write, flush_interval=60) as writer:
+            for line in sample_line_protocol:
+                writer.write(line)
+
+    assert influx_stub.lines == sample_line_protocol
+    encodings = {encoding for encoding, _ in influx_stub.received}
+    assert encodings == {compression or "identity"}
+
+    after = stats.snapshot()
+    raw = after["bytes_raw"] - before.get("bytes_raw", 0)
+    sent = after["bytes_sent"] - before.get("bytes_sent", 0)
+    assert sent == sum(size for _, size in influx_stub.received)
+    if compression:
+        # repeated series keys compress well
+        assert sent * 5 < raw
+    else:
+        assert sent == raw
+
+
+def test_compressor_levels():
+    from src.writer import compressor, decompress
+
+    payload = b"cpu,run=0 user=1.0 1\n" * 100
+    fast, best = compressor("gzip", 1), compressor("gzip", 9)
+    assert decompress("gzip", best(payload)) == payload
+    assert len(best(payload)) <= len(fast(payload))
+    for codec, level in (("lz4", None), ("gzip", 10)):
+        with pytest.raises(ValueError):
+            compressor(codec, level)